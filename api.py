@@ -0,0 +1,179 @@
+"""
+HTTP API for driving exam generation from other systems (e.g. an LMS).
+
+Run with a single server process; concurrency comes from the job worker
+pool (EXAM_GEN_API_WORKERS) inside it:
+    uvicorn api:app --host 0.0.0.0 --port 8000
+
+For local testing without a Gemini API key, use the offline fake LLM:
+    EXAM_GEN_FAKE_LLM=1 uvicorn api:app --port 8000
+
+Every request may carry an X-Tenant-ID header; jobs are scheduled fairly
+across tenants and only visible to the tenant that submitted them, and a
+document set only to the tenants that uploaded it.
+"""
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, File, Form, Header, HTTPException, Request, UploadFile
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
+
+from src.llm_handler import configure_llm
+from src.pdf_generator import create_pdf, create_pdf_bundle
+from src.pipeline import MARK_LEVELS, VARIANT_LABELS
+from src.service import ExamService, FINISHED_STATES
+from src.startup import start_background_warmup, get_warmup_status
+from src.topic_modeler import TOPIC_MODES
+
+FAKE_LLM = os.getenv("EXAM_GEN_FAKE_LLM") == "1"
+EVENT_POLL_SECONDS = 0.5  # How often the progress stream checks for job updates
+
+class ExamRequest(BaseModel):
+    document_set_id: str
+    structure: Dict[int, int] = Field(..., description="Number of questions per mark value, e.g. {\"1\": 10, \"5\": 2}.")
+    batch_size: int = Field(4, ge=1, le=8)
+    max_workers: int = Field(4, ge=1, le=8)
+    fresh: bool = False
+    variants: int = Field(1, ge=1, le=len(VARIANT_LABELS), description="Paper variants (sets A, B, ...) without shared questions.")
+
+@asynccontextmanager
+async def lifespan(app):
+    if FAKE_LLM:
+        from benchmarks.fake_llm import install_fake_llm
+        install_fake_llm(latency=float(os.getenv("EXAM_GEN_FAKE_LLM_LATENCY", "0.05")),
+                         error_rate=float(os.getenv("EXAM_GEN_FAKE_LLM_ERROR_RATE", "0")))
+    else:
+        configure_llm()
+    app.state.service = ExamService()
+    start_background_warmup()
+    yield
+
+app = FastAPI(title="Exam-Gen API", lifespan=lifespan)
+
+def _get_job_or_404(request, job_id, tenant):
+    job = request.app.state.service.get_job(job_id, tenant)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+def _get_finished_exam(request, job_id, tenant):
+    job = _get_job_or_404(request, job_id, tenant)
+    if job["kind"] != "exam" or job["status"] != "complete":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}; PDFs are available once an exam job is complete.")
+    return job
+
+def _variant_documents(variant):
+    """The (file name, title, content) of a variant's question paper and answer key, see create_pdf_bundle."""
+    suffix = f" (Set {variant['label']})" if variant["label"] else ""
+    file_suffix = f"_Set_{variant['label']}" if variant["label"] else ""
+    return [(f"Question_Paper{file_suffix}.pdf", f"Question Paper{suffix}", variant["question_paper"]),
+            (f"Answer_Key{file_suffix}.pdf", f"Answer Key{suffix}", variant["answer_key"])]
+
+# --- DOCUMENT SETS ---
+
+@app.post("/document-sets", status_code=202)
+def upload_documents(request: Request, files: List[UploadFile] = File(...), topic_mode: str = Form("auto"),
+                     x_tenant_id: str = Header("default")):
+    """Uploads PDFs and starts their ingestion. Returns the document set id and the ingestion job."""
+    if topic_mode not in TOPIC_MODES:
+        raise HTTPException(status_code=422, detail=f"topic_mode must be one of {TOPIC_MODES}.")
+    uploads = [(f.filename, f.file.read()) for f in files]
+    set_id, job = request.app.state.service.submit_ingestion(x_tenant_id, uploads, topic_mode)
+    return {"document_set_id": set_id, "job_id": job["id"]}
+
+@app.get("/document-sets/{set_id}")
+def get_document_set(request: Request, set_id: str, x_tenant_id: str = Header("default")):
+    document_set = request.app.state.service.get_document_set(set_id, x_tenant_id)
+    if document_set is None:
+        raise HTTPException(status_code=404, detail="Document set not found. Upload the documents first.")
+    return document_set
+
+# --- EXAM JOBS ---
+
+@app.post("/exams", status_code=202)
+def submit_exam(request: Request, exam: ExamRequest, x_tenant_id: str = Header("default")):
+    """Queues an exam generation job. Returns the job id to poll."""
+    unsupported = [marks for marks in exam.structure if marks not in MARK_LEVELS]
+    if unsupported:
+        raise HTTPException(status_code=422, detail=f"Unsupported mark values {unsupported}; choose from {sorted(MARK_LEVELS)}.")
+    try:
+        job = request.app.state.service.submit_exam(
+            x_tenant_id, exam.document_set_id, exam.structure,
+            batch_size=exam.batch_size, max_workers=exam.max_workers, fresh=exam.fresh,
+            num_variants=exam.variants)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Document set not found. Upload the documents first.")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"job_id": job["id"]}
+
+@app.get("/jobs/{job_id}")
+def get_job(request: Request, job_id: str, x_tenant_id: str = Header("default")):
+    """Returns the job status and progress, and the questions once complete."""
+    return _get_job_or_404(request, job_id, x_tenant_id)
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job(request: Request, job_id: str, x_tenant_id: str = Header("default")):
+    """Streams job snapshots as Server-Sent Events until the job finishes."""
+    _get_job_or_404(request, job_id, x_tenant_id)
+    service = request.app.state.service
+
+    async def events():
+        last_update = None
+        while True:
+            job = service.get_job(job_id, x_tenant_id)
+            if job is None:
+                return
+            if job["updated"] != last_update:
+                last_update = job["updated"]
+                yield f"data: {json.dumps(job)}\n\n"
+            if job["status"] in FINISHED_STATES or await request.is_disconnected():
+                return
+            await asyncio.sleep(EVENT_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(request: Request, job_id: str, x_tenant_id: str = Header("default")):
+    if not request.app.state.service.cancel_job(job_id, x_tenant_id):
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return _get_job_or_404(request, job_id, x_tenant_id)
+
+@app.get("/jobs/{job_id}/papers.zip")
+def download_all_pdfs(request: Request, job_id: str, x_tenant_id: str = Header("default")):
+    """Renders the question papers and answer keys of all variants in one pass and returns them as a zip."""
+    job = _get_finished_exam(request, job_id, x_tenant_id)
+    documents = [document for variant in job["result"]["variants"] for document in _variant_documents(variant)]
+    _, archive = create_pdf_bundle(documents)
+    return Response(archive, media_type="application/zip",
+                    headers={"Content-Disposition": 'attachment; filename="Exam_Papers.zip"'})
+
+@app.get("/jobs/{job_id}/{document}.pdf")
+def download_pdf(request: Request, job_id: str, document: str, variant: Optional[str] = None,
+                 x_tenant_id: str = Header("default")):
+    """
+    Renders (once, then from the PDF cache) the question paper or answer key
+    of a finished exam; pass ?variant=B for another set than the first.
+    """
+    documents = {"question-paper": 0, "answer-key": 1}
+    if document not in documents:
+        raise HTTPException(status_code=404, detail="Use question-paper.pdf or answer-key.pdf.")
+    job = _get_finished_exam(request, job_id, x_tenant_id)
+    variants = job["result"]["variants"]
+    selected = variants[0] if variant is None else next((v for v in variants if v["label"] == variant), None)
+    if selected is None:
+        raise HTTPException(status_code=404, detail=f"Unknown variant; this exam has {[v['label'] for v in variants]}.")
+    file_name, title, content = _variant_documents(selected)[documents[document]]
+    return Response(
+        create_pdf(title, content), media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"'}
+    )
+
+@app.get("/health")
+def health(request: Request):
+    service = request.app.state.service
+    return {"status": "ok", "queued_jobs": len(service.queue), "warmup": get_warmup_status()}
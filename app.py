@@ -1,15 +1,19 @@
-import streamlit as st
 import time
-from dotenv import load_dotenv
+from contextlib import closing
+
+SCRIPT_START = time.perf_counter()  # Measures the cost of every script run (rerun)
+
+import streamlit as st
 
 # Import your custom modules
-from src.document_processor import get_pdf_text, get_text_chunks
-from src.embedding_handler import create_embeddings
-from src.vector_store import create_vector_store
-from src.llm_handler import configure_llm, generate_question_from_context
-from src.uniqueness_filter import select_unique_questions
-from src.topic_modeler import get_document_topics
-from src.pdf_generator import create_pdf
+from src.pipeline import (ingest_documents, build_exam_structure, select_paper_questions, select_variant_questions,
+                          format_exam, VARIANT_LABELS)
+from src.topic_modeler import TOPIC_MODES
+from src.llm_handler import configure_llm
+from src.generation_scheduler import plan_generation_tasks, run_generation_plan, group_results_by_marks
+from src.pdf_generator import create_pdf_bundle, pdf_cache_key
+from src.instrumentation import start_run, get_records, summarize_records, records_to_jsonl
+from src.startup import start_background_warmup, get_warmup_status
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
@@ -19,21 +23,66 @@ st.set_page_config(
 )
 
 # --- LOAD API KEY AND CONFIGURE LLM ---
-try:
-    load_dotenv()
+@st.cache_resource(show_spinner=False)
+def init_llm():
+    """Configures the Gemini client once per server process instead of on every rerun."""
     configure_llm()
+    return True
+
+try:
+    init_llm()
 except ValueError as e:
     st.error(f"⚠️ API Key Configuration Error: {e}")
     st.stop()
 
+# --- WARM UP MODELS ---
+@st.cache_resource(show_spinner=False)
+def start_model_warmup():
+    """Starts loading the embedding model and heavy libraries in the background, once per server process."""
+    return start_background_warmup()
+
+start_model_warmup()
+
 # --- HELPER FUNCTION TO RESET STATE ---
 def reset_session_state():
     """Clears the generated content from the session state."""
-    for key in ['vector_store', 'question_paper', 'answer_key', 'topics']:
+    for key in ['vector_store', 'question_paper', 'answer_key', 'variants', 'paper_stats', 'topics', 'topic_index', 'generation', 'trace_run_id', 'pdf_files']:
         if key in st.session_state:
             del st.session_state[key]
     st.success("Session cleared! Ready for a new exam.")
 
+def update_paper(generation):
+    """
+    Selects the final questions of every completed mark bucket and stores the
+    (possibly partial) paper in the session state, so it is shown right away
+    and survives reruns. With several variants, every variant is stored and
+    the first one is also the paper shown in the previews.
+    """
+    tasks_by_index = {task["index"]: task for task in generation["tasks"]}
+    results = [(tasks_by_index[index], q_data) for index, q_data in generation["results"].items()]
+    completed_structure = {
+        marks: config for marks, config in generation["exam_structure"].items()
+        if marks in generation["completed_marks"]
+    }
+    num_variants = generation.get("num_variants", 1)
+    st.session_state.paper_stats = {}
+    if num_variants > 1:
+        variants = select_variant_questions(results, completed_structure, num_variants,
+                                            stats=st.session_state.paper_stats)
+        st.session_state.variants = [(VARIANT_LABELS[i], *format_exam(selected)) for i, selected in enumerate(variants)]
+        _, st.session_state.question_paper, st.session_state.answer_key = st.session_state.variants[0]
+    else:
+        st.session_state.pop("variants", None)
+        selected = select_paper_questions(group_results_by_marks(results), completed_structure,
+                                          stats=st.session_state.paper_stats)
+        st.session_state.question_paper, st.session_state.answer_key = format_exam(selected)
+
+# --- GENERATION STATE ---
+# A generation that is still marked as running was interrupted by a rerun
+# (the Stop button or any widget change); its finished questions are kept.
+if st.session_state.get("generation", {}).get("status") == "running":
+    st.session_state.generation["status"] = "paused"
+
 # --- SIDEBAR - THE CONTROL PANEL ---
 with st.sidebar:
     st.header("⚙️ Control Panel")
@@ -63,12 +112,49 @@ with st.sidebar:
         num_4_markers = st.number_input("4-Mark Questions", min_value=0, step=1)
         num_5_markers = st.number_input("5-Mark Questions", min_value=0, step=1)
         num_10_markers = st.number_input("10-Mark Questions", min_value=0, step=1)
+        num_variants = st.number_input(
+            "Paper Variants (Sets)", min_value=1, max_value=len(VARIANT_LABELS), value=1, step=1,
+            help="Equivalent papers (Set A, B, ...) with the same structure and no shared questions, "
+                 "drawn from one shared pool of generated questions."
+        )
+
+    with st.expander("Generation Settings"):
+        max_workers = st.slider("Concurrent LLM Requests", min_value=1, max_value=8, value=4)
+        requests_per_minute = st.number_input(
+            "Requests per Minute", min_value=1, value=15, step=1,
+            help="Should match the rate limit of your Gemini API plan."
+        )
+        batch_size = st.slider(
+            "Questions per LLM Request", min_value=1, max_value=8, value=4,
+            help="Questions of the same mark value are requested together to save API calls."
+        )
+        topic_mode = st.selectbox(
+            "Topic Modeling Mode", options=list(TOPIC_MODES),
+            help="'auto' uses full BERTopic for small uploads and the fast clustering fallback for large ones. "
+                 "'online' updates the saved model incrementally when you add PDFs to an uploaded set."
+        )
+        fresh_generation = st.checkbox(
+            "Force Fresh Questions", value=False,
+            help="Ignore previously cached LLM responses to get new variations."
+        )
 
     st.markdown("---")
     
     # 3. Generate Button
     st.subheader("3. Generate Exam")
     generate_button = st.button("✨ Generate Now!", use_container_width=True)
+
+    resume_button = False
+    generation = st.session_state.get("generation")
+    if generation is not None and generation["status"] == "paused":
+        st.info(f"⏸️ Generation paused with {len(generation['results'])} of "
+                f"{len(generation['tasks'])} candidate questions done.")
+        resume_button = st.button("▶️ Resume Generation", use_container_width=True)
+    if generate_button or resume_button:
+        st.button(
+            "⏹️ Stop Generation", use_container_width=True,
+            help="Stops after the requests already in flight. Finished questions are kept and you can resume later."
+        )
     
     st.markdown("---")
     
@@ -76,6 +162,14 @@ with st.sidebar:
     if st.button("🔄 Start Over", use_container_width=True):
         reset_session_state()
 
+    warmup_status = get_warmup_status()
+    if warmup_status["state"] == "ready":
+        st.caption(f"🟢 Models ready (warmed up in {warmup_status['total_s']:.1f}s)")
+    elif warmup_status["state"] == "warming":
+        st.caption("🟡 Loading models in the background...")
+    elif warmup_status["state"] == "error":
+        st.caption(f"🔴 Model warmup failed: {warmup_status['error']}")
+
 # --- MAIN PAGE ---
 st.title("📝 Exam-Gen ✨")
 st.markdown("Your intelligent assistant for creating well-balanced exam papers in minutes.")
@@ -98,6 +192,9 @@ if "question_paper" not in st.session_state or not st.session_state.question_pap
     
 
 # --- PROCESSING LOGIC ---
+if generate_button or resume_button:
+    st.session_state.trace_run_id = start_run()
+
 if generate_button:
     if not uploaded_files:
         st.warning("Please upload at least one PDF document to begin.")
@@ -106,18 +203,10 @@ if generate_button:
         with st.status("🚀 Processing your documents...", expanded=True) as status:
             if "vector_store" not in st.session_state:
                 try:
-                    status.write("Reading and chunking text...")
-                    all_raw_text = "".join([get_pdf_text(pdf) for pdf in uploaded_files])
-                    text_chunks = get_text_chunks(all_raw_text)
-                    
-                    status.write("Identifying main topics...")
-                    st.session_state.topics = get_document_topics(text_chunks)
-                    
-                    status.write("Creating text embeddings...")
-                    embeddings = create_embeddings(text_chunks)
-                    
-                    status.write("Building the vector knowledge base...")
-                    st.session_state.vector_store = create_vector_store(text_chunks, embeddings)
+                    ingestion = ingest_documents(uploaded_files, progress=status.write, topic_mode=topic_mode)
+                    st.session_state.topics = ingestion["topics"]
+                    st.session_state.vector_store = ingestion["collection"]
+                    st.session_state.topic_index = ingestion["topic_index"]
                     status.update(label="✅ Processing Complete!", state="complete")
                     
                 except Exception as e:
@@ -126,80 +215,176 @@ if generate_button:
             else:
                 status.update(label="✅ Documents already processed!", state="complete")
 
-        # Question Generation
+        # Plan a new generation; results are filled in as questions complete
         if "vector_store" in st.session_state:
-            with st.spinner("🧠 Generating a diverse set of questions... This might take a moment."):
-                # ... (The entire question generation logic remains the same)
-                question_paper = []
-                answer_key = []
-                exam_structure = {
-                    1: (num_1_markers, "very easy", "a key-term definition", 2),
-                    2: (num_2_markers, "easy", "a simple definition or concept", 3),
-                    3: (num_3_markers, "short answer", "a concept with an example", 3),
-                    4: (num_4_markers, "medium", "an explanation of a process", 2),
-                    5: (num_5_markers, "long answer", "an application or comparison", 2),
-                    10: (num_10_markers, "essay", "a detailed analysis or synthesis", 1),
-                }
-                try:
-                    topics = st.session_state.topics
-                    total_questions_generated = 0
-                    for marks, config in exam_structure.items():
-                        count, difficulty, topic_base, over_gen_count = config
-                        if count > 0:
-                            over_generated_pool = []
-                            for i in range(count + over_gen_count):
-                                current_topic = topics[total_questions_generated % len(topics)]
-                                topic_query = f"{topic_base} related to '{current_topic}'"
-                                q_data = generate_question_from_context(
-                                    st.session_state.vector_store, marks, difficulty, topic_query)
-                                over_generated_pool.append(q_data)
-                                total_questions_generated += 1
-                                time.sleep(2)
-                            unique_questions = select_unique_questions(over_generated_pool, count)
-                            for q_data in unique_questions:
-                                question_paper.append(f"**Q{len(question_paper) + 1}.** {q_data['question']} ({marks} Marks)")
-                                answer_key.append(f"**A{len(answer_key) + 1}.** {q_data['answer']}")
-                    st.session_state.question_paper = question_paper
-                    st.session_state.answer_key = answer_key
-                    st.success("🎉 Question paper generated successfully!")
-                except Exception as e:
-                    st.error(f"An error occurred during question generation: {e}")
+            exam_structure = build_exam_structure({
+                1: num_1_markers,
+                2: num_2_markers,
+                3: num_3_markers,
+                4: num_4_markers,
+                5: num_5_markers,
+                10: num_10_markers,
+            })
+            st.session_state.generation = {
+                "exam_structure": exam_structure,
+                "tasks": plan_generation_tasks(exam_structure, st.session_state.topics, num_variants),
+                "num_variants": num_variants,
+                "results": {},  # Plan index -> question data
+                "completed_marks": [],
+                "status": "running",
+            }
+            st.session_state.question_paper, st.session_state.answer_key = [], []
+            st.session_state.pop("variants", None)
+
+elif resume_button:
+    st.session_state.generation["status"] = "running"
+
+# Question Generation
+generation = st.session_state.get("generation")
+if generation is not None and generation["status"] == "running" and "vector_store" in st.session_state:
+    st.subheader("🧠 Generating Questions")
+    totals, done = {}, {}
+    for task in generation["tasks"]:
+        totals[task["marks"]] = totals.get(task["marks"], 0) + 1
+        done[task["marks"]] = done.get(task["marks"], 0) + (task["index"] in generation["results"])
+    bucket_bars = {
+        marks: st.progress(done[marks] / totals[marks], text=f"{marks}-Mark Questions: {done[marks]} of {totals[marks]} candidates")
+        for marks in totals
+    }
+    # Buckets finished just before an interruption may not have been selected yet
+    finished = [marks for marks in totals if done[marks] == totals[marks] and marks not in generation["completed_marks"]]
+    if finished:
+        generation["completed_marks"].extend(finished)
+        update_paper(generation)
+    live_feed = st.empty()
+    paper_preview = st.empty()
+    remaining = [task for task in generation["tasks"] if task["index"] not in generation["results"]]
+    try:
+        with closing(run_generation_plan(
+                st.session_state.vector_store, remaining,
+                max_workers=max_workers, requests_per_minute=requests_per_minute,
+                batch_size=batch_size, fresh=fresh_generation,
+                topic_index=st.session_state.get("topic_index"))) as stream:
+            for task, q_data in stream:
+                marks = task["marks"]
+                generation["results"][task["index"]] = q_data
+                done[marks] += 1
+                bucket_bars[marks].progress(
+                    done[marks] / totals[marks],
+                    text=f"{marks}-Mark Questions: {done[marks]} of {totals[marks]} candidates")
+                live_feed.markdown(f"*Latest ({marks} Marks):* {q_data['question']}")
+                if done[marks] == totals[marks]:
+                    # This bucket is final: select its questions and show the paper so far
+                    generation["completed_marks"].append(marks)
+                    update_paper(generation)
+                    with paper_preview.container():
+                        for question in st.session_state.question_paper:
+                            st.markdown(question)
+        generation["status"] = "complete"
+        live_feed.empty()
+        paper_preview.empty()
+        cache_hits = sum(1 for q_data in generation["results"].values() if q_data.get("cached"))
+        if cache_hits:
+            st.info(f"♻️ Reused {cache_hits} of {len(generation['results'])} generations from the response cache.")
+        st.success("🎉 Question paper generated successfully!")
+    except Exception as e:
+        generation["status"] = "paused"
+        st.error(f"An error occurred during question generation: {e}. "
+                 "Finished questions were kept; use 'Resume Generation' to continue.")
 
 # --- DISPLAY RESULTS USING TABS ---
 if "question_paper" in st.session_state and st.session_state.question_paper:
     st.markdown("---")
     st.header("Your Generated Exam 📄")
+    generation = st.session_state.get("generation")
+    if generation is not None and generation["status"] != "complete":
+        st.warning(f"⏸️ Partial paper: {len(generation['completed_marks'])} of "
+                   f"{len(set(task['marks'] for task in generation['tasks']))} mark sections are complete. "
+                   "Use 'Resume Generation' in the sidebar to finish it.")
+    shortfall = st.session_state.get("paper_stats", {}).get("shortfall")
+    if shortfall:
+        missing = ", ".join(f"{count} × {marks}-mark" for marks, count in sorted(shortfall.items()))
+        failed = st.session_state.paper_stats.get("failed_questions", 0)
+        reason = f"{failed} generations failed, and " if failed else ""
+        st.warning(f"⚠️ The paper is missing {missing} questions: {reason}too few distinct questions "
+                   "were left to fill it. Generate again to retry.")
     
     # Create tabs for clean output
     download_tab, qp_tab, ak_tab = st.tabs(["📥 Download", "📝 Question Paper (Preview)", "🔑 Answer Key (Preview)"])
 
+    # A single paper is one unlabeled variant
+    variants = st.session_state.get("variants") or [("", st.session_state.question_paper, st.session_state.answer_key)]
+
     with download_tab:
         st.subheader("Download Your Files")
-        question_pdf_bytes = create_pdf("Question Paper", st.session_state.question_paper)
-        answer_pdf_bytes = create_pdf("Answer Key", st.session_state.answer_key)
-
-        col1, col2 = st.columns(2)
-        with col1:
-            st.download_button(
-                label="Download Question Paper",
-                data=question_pdf_bytes,
-                file_name="Question_Paper.pdf",
-                mime="application/pdf",
-                use_container_width=True
-            )
-        with col2:
-            st.download_button(
-                label="Download Answer Key",
-                data=answer_pdf_bytes,
-                file_name="Answer_Key.pdf",
-                mime="application/pdf",
-                use_container_width=True
-            )
+        documents = []
+        for label, question_paper, answer_key in variants:
+            suffix = f" (Set {label})" if label else ""
+            file_suffix = f"_Set_{label}" if label else ""
+            documents.append((f"Question_Paper{file_suffix}.pdf", f"Question Paper{suffix}", question_paper))
+            documents.append((f"Answer_Key{file_suffix}.pdf", f"Answer Key{suffix}", answer_key))
+
+        # PDFs are only rendered on request, all variants in one pass, and not on every rerun
+        paper_key = tuple(pdf_cache_key(title, content) for _, title, content in documents)
+        if st.session_state.get("pdf_files", {}).get("key") != paper_key:
+            if st.button("📄 Prepare PDF Downloads", use_container_width=True):
+                with st.spinner("Rendering PDFs..."):
+                    pdfs, archive = create_pdf_bundle(documents)
+                    st.session_state.pdf_files = {"key": paper_key, "pdfs": pdfs, "zip": archive}
+
+        if st.session_state.get("pdf_files", {}).get("key") == paper_key:
+            pdfs = st.session_state.pdf_files["pdfs"]
+            for question_document, answer_document in zip(documents[::2], documents[1::2]):
+                col1, col2 = st.columns(2)
+                for col, (file_name, title, _) in ((col1, question_document), (col2, answer_document)):
+                    with col:
+                        st.download_button(
+                            label=f"Download {title}",
+                            data=pdfs[file_name],
+                            file_name=file_name,
+                            mime="application/pdf",
+                            use_container_width=True
+                        )
+            if len(variants) > 1:
+                st.download_button(
+                    label="Download All Variants (ZIP)",
+                    data=st.session_state.pdf_files["zip"],
+                    file_name="Exam_Variants.zip",
+                    mime="application/zip",
+                    use_container_width=True
+                )
 
     with qp_tab:
-        for question in st.session_state.question_paper:
-            st.markdown(question)
+        variant_tabs = st.tabs([f"Set {label}" for label, _, _ in variants]) if len(variants) > 1 else [st.container()]
+        for variant_tab, (_, question_paper, _) in zip(variant_tabs, variants):
+            with variant_tab:
+                for question in question_paper:
+                    st.markdown(question)
 
     with ak_tab:
-        for answer in st.session_state.answer_key:
-            st.markdown(answer)
\ No newline at end of file
+        variant_tabs = st.tabs([f"Set {label}" for label, _, _ in variants]) if len(variants) > 1 else [st.container()]
+        for variant_tab, (_, _, answer_key) in zip(variant_tabs, variants):
+            with variant_tab:
+                for answer in answer_key:
+                    st.markdown(answer)
+
+# --- DIAGNOSTICS PANEL ---
+with st.expander("🔬 Diagnostics: where did the time go?"):
+    warmup_status = get_warmup_status()
+    st.caption(f"This script run took {(time.perf_counter() - SCRIPT_START) * 1000:.0f} ms. "
+               f"Model warmup: {warmup_status['state']}.")
+    if warmup_status["steps"]:
+        st.dataframe(
+            [{"startup step": step, "seconds": seconds} for step, seconds in warmup_status["steps"].items()],
+            use_container_width=True
+        )
+
+    trace_records = get_records(st.session_state.trace_run_id) if "trace_run_id" in st.session_state else []
+    if trace_records:
+        st.dataframe(summarize_records(trace_records), use_container_width=True)
+        st.download_button(
+            label="Download Trace (JSON Lines)",
+            data=records_to_jsonl(trace_records),
+            file_name="exam_gen_trace.jsonl",
+            mime="application/jsonl"
+        )
@@ -0,0 +1,63 @@
+"""
+Checks whether an embedding backend can replace the fp32 PyTorch model.
+
+Embeds a sample of document chunks with both backends and compares cosine
+agreement and nearest-neighbor recall@k (see compare_embedding_backends).
+Run it on each deployment's hardware before switching
+EXAM_GEN_EMBEDDING_BACKEND; it exits with status 1 if the backend fails.
+
+Examples:
+    python -m benchmarks.check_embedding_backend --backend onnx-int8
+    python -m benchmarks.check_embedding_backend --backend onnx --pdf notes.pdf --threads 4
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from benchmarks.synthetic_pdf import get_corpus
+
+def load_sample(pdf_paths, max_chunks):
+    """Returns up to max_chunks chunks of the given PDFs, as ingestion would produce them."""
+    from src.chunk_dedup import strip_boilerplate
+    from src.document_processor import iter_pdf_pages, iter_text_chunks
+
+    chunks = []
+    for path in pdf_paths:
+        with open(path, "rb") as f:
+            pages = strip_boilerplate(iter_pdf_pages(f))
+            chunks.extend(chunk for chunk, _ in iter_text_chunks(pages, os.path.basename(path)))
+        if len(chunks) >= max_chunks:
+            break
+    return chunks[:max_chunks]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare an embedding backend against the fp32 PyTorch model.")
+    parser.add_argument("--backend", default="onnx-int8", help="Backend to check: onnx or onnx-int8.")
+    parser.add_argument("--pdf", action="append", default=[],
+                        help="PDF to sample chunks from (repeatable). Defaults to the medium synthetic corpus.")
+    parser.add_argument("--max-chunks", type=int, default=1000, help="Chunks embedded by each backend.")
+    parser.add_argument("--k", type=int, default=10, help="Neighbors compared per query for recall@k.")
+    parser.add_argument("--batch-size", type=int, help="Encoding batch size (default: EXAM_GEN_EMBEDDING_BATCH_SIZE).")
+    parser.add_argument("--threads", type=int, help="Inference threads (sets EXAM_GEN_EMBEDDING_THREADS).")
+    args = parser.parse_args(argv)
+    if args.backend == "torch":
+        parser.error("--backend torch is the reference model; choose onnx or onnx-int8.")
+
+    if args.threads:
+        os.environ["EXAM_GEN_EMBEDDING_THREADS"] = str(args.threads)
+    from src.embedding_handler import EMBEDDING_BATCH_SIZE, compare_embedding_backends
+
+    pdf_paths = args.pdf or [get_corpus("medium", os.path.join(tempfile.gettempdir(), "exam-gen-bench-corpus"))]
+    chunks = load_sample(pdf_paths, args.max_chunks)
+    print(f"Embedding {len(chunks)} chunks with 'torch' and '{args.backend}'...")
+    results = compare_embedding_backends(chunks, args.backend, k=args.k,
+                                         batch_size=args.batch_size or EMBEDDING_BATCH_SIZE)
+    print(json.dumps(results, indent=2))
+    if not results["passed"]:
+        print(f"'{args.backend}' does not agree closely enough with the fp32 model; keep the 'torch' backend.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+A deterministic, offline stand-in for genai.GenerativeModel.
+
+Responses are built from the prompt itself (words from its context
+passages), so the question and batch parsers, the response cache and the
+uniqueness filter all see realistic input without any network access.
+"""
+import hashlib
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+STOP_WORDS = {
+    "about", "after", "also", "based", "because", "before", "being", "between", "context", "could",
+    "every", "first", "from", "have", "into", "more", "most", "other", "over", "passage", "should",
+    "some", "such", "than", "that", "their", "them", "then", "there", "these", "they", "this",
+    "through", "under", "using", "when", "where", "which", "while", "with", "within", "would",
+}
+
+QUESTION_TEMPLATES = [
+    "Define {a} and explain how it relates to {b}.",
+    "Why does {a} depend on {b} in the context of {c}?",
+    "Compare {a} with {b}, giving one example of each.",
+    "How would you apply {a} to a problem involving {b} and {c}?",
+    "Describe the role of {a} in {b}.",
+    "Evaluate the impact of {a} on {b}, referring to {c}.",
+]
+
+
+class ResourceExhausted(Exception):
+    """Mimics the 429 error raised by the Gemini client, so is_quota_error() matches it."""
+
+
+class FakeGenerativeModel:
+    """
+    Drop-in replacement for genai.GenerativeModel.
+
+    Args:
+        model_name: Ignored, kept for signature compatibility.
+        latency: Seconds every generate_content() call sleeps, like a network round trip.
+        jitter: Extra latency as a fraction of latency, drawn deterministically per call.
+        error_rate: Fraction of calls that raise ResourceExhausted (0..1).
+        seed: Changes every response and failure decision.
+    """
+
+    # The nth call with a given prompt always gets the nth variant, so a run's
+    # set of responses is deterministic no matter which worker thread asks first.
+    _call_counts = {}
+    _call_counts_lock = threading.Lock()
+
+    def __init__(self, model_name=None, latency=0.05, jitter=0.2, error_rate=0.0, seed=0):
+        self.model_name = model_name
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+
+    def _next_rng(self, prompt):
+        with self._call_counts_lock:
+            count = self._call_counts.get(prompt, 0)
+            self._call_counts[prompt] = count + 1
+        digest = hashlib.sha256(f"{self.seed}:{count}:{prompt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def generate_content(self, prompt, generation_config=None):
+        rng = self._next_rng(prompt)
+        time.sleep(self.latency * (1 + self.jitter * rng.random()))
+        if rng.random() < self.error_rate:
+            raise ResourceExhausted("429 Resource has been exhausted (e.g. check quota).")
+
+        batch = re.search(r"generate (\d+) different questions", prompt)
+        if batch:
+            text = "[" + ",\n".join(_fake_question(prompt, rng) for _ in range(int(batch.group(1)))) + "]"
+        else:
+            text = _fake_question(prompt, rng)
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4),
+        )
+
+    @classmethod
+    def reset(cls):
+        """Forgets per-prompt call counts, so a new run replays the same responses."""
+        with cls._call_counts_lock:
+            cls._call_counts.clear()
+
+
+def _fake_question(prompt, rng):
+    """Builds one question/answer JSON object from words of the prompt's context."""
+    sections = prompt.split("---")
+    context = sections[1] if len(sections) > 2 else prompt  # The prompts put their passages between --- lines
+    words = [w.lower() for w in re.findall(r"[A-Za-z]{5,}", context) if w.lower() not in STOP_WORDS]
+    if len(words) < 3:
+        words = ["concept", "principle", "process"]
+    a, b, c = rng.sample(words, 3) if len(set(words)) >= 3 else (words * 3)[:3]
+    question = rng.choice(QUESTION_TEMPLATES).format(a=a, b=b, c=c)
+    answer = " ".join(rng.choice(words) for _ in range(rng.randint(15, 60))).capitalize() + "."
+    return '{"question": "%s", "answer": "%s"}' % (question, answer)
+
+
+def install_fake_llm(latency=0.05, jitter=0.2, error_rate=0.0, seed=0):
+    """
+    Replaces genai.GenerativeModel (as used by src.llm_handler) with
+    FakeGenerativeModel for the rest of the process, e.g. for a local API
+    server (EXAM_GEN_FAKE_LLM=1).
+
+    Returns:
+        The original GenerativeModel class, so it can be restored.
+    """
+    from src.llm_handler import get_genai
+
+    genai = get_genai()
+    original = genai.GenerativeModel
+    FakeGenerativeModel.reset()
+    genai.GenerativeModel = lambda model_name, **kwargs: FakeGenerativeModel(
+        model_name, latency=latency, jitter=jitter, error_rate=error_rate, seed=seed)
+    return original
+
+
+@contextmanager
+def fake_llm(latency=0.05, jitter=0.2, error_rate=0.0, seed=0):
+    """
+    Uses FakeGenerativeModel for the duration of the block.
+
+    Example:
+        with fake_llm(latency=0.2, error_rate=0.05):
+            results = list(run_generation_plan(collection, tasks))
+    """
+    from src.llm_handler import get_genai
+
+    original = install_fake_llm(latency=latency, jitter=jitter, error_rate=error_rate, seed=seed)
+    try:
+        yield
+    finally:
+        get_genai().GenerativeModel = original
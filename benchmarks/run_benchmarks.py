@@ -0,0 +1,250 @@
+"""
+Offline benchmark suite for the exam generation pipeline.
+
+Times every pipeline stage and the end-to-end paper build on synthetic PDFs,
+with the Gemini client replaced by a deterministic fake (see fake_llm.py).
+No API key or network access is needed; the embedding model must already be
+in the local Hugging Face cache.
+
+Examples:
+    python -m benchmarks.run_benchmarks --sizes small,medium --repeat 3
+    python -m benchmarks.run_benchmarks --save-baseline cpu-laptop
+    python -m benchmarks.run_benchmarks --baseline cpu-laptop --fail-on-regression
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+# Keep every cache of the benchmark run out of the user's cache and offline
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault("EXAM_GEN_CACHE_DIR", os.path.join(tempfile.mkdtemp(prefix="exam-gen-bench-"), "cache"))
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+from benchmarks.fake_llm import fake_llm
+from benchmarks.synthetic_pdf import CORPUS_SIZES, get_corpus
+
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+DEFAULT_STRUCTURE = {1: 5, 2: 5, 3: 3, 5: 2, 10: 1}
+
+# --- STAGE BENCHMARKS ---
+
+def bench_get_pdf_text(state):
+    from src.document_processor import get_pdf_text
+    with open(state["pdf_path"], "rb") as f:
+        state["text"] = get_pdf_text(f)
+    return len(state["text"])
+
+def bench_get_text_chunks(state):
+    from src.document_processor import get_text_chunks
+    state["chunks"] = get_text_chunks(state["text"])
+    return len(state["chunks"])
+
+def bench_deduplicate_chunks(state):
+    from src.chunk_dedup import deduplicate_chunks
+    chunks = state["chunks"]
+    state["chunks"] = [chunks[i] for i in deduplicate_chunks(chunks)]
+    return len(chunks)
+
+def bench_create_embeddings(state):
+    from src.embedding_handler import create_embeddings
+    state["embeddings"] = create_embeddings(state["chunks"])
+    return len(state["embeddings"])
+
+def bench_create_vector_store(state):
+    from src.vector_store import create_vector_store
+    # A new document set per run, so every run indexes from scratch
+    state["collection"] = create_vector_store(
+        state["chunks"], state["embeddings"], file_hashes=[f"bench-{state['size']}-{state['run']}-{time.time_ns()}"])
+    return len(state["chunks"])
+
+def bench_get_document_topics(state):
+    from src.topic_modeler import get_document_topics
+    state["topics"] = get_document_topics(state["chunks"], embeddings=state["embeddings"], mode=state["topic_mode"])
+    return len(state["topics"])
+
+def bench_select_unique_questions(state):
+    from src.uniqueness_filter import select_unique_questions
+    candidates = [{"question": chunk[:300], "answer": chunk} for chunk in state["chunks"]]
+    return len(select_unique_questions(candidates, max(1, len(candidates) // 2)))
+
+def bench_create_pdf(state):
+    from src.pdf_generator import create_pdf
+    paragraphs = [f"**Q{i + 1}.** {chunk[:400]} (5 Marks)" for i, chunk in enumerate(state["chunks"][:50])]
+    return len(create_pdf("Question Paper", paragraphs))
+
+STAGES = [
+    ("get_pdf_text", bench_get_pdf_text),
+    ("get_text_chunks", bench_get_text_chunks),
+    ("deduplicate_chunks", bench_deduplicate_chunks),
+    ("create_embeddings", bench_create_embeddings),
+    ("create_vector_store", bench_create_vector_store),
+    ("get_document_topics", bench_get_document_topics),
+    ("select_unique_questions", bench_select_unique_questions),
+    ("create_pdf", bench_create_pdf),
+]
+
+# --- END-TO-END BENCHMARK ---
+
+def build_paper(pdf_path, args):
+    """Runs the same steps as the app: ingestion, generation, selection and PDF rendering."""
+    from src.generation_scheduler import plan_generation_tasks, run_generation_plan, group_results_by_marks
+    from src.pdf_generator import create_pdf
+    from src.pipeline import ingest_documents, build_exam_structure, select_paper_questions, format_exam
+
+    with open(pdf_path, "rb") as f:
+        ingestion = ingest_documents([f], progress=lambda message: None, topic_mode=args.topic_mode)
+    exam_structure = build_exam_structure(DEFAULT_STRUCTURE)
+    tasks = plan_generation_tasks(exam_structure, ingestion["topics"])
+    results = list(run_generation_plan(
+        ingestion["collection"], tasks, max_workers=args.workers, requests_per_minute=args.rpm,
+        base_delay=0.1, batch_size=args.batch_size, topic_index=ingestion["topic_index"]))
+    selected = select_paper_questions(group_results_by_marks(results), exam_structure)
+    question_paper, answer_key = format_exam(selected)
+    create_pdf("Question Paper", question_paper)
+    create_pdf("Answer Key", answer_key)
+    return len(question_paper)
+
+def bench_end_to_end(size, args):
+    """
+    Times the full paper build. "cold" runs use a fresh document per run (new
+    seed), so no cache is hit; "warm" repeats the last document, so the
+    ingestion and LLM response caches are.
+    """
+    from src.instrumentation import trace_run, get_records, summarize_records
+
+    timings = {"end_to_end_cold": [], "end_to_end_warm": []}
+    stage_breakdown = None
+    pdf_path = None
+    with fake_llm(latency=args.llm_latency, error_rate=args.llm_error_rate, seed=args.seed):
+        for run in range(args.repeat):
+            pdf_path = get_corpus(size, args.corpus_dir, seed=args.seed + 1000 + run)
+            with trace_run() as run_id:
+                start = time.perf_counter()
+                build_paper(pdf_path, args)
+                timings["end_to_end_cold"].append(time.perf_counter() - start)
+            stage_breakdown = summarize_records(get_records(run_id))
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            build_paper(pdf_path, args)
+            timings["end_to_end_warm"].append(time.perf_counter() - start)
+    return timings, stage_breakdown
+
+# --- RUNNER ---
+
+def summarize_timings(runs, items=None):
+    summary = {
+        "runs_s": [round(t, 6) for t in runs],
+        "median_s": round(statistics.median(runs), 6),
+        "min_s": round(min(runs), 6),
+    }
+    if items is not None:
+        summary["items"] = items
+    return summary
+
+def run_size(size, args):
+    """Runs every stage benchmark (in pipeline order) and the end-to-end build for one corpus size."""
+    pdf_path = get_corpus(size, args.corpus_dir, seed=args.seed)
+    timings = {name: [] for name, _ in STAGES}
+    items = {}
+    for run in range(args.repeat):
+        state = {"pdf_path": pdf_path, "size": size, "run": run, "topic_mode": args.topic_mode}
+        for name, stage in STAGES:
+            start = time.perf_counter()
+            items[name] = stage(state)
+            timings[name].append(time.perf_counter() - start)
+        print(f"  [{size}] run {run + 1}/{args.repeat} done")
+
+    results = {name: summarize_timings(runs, items[name]) for name, runs in timings.items()}
+    end_to_end, breakdown = bench_end_to_end(size, args)
+    results.update({name: summarize_timings(runs) for name, runs in end_to_end.items()})
+    return {"pages": CORPUS_SIZES[size], "stages": results, "end_to_end_breakdown": breakdown}
+
+def environment_info(args):
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "embedding_backend": os.getenv("EXAM_GEN_EMBEDDING_BACKEND", "torch"),
+        "embedding_threads": os.getenv("EXAM_GEN_EMBEDDING_THREADS", "default"),
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("save_baseline", "baseline", "output", "corpus_dir")},
+    }
+
+def compare(results, baseline, threshold):
+    """
+    Prints the median time of every stage against a baseline.
+
+    Returns:
+        A list of (size, stage, ratio) tuples for stages slower than the
+        baseline by more than threshold.
+    """
+    regressions = []
+    print(f"\n{'size':<8} {'stage':<26} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for size, size_results in results["sizes"].items():
+        baseline_stages = baseline.get("sizes", {}).get(size, {}).get("stages", {})
+        for stage, summary in size_results["stages"].items():
+            if stage not in baseline_stages:
+                continue
+            before = baseline_stages[stage]["median_s"]
+            ratio = summary["median_s"] / before if before > 0 else float("inf")
+            flag = "  REGRESSION" if ratio > 1 + threshold else ""
+            print(f"{size:<8} {stage:<26} {before:>10.4f} {summary['median_s']:>10.4f} {ratio:>6.2f}x{flag}")
+            if flag:
+                regressions.append((size, stage, ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the exam generation pipeline offline.")
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma-separated corpus sizes from {sorted(CORPUS_SIZES)}.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark; the median is reported.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic corpus and the fake LLM.")
+    parser.add_argument("--topic-mode", default="auto", help="Topic modeling mode passed to get_document_topics.")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per fake LLM call.")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of fake LLM calls failing with a 429.")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent LLM calls in the end-to-end build.")
+    parser.add_argument("--rpm", type=int, default=6000, help="Requests-per-minute limit in the end-to-end build.")
+    parser.add_argument("--batch-size", type=int, default=1, help="Questions per LLM call in the end-to-end build.")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "exam-gen-bench-corpus"),
+                        help="Where synthetic PDFs are generated (and reused).")
+    parser.add_argument("--output", help="Results file. Defaults to benchmarks/results/<timestamp>.json.")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Also save the results as benchmarks/baselines/NAME.json.")
+    parser.add_argument("--baseline", metavar="NAME", help="Compare against benchmarks/baselines/NAME.json (or a path).")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Slowdown ratio above which a stage is a regression.")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if any stage regressed.")
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in CORPUS_SIZES]
+    if unknown:
+        parser.error(f"Unknown corpus size(s) {unknown}; choose from {sorted(CORPUS_SIZES)}.")
+
+    results = {"environment": environment_info(args), "sizes": {}}
+    for size in sizes:
+        print(f"Benchmarking '{size}' corpus ({CORPUS_SIZES[size]} pages)...")
+        results["sizes"][size] = run_size(size, args)
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    paths = [output] + ([os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")] if args.save_baseline else [])
+    for path in paths:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {path}")
+
+    if args.baseline:
+        baseline_path = args.baseline if args.baseline.endswith(".json") else os.path.join(BASELINE_DIR, f"{args.baseline}.json")
+        with open(baseline_path, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Deterministic synthetic course-notes PDFs for benchmarking.
+
+Each page covers one of a few subject domains, so topic modeling finds real
+clusters, and carries a running header and page footer like real lecture notes.
+"""
+import os
+import random
+
+from fpdf import FPDF
+
+CORPUS_SIZES = {"small": 20, "medium": 100, "large": 500}  # Pages per synthetic PDF
+
+DOMAINS = {
+    "networking": ["packet", "router", "protocol", "latency", "bandwidth", "congestion", "routing",
+                   "handshake", "socket", "firewall", "subnet", "throughput", "switching", "datagram"],
+    "databases": ["transaction", "index", "query", "schema", "normalization", "isolation", "locking",
+                  "replication", "partition", "journal", "optimizer", "relation", "cursor", "constraint"],
+    "biology": ["enzyme", "membrane", "protein", "mitosis", "ribosome", "genome", "photosynthesis",
+                "metabolism", "chromosome", "organelle", "respiration", "mutation", "cellular", "osmosis"],
+    "economics": ["inflation", "demand", "supply", "elasticity", "monopoly", "interest", "investment",
+                  "taxation", "equilibrium", "currency", "productivity", "recession", "tariff", "subsidy"],
+    "physics": ["momentum", "velocity", "entropy", "friction", "voltage", "magnetism", "oscillation",
+                "wavelength", "gravity", "pressure", "thermodynamics", "radiation", "acceleration", "inertia"],
+}
+
+CONNECTORS = ["affects", "depends on", "is related to", "determines", "limits", "increases",
+              "reduces", "is measured by", "interacts with", "is explained by"]
+
+
+class _NotesPDF(FPDF):
+    """Lecture-notes layout: a running header and a page-number footer on every page."""
+
+    def __init__(self, seed):
+        super().__init__()
+        self.seed = seed
+
+    def header(self):
+        self.set_font("Helvetica", "I", 8)
+        self.cell(0, 6, f"Synthetic Course Notes (seed {self.seed})", 0, 1, "C")
+
+    def footer(self):
+        self.set_y(-12)
+        self.set_font("Helvetica", "I", 8)
+        self.cell(0, 6, f"Page {self.page_no()}", 0, 0, "C")
+
+
+def _sentence(rng, vocabulary):
+    subject, obj = rng.sample(vocabulary, 2)
+    extra = rng.choice(vocabulary)
+    return (f"In practice, {subject} {rng.choice(CONNECTORS)} {obj}, "
+            f"and engineers study how {extra} changes under load.")
+
+
+def make_page_text(rng, domain):
+    """Returns a few paragraphs (about 2,500 characters) about one domain."""
+    vocabulary = DOMAINS[domain]
+    paragraphs = []
+    for _ in range(4):
+        paragraphs.append(" ".join(_sentence(rng, vocabulary) for _ in range(rng.randint(4, 6))))
+    return "\n\n".join(paragraphs)
+
+
+def make_synthetic_pdf(path, num_pages, seed=0):
+    """
+    Writes a synthetic PDF with num_pages pages.
+
+    The same (num_pages, seed) always produces the same text, so benchmark
+    runs are comparable; a different seed produces a different document
+    (and therefore misses every cache).
+
+    Returns:
+        The path of the written PDF.
+    """
+    rng = random.Random(seed)
+    domains = sorted(DOMAINS)
+    pdf = _NotesPDF(seed)
+    pdf.set_auto_page_break(auto=True, margin=15)
+    for page in range(1, num_pages + 1):
+        domain = domains[(page - 1) // 5 % len(domains)]  # A few consecutive pages per domain
+        pdf.add_page()
+        pdf.set_font("Helvetica", "B", 12)
+        pdf.cell(0, 8, f"Chapter {page}: {domain.title()}", 0, 1)
+        pdf.set_font("Helvetica", "", 10)
+        pdf.multi_cell(0, 5, make_page_text(rng, domain))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    pdf.output(path)
+    return path
+
+
+def get_corpus(size, directory, seed=0):
+    """Returns the path of the synthetic PDF for a named size, generating it once."""
+    path = os.path.join(directory, f"synthetic-{size}-seed{seed}.pdf")
+    if not os.path.exists(path):
+        make_synthetic_pdf(path, CORPUS_SIZES[size], seed)
+    return path
@@ -0,0 +1,90 @@
+"""
+Headless question bank builder.
+
+Pre-generates a large, deduplicated question bank for a set of PDFs and
+assembles papers from it without any live LLM calls.
+
+Examples:
+    python build_question_bank.py build notes.pdf textbook.pdf --per-topic 3
+    python build_question_bank.py sample notes.pdf textbook.pdf --structure 1=10,2=5,10=1 --seed 7
+"""
+import argparse
+import os
+import sys
+from contextlib import ExitStack
+
+from src.ingestion_cache import file_sha256
+from src.llm_handler import configure_llm
+from src.pdf_generator import create_pdf
+from src.pipeline import MARK_LEVELS, ingest_documents, build_exam_structure, format_exam
+from src.question_bank import build_question_bank, load_question_bank, sample_paper
+from src.vector_store import document_set_id
+
+def parse_structure(value):
+    """Parses an exam structure like '1=10,2=5,10=1' into {marks: count}."""
+    counts = {}
+    for part in value.split(","):
+        marks, count = part.split("=")
+        if int(marks) not in MARK_LEVELS:
+            raise argparse.ArgumentTypeError(f"Unsupported mark value {marks}; choose from {sorted(MARK_LEVELS)}.")
+        counts[int(marks)] = int(count)
+    return counts
+
+def build(args):
+    configure_llm()
+    with ExitStack() as stack:
+        pdf_files = [stack.enter_context(open(path, "rb")) for path in args.pdfs]
+        ingestion = ingest_documents(pdf_files)
+    set_id = document_set_id(ingestion["file_hashes"])
+    print(f"Document set {set_id[:16]} has {len(ingestion['topics'])} topics.")
+    bank = build_question_bank(
+        ingestion["collection"], ingestion["topics"], set_id,
+        marks_levels=args.marks, questions_per_topic=args.per_topic,
+        max_workers=args.workers, requests_per_minute=args.rpm, batch_size=args.batch_size,
+        topic_index=ingestion["topic_index"]
+    )
+    print(f"Question bank ready with {len(bank)} questions.")
+
+def sample(args):
+    file_hashes = []
+    for path in args.pdfs:
+        with open(path, "rb") as f:
+            file_hashes.append(file_sha256(f))
+    bank = load_question_bank(document_set_id(file_hashes))
+    if bank is None:
+        sys.exit("No question bank found for these documents. Run the 'build' command first.")
+
+    selected = sample_paper(bank, build_exam_structure(args.structure), seed=args.seed)
+    question_paper, answer_key = format_exam(selected)
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, "Question_Paper.pdf"), "wb") as f:
+        f.write(create_pdf("Question Paper", question_paper))
+    with open(os.path.join(args.output_dir, "Answer_Key.pdf"), "wb") as f:
+        f.write(create_pdf("Answer Key", answer_key))
+    print(f"Wrote a {len(question_paper)}-question paper to {args.output_dir}.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and sample Exam-Gen question banks.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Generate (or resume generating) the question bank.")
+    build_parser.add_argument("pdfs", nargs="+", help="Source PDF files.")
+    build_parser.add_argument("--marks", type=int, nargs="+", choices=sorted(MARK_LEVELS), help="Mark levels to cover (default: all).")
+    build_parser.add_argument("--per-topic", type=int, default=2, help="Questions per topic and mark level.")
+    build_parser.add_argument("--workers", type=int, default=4, help="Concurrent LLM requests.")
+    build_parser.add_argument("--rpm", type=int, default=15, help="LLM requests per minute.")
+    build_parser.add_argument("--batch-size", type=int, default=4, help="Questions per LLM request.")
+    build_parser.set_defaults(func=build)
+
+    sample_parser = subparsers.add_parser("sample", help="Assemble a paper from an existing question bank.")
+    sample_parser.add_argument("pdfs", nargs="+", help="The same PDF files the bank was built from.")
+    sample_parser.add_argument("--structure", type=parse_structure, required=True, help="Questions per mark value, e.g. 1=10,2=5,10=1.")
+    sample_parser.add_argument("--seed", type=int, default=None, help="Random seed for a reproducible paper.")
+    sample_parser.add_argument("--output-dir", default=".", help="Where to write the PDFs.")
+    sample_parser.set_defaults(func=sample)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
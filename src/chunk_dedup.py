@@ -0,0 +1,172 @@
+"""
+Ingestion-time cleanup between chunking and embedding.
+
+Repeated running headers, footers, page numbers and copyright lines are
+stripped from every page, and chunks that are near-duplicates of an earlier
+chunk (e.g. a preface repeated in two editions, or a slide deck exported
+twice) are dropped before they are embedded, indexed and clustered.
+"""
+import re
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from src.instrumentation import instrumented
+
+BOILERPLATE_EDGE_LINES = 3  # Lines at the top and bottom of a page that may be headers or footers
+BOILERPLATE_MIN_PAGES = 3  # A header/footer line must repeat on at least this many pages...
+BOILERPLATE_MIN_RATIO = 0.5  # ...and on at least this share of the pages in a window
+BOILERPLATE_WINDOW = 50  # Pages examined together, so memory stays bounded for long PDFs
+
+NEAR_DUPLICATE_THRESHOLD = 0.8  # Estimated Jaccard similarity of word 3-grams above which a chunk is a duplicate
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16  # 16 bands of 4 rows: pairs from ~0.5 similarity upwards become candidates
+SHINGLE_WORDS = 3
+
+# Part of the ingestion cache key and chunk ids: changing them changes the stored chunks
+DEDUP_PARAMS = {
+    "boilerplate_edge_lines": BOILERPLATE_EDGE_LINES,
+    "boilerplate_min_ratio": BOILERPLATE_MIN_RATIO,
+    "near_duplicate_threshold": NEAR_DUPLICATE_THRESHOLD,
+    "minhash_permutations": MINHASH_PERMUTATIONS,
+}
+
+# "12", "- 12 -", "Page 12", "12 of 300", "Page 12 / 300"
+PAGE_NUMBER_PATTERN = re.compile(r"^[\s\-–—]*(?:page\s+)?\d+(?:\s*(?:/|of)\s*\d+)?[\s\-–—]*$", re.IGNORECASE)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# --- BOILERPLATE ---
+
+def _line_signature(line):
+    """Normalizes a line so running headers match across pages despite changing page numbers."""
+    return re.sub(r"\d+", "#", " ".join(line.lower().split()))
+
+def _edge_lines(lines):
+    """Returns the indices of the first and last BOILERPLATE_EDGE_LINES non-empty lines."""
+    non_empty = [i for i, line in enumerate(lines) if line.strip()]
+    return set(non_empty[:BOILERPLATE_EDGE_LINES] + non_empty[-BOILERPLATE_EDGE_LINES:])
+
+def _strip_window(window, known, stats):
+    counts = Counter()
+    for _, lines, edges in window:
+        counts.update({_line_signature(lines[i]) for i in edges})
+    min_pages = max(BOILERPLATE_MIN_PAGES, BOILERPLATE_MIN_RATIO * len(window))
+    known.update(signature for signature, count in counts.items() if count >= min_pages)
+
+    for page_number, lines, edges in window:
+        kept = []
+        for i, line in enumerate(lines):
+            if i in edges and (_line_signature(line) in known or PAGE_NUMBER_PATTERN.match(line)):
+                stats["boilerplate_lines"] = stats.get("boilerplate_lines", 0) + 1
+                continue
+            kept.append(line)
+        yield page_number, "\n".join(kept)
+
+@instrumented("dedup.strip_boilerplate")
+def strip_boilerplate(pages, stats=None):
+    """
+    Removes running headers, footers and page numbers from a stream of pages.
+
+    A line near the top or bottom of a page is boilerplate if, with digits
+    ignored, it recurs at the edge of many pages (see BOILERPLATE_MIN_PAGES
+    and BOILERPLATE_MIN_RATIO), or if it is just a page number. Pages are
+    examined in windows of BOILERPLATE_WINDOW; lines found to be boilerplate
+    in one window are also removed from every later page.
+
+    Args:
+        pages: An iterable of (page_number, text) tuples, e.g. from iter_pdf_pages.
+        stats: Optional dict; its "boilerplate_lines" count is incremented.
+
+    Yields:
+        (page_number, text) tuples with the boilerplate lines removed.
+    """
+    stats = stats if stats is not None else {}
+    known = set()
+    window = []
+    for page_number, text in pages:
+        lines = text.split("\n")
+        window.append((page_number, lines, _edge_lines(lines)))
+        if len(window) >= BOILERPLATE_WINDOW:
+            yield from _strip_window(window, known, stats)
+            window = []
+    if window:
+        yield from _strip_window(window, known, stats)
+
+# --- NEAR-DUPLICATE CHUNKS ---
+
+def _shingle_hashes(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_WORDS:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures of word 3-grams, bucketed with locality-sensitive
+    hashing, so each new text is only compared against the few earlier texts
+    that share a band. Indexing n texts takes roughly linear time.
+
+    Args:
+        threshold: Estimated Jaccard similarity at or above which a text is a duplicate.
+        num_permutations: MinHash signature length.
+        bands: Number of LSH bands; must divide num_permutations.
+    """
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD, num_permutations=MINHASH_PERMUTATIONS, bands=LSH_BANDS):
+        rng = np.random.default_rng(0)  # Fixed, so the same chunks are kept on every run
+        self.a = rng.integers(1, _MERSENNE_PRIME, size=num_permutations, dtype=np.uint64)
+        self.b = rng.integers(0, _MERSENNE_PRIME, size=num_permutations, dtype=np.uint64)
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_permutations // bands
+        self.signatures = []
+        self.buckets = {}
+
+    def signature(self, text):
+        hashes = _shingle_hashes(text)
+        # Universal hashing (a * x + b) mod p, as in datasketch; uint64 overflow wraps around
+        with np.errstate(over="ignore"):
+            permuted = (hashes[:, None] * self.a + self.b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+    def add(self, text):
+        """
+        Indexes a text unless it is a near-duplicate of an earlier one.
+
+        Returns:
+            True if the text was new and indexed, False if it is a duplicate.
+        """
+        signature = self.signature(text)
+        keys = [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+        candidates = {position for key in keys for position in self.buckets.get(key, ())}
+        for position in candidates:
+            if np.mean(self.signatures[position] == signature) >= self.threshold:
+                return False
+
+        position = len(self.signatures)
+        self.signatures.append(signature)
+        for key in keys:
+            self.buckets.setdefault(key, []).append(position)
+        return True
+
+@instrumented("dedup.deduplicate_chunks", items=len)
+def deduplicate_chunks(chunks, index=None):
+    """
+    Finds the chunks that are not near-duplicates of an earlier chunk.
+
+    Args:
+        chunks: A list of chunk texts.
+        index: A NearDuplicateIndex shared across calls, e.g. to deduplicate
+               chunks across all files of a document set. A new one is used
+               if not given.
+
+    Returns:
+        The positions of the chunks to keep, in order.
+    """
+    index = index or NearDuplicateIndex()
+    return [i for i, chunk in enumerate(chunks) if index.add(chunk)]
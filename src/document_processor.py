@@ -1,37 +1,228 @@
+import bisect
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 from pypdf import PdfReader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from src.instrumentation import instrumented
+
+CHUNK_SIZE = 1000  # Size of each chunk in characters
+CHUNK_OVERLAP = 0  # Continuity comes from neighbor expansion at retrieval time, not duplicated text
+CHUNKING_PARAMS = {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "splitter": "sentence"}
+
+# Split points, tried in order: section headings, paragraphs, sentences,
+# lines, clauses and finally words, so chunks end at the most natural boundary
+# that fits. Sentences come before single line breaks, which in extracted PDF
+# text are mostly just wrapped lines.
+SECTION_HEADING_PATTERN = r"\n(?=(?i:chapter|section|unit|part|lecture|module)\s+\w+|\d+(?:\.\d+)*\.?\s+[A-Z])"
+CHUNK_SEPARATORS = [
+    SECTION_HEADING_PATTERN,
+    r"\n\s*\n",
+    r"(?<=[.!?])\s+",
+    r"\n",
+    r"(?<=[;:])\s+",
+    r" ",
+    r"",
+]
+
+MIN_CHUNK_CHARS = 200  # Shorter fragments (e.g. a running header before a section break) are merged into a neighbor
+
+PARALLEL_PAGE_THRESHOLD = 50  # PDFs with more pages than this are extracted in a process pool
+PAGES_PER_TASK = 20  # Number of pages each worker extracts per task
+STREAM_BUFFER_CHARS = 20 * CHUNK_SIZE  # How much text is buffered before it is split into chunks
+
+
+def _read_pdf_bytes(pdf_doc):
+    if hasattr(pdf_doc, "getvalue"):
+        return pdf_doc.getvalue()
+    pdf_doc.seek(0)
+    return pdf_doc.read()
+
+
+# The PDF parsed once per worker process, see _init_worker
+_worker_reader = None
+
+
+def _init_worker(pdf_bytes):
+    """Receives the PDF once per worker process, so tasks only carry page ranges."""
+    global _worker_reader
+    _worker_reader = PdfReader(io.BytesIO(pdf_bytes))
+
+
+def _extract_page_range(start, end):
+    """Extracts the text of pages [start, end) of the worker's PDF (runs in a worker process)."""
+    return [_worker_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def _pool_context():
+    # The app and the API run threads, which must not be forked
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+@instrumented("pdf_extraction")
+def iter_pdf_pages(pdf_doc, max_workers=None):
+    """
+    Streams the text of an uploaded PDF page by page.
+
+    Large PDFs (more than PARALLEL_PAGE_THRESHOLD pages) are extracted across
+    a process pool when more than one CPU is available. Each worker receives
+    the PDF once, when it starts; pages are still yielded in order, and only
+    a bounded window of page ranges is in flight at once.
+
+    Args:
+        pdf_doc: The uploaded PDF file object.
+        max_workers: Number of worker processes. Defaults to the CPU count;
+                     1 extracts in this process.
+
+    Yields:
+        (page_number, text) tuples, with 1-based page numbers.
+    """
+    pdf_bytes = _read_pdf_bytes(pdf_doc)
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    num_pages = len(reader.pages)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if num_pages <= PARALLEL_PAGE_THRESHOLD or max_workers == 1:
+        for i, page in enumerate(reader.pages):
+            yield i + 1, page.extract_text() or ""
+        return
+
+    ranges = [(start, min(start + PAGES_PER_TASK, num_pages)) for start in range(0, num_pages, PAGES_PER_TASK)]
+    window = max_workers * 2
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=_pool_context(),
+                             initializer=_init_worker, initargs=(pdf_bytes,)) as executor:
+        pending = []
+        next_range = 0
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < window:
+                start, end = ranges[next_range]
+                pending.append((start, executor.submit(_extract_page_range, start, end)))
+                next_range += 1
+            start, future = pending.pop(0)
+            for offset, text in enumerate(future.result()):
+                yield start + offset + 1, text
+
+
+@instrumented("pdf_extraction.get_pdf_text")
 def get_pdf_text(pdf_doc):
     """
     Extracts text from an uploaded PDF document.
-    
+
     Args:
         pdf_doc: The uploaded PDF file object.
-        
+
     Returns:
         A single string containing all the text from the PDF.
     """
-    text = ""
-    pdf_reader = PdfReader(pdf_doc)
-    for page in pdf_reader.pages:
-        text += page.extract_text()
-    return text
+    return "".join(text for _, text in iter_pdf_pages(pdf_doc))
+
+
+def _make_text_splitter():
+    """A splitter that respects section, paragraph and sentence boundaries (see CHUNK_SEPARATORS)."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+        separators=CHUNK_SEPARATORS,
+        is_separator_regex=True,
+        keep_separator="end",
+        add_start_index=True
+    )
 
 
+def _split_spans(text_splitter, text):
+    """
+    Splits text and returns the (start, end) offsets of every chunk. Chunks
+    shorter than MIN_CHUNK_CHARS are folded into the following chunk (or the
+    previous one, at the end), so no embedding is spent on a fragment.
+    """
+    spans = []
+    pending_start = None
+    for document in text_splitter.create_documents([text]):
+        start = document.metadata["start_index"]
+        end = start + len(document.page_content)
+        if pending_start is not None:
+            start, pending_start = pending_start, None
+        if end - start < MIN_CHUNK_CHARS:
+            pending_start = start
+            continue
+        spans.append((start, end))
+    if pending_start is not None:
+        if spans:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((pending_start, end))
+    return spans
+
+
+@instrumented("chunking.get_text_chunks", items=len)
 def get_text_chunks(text):
     """
-    Splits a long string of text into smaller, overlapping chunks.
-    
+    Splits a long string of text into chunks that end at section, paragraph
+    or sentence boundaries where possible.
+
     Args:
         text: The input string.
-        
+
     Returns:
         A list of text chunks.
     """
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,  # Size of each chunk in characters
-        chunk_overlap=200, # Number of characters to overlap between chunks
-        length_function=len
-    )
-    chunks = text_splitter.split_text(text)
-    return chunks
\ No newline at end of file
+    text_splitter = _make_text_splitter()
+    return [text[start:end] for start, end in _split_spans(text_splitter, text)]
+
+
+@instrumented("chunking")
+def iter_text_chunks(pages, source):
+    """
+    Chunks a stream of pages incrementally, keeping track of where each chunk
+    came from.
+
+    Text is buffered only up to STREAM_BUFFER_CHARS before being split, so
+    memory stays bounded regardless of the document size. The last (possibly
+    incomplete) chunk of each split is carried over into the next buffer.
+
+    Args:
+        pages: An iterable of (page_number, text) tuples, e.g. from iter_pdf_pages.
+        source: The name of the source file, stored as provenance.
+
+    Yields:
+        (chunk_text, metadata) tuples, where metadata has "source" and "page" keys.
+    """
+    text_splitter = _make_text_splitter()
+    buffer = ""
+    page_starts = []  # Sorted buffer offsets at which each page begins
+    page_numbers = []
+
+    def split_buffer(final):
+        spans = _split_spans(text_splitter, buffer)
+        if not final and len(spans) > 1:
+            carry_from = spans[-1][0]
+            spans = spans[:-1]
+        else:
+            carry_from = len(buffer)
+        chunks = []
+        for start, end in spans:
+            page_index = max(bisect.bisect_right(page_starts, start) - 1, 0)
+            chunks.append((buffer[start:end], {"source": source, "page": page_numbers[page_index]}))
+        return chunks, carry_from
+
+    for page_number, text in pages:
+        page_starts.append(len(buffer))
+        page_numbers.append(page_number)
+        buffer += text + "\n"  # A page break is a natural split point
+        if len(buffer) >= STREAM_BUFFER_CHARS:
+            chunks, carry_from = split_buffer(final=False)
+            yield from chunks
+            # Keep only the carried-over text and the pages it spans
+            first_page = max(bisect.bisect_right(page_starts, carry_from) - 1, 0)
+            page_starts = [max(start - carry_from, 0) for start in page_starts[first_page:]]
+            page_numbers = page_numbers[first_page:]
+            buffer = buffer[carry_from:]
+
+    if buffer.strip():
+        chunks, _ = split_buffer(final=True)
+        yield from chunks
@@ -1,20 +1,217 @@
-from sentence_transformers import SentenceTransformer
+import os
+import platform
+import threading
+import time
+
 import numpy as np
 
-def create_embeddings(chunks):
+from src.instrumentation import instrumented
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# "torch" runs the model in PyTorch; "onnx" and "onnx-int8" run the ONNX
+# exports shipped with the model through ONNX Runtime (needs
+# `pip install "sentence-transformers[onnx]"`), which is faster on CPU.
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+EMBEDDING_BACKEND = os.getenv("EXAM_GEN_EMBEDDING_BACKEND", "torch")
+EMBEDDING_THREADS = int(os.getenv("EXAM_GEN_EMBEDDING_THREADS", "0"))  # 0 keeps the library default (all cores)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EXAM_GEN_EMBEDDING_BATCH_SIZE", "64"))
+ONNX_MODEL_FILE = "onnx/model.onnx"
+# Dynamically quantized int8 exports in the model repository, per CPU family
+ONNX_INT8_MODEL_FILE = os.getenv("EXAM_GEN_ONNX_INT8_FILE") or (
+    "onnx/model_qint8_arm64.onnx" if platform.machine().lower() in ("arm64", "aarch64")
+    else "onnx/model_qint8_avx2.onnx"
+)
+
+# Guardrails for switching backends, see compare_embedding_backends
+EMBEDDING_CHECK_MIN_COSINE = 0.98  # Mean cosine similarity to the fp32 PyTorch embeddings
+EMBEDDING_CHECK_MIN_RECALL = 0.90  # Recall@k of the fp32 PyTorch nearest neighbors
+EMBEDDING_CHECK_K = 10
+
+# The process-wide model instance, loaded lazily on first use
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+def embedding_model_id(backend=EMBEDDING_BACKEND):
+    """
+    Identifies the embeddings a backend produces, for the ingestion cache
+    key, chunk ids and collection names (see INGESTION_PARAMS in
+    src.pipeline): vectors from different backends are close but not
+    identical, so they are never mixed in one index.
+    """
+    return EMBEDDING_MODEL_NAME if backend == "torch" else f"{EMBEDDING_MODEL_NAME}:{backend}"
+
+def load_embedding_model(backend=EMBEDDING_BACKEND, num_threads=EMBEDDING_THREADS):
+    """
+    Loads a new SentenceTransformer instance of the embedding model.
+
+    Args:
+        backend: One of EMBEDDING_BACKENDS.
+        num_threads: CPU threads used for inference; 0 keeps the library default.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'; choose from {EMBEDDING_BACKENDS}.")
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+        return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+    model_kwargs = {"file_name": ONNX_INT8_MODEL_FILE if backend == "onnx-int8" else ONNX_MODEL_FILE}
+    if num_threads:
+        import onnxruntime
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = num_threads
+        session_options.inter_op_num_threads = 1
+        model_kwargs["session_options"] = session_options
+    return SentenceTransformer(EMBEDDING_MODEL_NAME, backend="onnx", model_kwargs=model_kwargs)
+
+def get_embedding_model():
+    """
+    Returns the shared SentenceTransformer model, loading it on first use.
+    
+    The same instance is reused for chunk embeddings, retrieval queries,
+    topic modeling and the uniqueness filter, so the model is only loaded
+    once per process.
+
+    sentence_transformers (and torch) are imported here rather than at module
+    level, so importing this module does not slow down app startup.
+
+    The backend and thread count come from EXAM_GEN_EMBEDDING_BACKEND and
+    EXAM_GEN_EMBEDDING_THREADS, see load_embedding_model.
     """
-    Creates embeddings for a list of text chunks using a pre-trained model.
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                _embedding_model = load_embedding_model()
+    return _embedding_model
+
+@instrumented("embedding.encode", items=len)
+def encode_texts(texts, batch_size=EMBEDDING_BATCH_SIZE, dtype="float32", show_progress_bar=False):
+    """
+    Encodes a list of strings with the shared embedding model in batches.
+
+    SentenceTransformer.encode sorts the texts by length before batching (and
+    restores the input order afterwards), so each batch is padded only to
+    its own longest text.
     
     Args:
-        chunks: A list of text strings.
+        texts: A list of text strings.
+        batch_size: Number of texts encoded per forward pass.
+        dtype: "float32" or "float16" for the returned numpy array.
+        show_progress_bar: Whether to display the encoding progress bar.
         
     Returns:
-        A list of embeddings, where each embedding is a numerical vector.
+        A 2D numpy array with one embedding row per text.
     """
-    embedder = SentenceTransformer("all-MiniLM-L6-v2")
-    
-    # The model generates embeddings as numpy arrays, which we convert to lists
-    embeddings = embedder.encode(chunks, show_progress_bar=True)
+    embeddings = get_embedding_model().encode(
+        list(texts),
+        batch_size=batch_size,
+        show_progress_bar=show_progress_bar,
+        convert_to_numpy=True
+    )
+    return embeddings.astype(dtype, copy=False)
+
+class SharedEmbeddingFunction:
+    """
+    A ChromaDB embedding function backed by the shared model, so query texts
+    are embedded with the same model as the indexed chunks.
+    """
+
+    def __call__(self, input):
+        return encode_texts(input).tolist()
+
+    def name(self):
+        return EMBEDDING_MODEL_NAME
+
+@instrumented("embedding.create_embeddings", items=len)
+def create_embeddings(chunks, dtype="float32"):
+    """
+    Creates embeddings for a list of text chunks using the shared model.
     
-    # It's good practice to convert to a list of lists for compatibility
-    return embeddings.tolist()
\ No newline at end of file
+    Args:
+        chunks: A list of text strings.
+        dtype: "float32" (default) or "float16" to halve the memory footprint.
+        
+    Returns:
+        A 2D numpy array of embeddings, one row per chunk.
+    """
+    return encode_texts(chunks, dtype=dtype, show_progress_bar=True)
+
+def normalize_embeddings(vectors):
+    """
+    L2-normalizes a vector or each row of a 2D array, so dot products are
+    cosine similarities.
+
+    Returns:
+        A float32 numpy array of the same shape.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+# --- BACKEND CHECK ---
+
+def _top_k_neighbors(embeddings, query_positions, k):
+    similarities = embeddings[query_positions] @ embeddings.T
+    similarities[np.arange(len(query_positions)), query_positions] = -np.inf  # Exclude the query itself
+    return np.argpartition(-similarities, k, axis=1)[:, :k]
+
+def compare_embedding_backends(texts, backend, reference_backend="torch", k=EMBEDDING_CHECK_K,
+                               num_queries=200, batch_size=EMBEDDING_BATCH_SIZE):
+    """
+    Checks that a backend can replace the fp32 PyTorch model on a sample of
+    real texts (e.g. document chunks).
+
+    Both models embed the texts. The backend passes if its embeddings keep a
+    mean cosine similarity of at least EMBEDDING_CHECK_MIN_COSINE to the
+    reference embeddings, and if, for num_queries of the texts, its k nearest
+    neighbors recover at least EMBEDDING_CHECK_MIN_RECALL of the reference
+    k nearest neighbors (what retrieval and topic modeling depend on).
+
+    Args:
+        texts: The sample to embed; more than k texts.
+        backend: The backend to check, one of EMBEDDING_BACKENDS.
+        reference_backend: The backend to compare against.
+        k: Neighbors compared per query for recall@k.
+        num_queries: How many of the texts are used as neighbor queries.
+        batch_size: Encoding batch size for both models.
+
+    Returns:
+        A dict with the agreement metrics, the encoding time of both
+        backends, the speedup and whether the backend passed.
+    """
+    if backend == reference_backend:
+        raise ValueError(f"Cannot check backend '{backend}' against itself; choose a different reference backend.")
+    if len(texts) <= k:
+        raise ValueError(f"Need more than k={k} texts to compare nearest neighbors.")
+    results = {"backend": backend, "reference_backend": reference_backend, "num_texts": len(texts), "k": k}
+    embeddings = {}
+    for name in (reference_backend, backend):
+        model = load_embedding_model(name)
+        model.encode(texts[:batch_size], batch_size=batch_size)  # Warm up before timing
+        start = time.perf_counter()
+        embeddings[name] = normalize_embeddings(model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True))
+        results[f"{'reference' if name == reference_backend else 'backend'}_seconds"] = round(time.perf_counter() - start, 3)
+
+    reference, candidate = embeddings[reference_backend], embeddings[backend]
+    cosine = (reference * candidate).sum(axis=1)
+    queries = np.linspace(0, len(texts) - 1, min(num_queries, len(texts))).astype(int)
+    reference_neighbors = _top_k_neighbors(reference, queries, k)
+    candidate_neighbors = _top_k_neighbors(candidate, queries, k)
+    recall = np.mean([len(set(r) & set(c)) / k for r, c in zip(reference_neighbors, candidate_neighbors)])
+
+    results.update(
+        mean_cosine=round(float(cosine.mean()), 4),
+        min_cosine=round(float(cosine.min()), 4),
+        recall_at_k=round(float(recall), 4),
+        speedup=round(results["reference_seconds"] / max(results["backend_seconds"], 1e-9), 2),
+    )
+    results["passed"] = (results["mean_cosine"] >= EMBEDDING_CHECK_MIN_COSINE
+                         and results["recall_at_k"] >= EMBEDDING_CHECK_MIN_RECALL)
+    return results
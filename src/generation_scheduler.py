@@ -0,0 +1,223 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src.llm_handler import generate_question_from_context, generate_questions_batch, is_quota_error
+from src.retrieval_index import attach_contexts
+from src.instrumentation import instrumented, bind_run_context
+
+
+class TokenBucketLimiter:
+    """
+    A thread-safe token bucket that limits how many LLM requests are started
+    per minute. Workers call acquire() before each request and block until a
+    token is available.
+    """
+
+    def __init__(self, requests_per_minute=15, burst=None):
+        self.rate = requests_per_minute / 60.0  # Tokens added per second
+        self.capacity = burst if burst is not None else max(1, requests_per_minute // 4)
+        self.tokens = float(self.capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until one request token is available, then consumes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+def plan_generation_tasks(exam_structure, topics, num_variants=1):
+    """
+    Expands the exam structure into an ordered list of generation tasks.
+
+    Topics are rotated within each mark bucket, starting one topic further
+    for every bucket, so the plan is deterministic no matter in which order
+    the tasks later complete. A bucket's tasks do not depend on the counts
+    of the other buckets, and adding questions to a bucket only appends
+    tasks to it, so a small structure change reuses all earlier responses
+    from the LLM response cache.
+
+    Args:
+        exam_structure: Dict mapping marks to (count, difficulty, topic_base, over_gen_count).
+        topics: The list of topic names from get_document_topics.
+        num_variants: Number of paper variants (sets A, B, ...) to fill from
+                      one shared pool: every bucket gets count * num_variants
+                      candidates plus its over_gen_count spares, which all
+                      variants share.
+
+    Each task also gets a "variant": how many earlier tasks share its marks
+    and topic query. It keeps repeated prompts distinct in the LLM response
+    cache while staying stable across reruns of the same plan.
+
+    Returns:
+        A list of task dicts with index, marks, difficulty, topic_query and variant keys.
+    """
+    tasks = []
+    seen_queries = {}
+    total_questions_generated = 0
+    for bucket, (marks, config) in enumerate(exam_structure.items()):
+        count, difficulty, topic_base, over_gen_count = config
+        if count > 0:
+            for i in range(count * num_variants + over_gen_count):
+                current_topic = topics[(bucket + i) % len(topics)]
+                topic_query = f"{topic_base} related to '{current_topic}'"
+                variant = seen_queries.get((marks, topic_query), 0)
+                seen_queries[(marks, topic_query)] = variant + 1
+                tasks.append({
+                    "index": total_questions_generated,
+                    "marks": marks,
+                    "difficulty": difficulty,
+                    "topic": current_topic,
+                    "topic_query": topic_query,
+                    "variant": variant,
+                })
+                total_questions_generated += 1
+    return tasks
+
+
+def plan_generation_batches(tasks, batch_size):
+    """
+    Groups consecutive tasks of the same mark value into batches of at most
+    batch_size, so each batch can be generated with a single LLM call.
+
+    Returns:
+        A list of task lists.
+    """
+    batches = []
+    for task in tasks:
+        if batches and len(batches[-1]) < batch_size and batches[-1][0]["marks"] == task["marks"]:
+            batches[-1].append(task)
+        else:
+            batches.append([task])
+    return batches
+
+
+def _generate_with_retry(vector_store, task, limiter, max_retries, base_delay, fresh=False):
+    """
+    Runs one generation task, retrying with exponential backoff and jitter
+    when the LLM reports a quota or rate-limit error. The limiter is only
+    taken for real LLM requests, not for cache hits.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return generate_question_from_context(
+                vector_store, task["marks"], task["difficulty"], task["topic_query"], raise_errors=True,
+                fresh=fresh, cache_variant=task["variant"], context_chunks=task.get("context_chunks"),
+                limiter=limiter)
+        except Exception as e:
+            if is_quota_error(e) and attempt < max_retries:
+                time.sleep(base_delay * (2 ** attempt) + random.uniform(0, base_delay))
+                continue
+            print(f"Error during LLM call or JSON parsing: {e}")
+            return {
+                "question": f"Error generating question: {e}",
+                "answer": "N/A"
+            }
+
+
+def _generate_batch_with_retry(vector_store, batch, limiter, max_retries, base_delay, fresh=False):
+    """
+    Runs one batched generation call, retrying the whole batch on quota
+    errors. Any element that fails validation is regenerated with a
+    single-question call.
+    """
+    if len(batch) == 1:
+        return [(batch[0], _generate_with_retry(vector_store, batch[0], limiter, max_retries, base_delay, fresh))]
+
+    questions = [None] * len(batch)
+    for attempt in range(max_retries + 1):
+        try:
+            questions = generate_questions_batch(
+                vector_store, batch[0]["marks"], batch[0]["difficulty"],
+                [task["topic_query"] for task in batch], raise_errors=True,
+                fresh=fresh, cache_variant=batch[0]["variant"],
+                contexts=[task.get("context_chunks") for task in batch] if all(task.get("context_chunks") for task in batch) else None,
+                limiter=limiter)
+            break
+        except Exception as e:
+            if is_quota_error(e) and attempt < max_retries:
+                time.sleep(base_delay * (2 ** attempt) + random.uniform(0, base_delay))
+                continue
+            print(f"Batched generation failed, falling back to single questions: {e}")
+            break
+
+    results = []
+    for task, q_data in zip(batch, questions):
+        if q_data is None:
+            q_data = _generate_with_retry(vector_store, task, limiter, max_retries, base_delay, fresh)
+        results.append((task, q_data))
+    return results
+
+
+@instrumented("generation")
+def run_generation_plan(vector_store, tasks, max_workers=4, requests_per_minute=15,
+                        max_retries=4, base_delay=2.0, batch_size=1, fresh=False, topic_index=None, limiter=None):
+    """
+    Generates questions for all planned tasks with bounded concurrency.
+
+    This is a generator: finished questions are yielded as soon as they
+    complete, so the caller can stream them to the UI.
+
+    Args:
+        vector_store: The ChromaDB collection to retrieve context from.
+        tasks: The list of tasks from plan_generation_tasks.
+        max_workers: Maximum number of LLM calls in flight at once.
+        requests_per_minute: Rate limit applied across all workers.
+        max_retries: How many times to retry a task on quota errors.
+        base_delay: Initial backoff delay in seconds.
+        batch_size: Questions requested per LLM call. Values above 1 group
+            tasks of the same mark value into batched calls.
+        fresh: Bypass the LLM response cache to get new variations.
+        topic_index: Optional precomputed topic neighborhoods (see
+            build_topic_index). Contexts for all tasks are attached before
+            generation starts, either from this index or from one batched
+            vector search.
+        limiter: Optional shared TokenBucketLimiter, so concurrent runs
+            (e.g. jobs of the API service) share one API rate limit.
+            Defaults to a new limiter for requests_per_minute.
+
+    Closing the generator (or breaking out of the loop) cancels all requests
+    that have not started yet; requests already in flight finish in the
+    background and their results are discarded.
+
+    Yields:
+        (task, question_data) tuples in completion order.
+    """
+    attach_contexts(tasks, vector_store=vector_store, topic_index=topic_index)
+    limiter = limiter or TokenBucketLimiter(requests_per_minute)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [
+            executor.submit(bind_run_context(_generate_batch_with_retry), vector_store, batch, limiter, max_retries, base_delay, fresh)
+            for batch in plan_generation_batches(tasks, batch_size)
+        ]
+        for future in as_completed(futures):
+            yield from future.result()
+    finally:
+        # If the caller stops iterating early (e.g. the user cancelled), drop
+        # the queued requests instead of waiting for the whole plan to finish.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def group_results_by_marks(results):
+    """
+    Groups (task, question_data) results into per-mark pools, ordered by the
+    original plan index so downstream filtering stays deterministic.
+
+    Returns:
+        A dict mapping marks to a list of question data dicts.
+    """
+    pools = {}
+    for task, q_data in sorted(results, key=lambda r: r[0]["index"]):
+        pools.setdefault(task["marks"], []).append(q_data)
+    return pools
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from src.instrumentation import instrumented
+
+CACHE_DIR = os.getenv("EXAM_GEN_CACHE_DIR", ".exam_gen_cache")
+INGESTION_CACHE_DIR = os.path.join(CACHE_DIR, "ingestion")
+TEMP_PREFIX = ".tmp-"  # Staging directories of entries being written
+MAX_CACHE_BYTES = int(os.getenv("EXAM_GEN_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+def file_sha256(file_obj):
+    """
+    Computes the SHA-256 hex digest of an uploaded file without consuming it.
+
+    Args:
+        file_obj: A Streamlit UploadedFile or any seekable binary file object.
+
+    Returns:
+        The hex digest string.
+    """
+    if hasattr(file_obj, "getvalue"):
+        return hashlib.sha256(file_obj.getvalue()).hexdigest()
+    position = file_obj.tell()
+    file_obj.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: file_obj.read(1024 * 1024), b""):
+        digest.update(block)
+    file_obj.seek(position)
+    return digest.hexdigest()
+
+def compute_cache_key(file_hashes, params):
+    """
+    Builds a content-addressed cache key for a set of uploaded files.
+
+    Args:
+        file_hashes: SHA-256 digests of the uploaded PDFs (see file_sha256), in upload order.
+        params: A dict of chunking/model parameters that affect the output.
+
+    Returns:
+        A hex string identifying this document set and configuration.
+    """
+    payload = {
+        "files": list(file_hashes),
+        "params": params,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _entry_dir(key):
+    return os.path.join(INGESTION_CACHE_DIR, key)
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def make_temp_dir(parent):
+    """Creates a uniquely named staging directory next to the entries it will become."""
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=parent)
+
+def install_dir(tmp_dir, target):
+    """
+    Moves a fully written staging directory into place as target.
+
+    Concurrent writers of the same (content-addressed) entry may race; the
+    first one to land wins and the others discard their copy, so an entry
+    another writer has just installed is never removed. A leftover target
+    without meta.json (from an interrupted older version) is replaced.
+
+    Returns:
+        True if tmp_dir was installed, False if another writer's entry was kept.
+    """
+    for _ in range(2):
+        try:
+            os.rename(tmp_dir, target)
+            return True
+        except OSError:
+            if os.path.exists(os.path.join(target, "meta.json")):
+                break
+            shutil.rmtree(target, ignore_errors=True)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    return False
+
+@instrumented("ingestion_cache.load")
+def load_ingestion(key):
+    """
+    Loads a cached ingestion result and marks it as recently used.
+
+    Returns:
+        A dict with text, chunks, chunk_ids, chunk_metadata, embeddings
+        (memory-mapped numpy array), topics, chunk_topics and stats, or None
+        if the key is not cached.
+    """
+    entry = _entry_dir(key)
+    meta_path = os.path.join(entry, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(entry, "text.txt"), encoding="utf-8") as f:
+            text = f.read()
+        with open(os.path.join(entry, "chunks.json"), encoding="utf-8") as f:
+            chunks = json.load(f)
+        with open(os.path.join(entry, "chunk_ids.json"), encoding="utf-8") as f:
+            chunk_ids = json.load(f)
+        with open(os.path.join(entry, "chunk_metadata.json"), encoding="utf-8") as f:
+            chunk_metadata = json.load(f)
+        with open(os.path.join(entry, "topics.json"), encoding="utf-8") as f:
+            topics = json.load(f)
+        with open(os.path.join(entry, "chunk_topics.json"), encoding="utf-8") as f:
+            chunk_topics = json.load(f)
+        embeddings = np.load(os.path.join(entry, "embeddings.npy"), mmap_mode="r")
+    except (OSError, ValueError) as e:
+        print(f"Discarding corrupt ingestion cache entry {key}: {e}")
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+
+    # Touch the entry so LRU eviction keeps it around
+    os.utime(meta_path, None)
+    return {"text": text, "chunks": chunks, "chunk_ids": chunk_ids,
+            "chunk_metadata": chunk_metadata, "embeddings": embeddings, "topics": topics, "chunk_topics": chunk_topics,
+            "stats": meta.get("stats", {})}
+
+@instrumented("ingestion_cache.save")
+def save_ingestion(key, text, chunks, chunk_ids, chunk_metadata, embeddings, topics, chunk_topics, stats=None):
+    """
+    Stores an ingestion result on disk and evicts old entries if the cache
+    grows beyond MAX_CACHE_BYTES. stats (e.g. how many chunks were removed
+    as duplicates) is kept in the entry's metadata.
+    """
+    entry = _entry_dir(key)
+    tmp_entry = make_temp_dir(INGESTION_CACHE_DIR)
+    with open(os.path.join(tmp_entry, "text.txt"), "w", encoding="utf-8") as f:
+        f.write(text)
+    with open(os.path.join(tmp_entry, "chunks.json"), "w", encoding="utf-8") as f:
+        json.dump(chunks, f)
+    with open(os.path.join(tmp_entry, "chunk_ids.json"), "w", encoding="utf-8") as f:
+        json.dump(chunk_ids, f)
+    with open(os.path.join(tmp_entry, "chunk_metadata.json"), "w", encoding="utf-8") as f:
+        json.dump(chunk_metadata, f)
+    with open(os.path.join(tmp_entry, "topics.json"), "w", encoding="utf-8") as f:
+        json.dump(topics, f)
+    with open(os.path.join(tmp_entry, "chunk_topics.json"), "w", encoding="utf-8") as f:
+        json.dump(chunk_topics, f)
+    np.save(os.path.join(tmp_entry, "embeddings.npy"), np.asarray(embeddings))
+    # meta.json is written last; its presence marks a complete entry
+    with open(os.path.join(tmp_entry, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"created": time.time(), "num_chunks": len(chunks), "stats": stats or {}}, f)
+
+    install_dir(tmp_entry, entry)
+    evict_lru(MAX_CACHE_BYTES)
+
+def evict_lru(max_bytes, cache_dir=INGESTION_CACHE_DIR):
+    """
+    Removes the least recently used entries of a cache directory (the
+    ingestion cache by default) until its total size is at most max_bytes.
+    An entry is a directory with a meta.json, whose mtime records its last use.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.startswith(TEMP_PREFIX):
+            continue  # Another writer's staging directory
+        path = os.path.join(cache_dir, name)
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            entries.append((os.path.getmtime(meta_path), _dir_size(path), path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
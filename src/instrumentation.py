@@ -0,0 +1,238 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+TRACE_FILE = os.getenv("EXAM_GEN_TRACE_FILE")  # If set, every span is appended here as a JSON line
+MAX_RECORDS = 20000  # Spans kept in memory for the diagnostics panel
+
+_records = deque(maxlen=MAX_RECORDS)
+_records_lock = threading.Lock()
+_current_run = contextvars.ContextVar("exam_gen_run", default=None)
+
+class Span:
+    """A timed pipeline stage. Attributes such as item or token counts can be added with set()."""
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = dict(attrs)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is reported in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def _span_record(name, attrs, start, wall_s, cpu_s, error=None):
+    record = {
+        "name": name,
+        "run_id": _current_run.get(),
+        "thread": threading.current_thread().name,
+        "start": start,
+        "wall_s": round(wall_s, 6),
+        "cpu_s": round(cpu_s, 6),
+        "process_peak_rss_mb": _peak_rss_mb(),
+        **attrs,
+    }
+    if error is not None:
+        record["error"] = error
+    return record
+
+def _record(record):
+    with _records_lock:
+        _records.append(record)
+        if TRACE_FILE:
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Times a block of code and records wall time, CPU time of the calling
+    thread, the peak RSS of the whole process so far, and any attributes set
+    on the yielded Span.
+
+    Example:
+        with span("chunking", source=name) as s:
+            chunks = ...
+            s.set(items=len(chunks))
+    """
+    current = Span(name, attrs)
+    start = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = repr(e)
+        raise
+    finally:
+        _record(_span_record(name, current.attrs, start, time.perf_counter() - wall_start,
+                             time.thread_time() - cpu_start, error))
+
+def instrumented(name=None, items=None):
+    """
+    Decorator that wraps every call of a function in a span.
+
+    Args:
+        name: Span name. Defaults to module.function.
+        items: Optional callable computing an item count from the result.
+               Not accepted for generator functions: their yielded items
+               are counted automatically (also when the consumer stops
+               early), and the span covers only the time spent inside the
+               generator.
+
+    Raises:
+        TypeError: If items is given for a generator function.
+    """
+    def decorator(func):
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        if inspect.isgeneratorfunction(func):
+            if items is not None:
+                raise TypeError(f"{span_name}: items= cannot be used on a generator; yielded items are counted.")
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                # Only the time spent producing items is counted, not the time
+                # the consumer spends between them (which may be another span)
+                start = time.time()
+                wall_s = cpu_s = 0.0
+                count = 0
+                error = None
+                iterator = func(*args, **kwargs)
+                try:
+                    while True:
+                        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            break
+                        finally:
+                            wall_s += time.perf_counter() - wall_start
+                            cpu_s += time.thread_time() - cpu_start
+                        count += 1
+                        yield item
+                except Exception as e:
+                    error = repr(e)
+                    raise
+                finally:
+                    iterator.close()
+                    _record(_span_record(span_name, {"items": count}, start, wall_s, cpu_s, error))
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name) as s:
+                result = func(*args, **kwargs)
+                if items is not None:
+                    s.set(items=items(result))
+                return result
+        return wrapper
+    return decorator
+
+@contextmanager
+def trace_run(run_id=None):
+    """
+    Tags all spans recorded inside the block (including in worker threads
+    started with bind_run_context) with a run id.
+
+    Yields:
+        The run id.
+    """
+    run_id = run_id or uuid.uuid4().hex[:12]
+    token = _current_run.set(run_id)
+    try:
+        yield run_id
+    finally:
+        _current_run.reset(token)
+
+def start_run(run_id=None):
+    """
+    Starts tagging spans with a new run id in the current context, without a
+    with-block (e.g. for one Streamlit script run).
+
+    Returns:
+        The run id.
+    """
+    run_id = run_id or uuid.uuid4().hex[:12]
+    _current_run.set(run_id)
+    return run_id
+
+def bind_run_context(func):
+    """Returns func bound to a copy of the caller's context, so spans in worker threads keep the run id."""
+    run_id = _current_run.get()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current_run.set(run_id)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_run.reset(token)
+    return wrapper
+
+def get_records(run_id=None):
+    """Returns the recorded spans, optionally only those of one run."""
+    with _records_lock:
+        return [r for r in _records if run_id is None or r.get("run_id") == run_id]
+
+def clear_records():
+    with _records_lock:
+        _records.clear()
+
+def summarize_records(records):
+    """
+    Aggregates spans by name.
+
+    Returns:
+        A list of dicts with calls, total/mean/max wall time, thread CPU
+        time, the highest process peak RSS seen, items and LLM token counts,
+        slowest stages first.
+    """
+    stages = {}
+    for r in records:
+        stage = stages.setdefault(r["name"], {
+            "stage": r["name"], "calls": 0, "total_wall_s": 0.0, "max_wall_s": 0.0,
+            "cpu_s": 0.0, "process_peak_rss_mb": 0.0, "items": 0, "prompt_tokens": 0, "output_tokens": 0, "errors": 0,
+        })
+        stage["calls"] += 1
+        stage["total_wall_s"] += r["wall_s"]
+        stage["max_wall_s"] = max(stage["max_wall_s"], r["wall_s"])
+        stage["cpu_s"] += r["cpu_s"]
+        stage["process_peak_rss_mb"] = max(stage["process_peak_rss_mb"], r.get("process_peak_rss_mb") or 0.0)
+        stage["items"] += r.get("items") or 0
+        stage["prompt_tokens"] += r.get("prompt_tokens") or 0
+        stage["output_tokens"] += r.get("output_tokens") or 0
+        stage["errors"] += 1 if "error" in r else 0
+
+    summary = []
+    for stage in stages.values():
+        stage["mean_wall_s"] = stage["total_wall_s"] / stage["calls"]
+        for key in ("total_wall_s", "max_wall_s", "mean_wall_s", "cpu_s"):
+            stage[key] = round(stage[key], 4)
+        summary.append(stage)
+    return sorted(summary, key=lambda s: s["total_wall_s"], reverse=True)
+
+def records_to_jsonl(records):
+    """Serializes spans as JSON lines, e.g. for a download button or log shipping."""
+    return "".join(json.dumps(r, default=str) + "\n" for r in records)
+
+def export_jsonl(path, records=None):
+    """Appends spans (default: all recorded) to a JSON lines file."""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(records_to_jsonl(get_records() if records is None else records))
@@ -1,8 +1,39 @@
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
+import hashlib
 import json
 import re 
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from src.ingestion_cache import CACHE_DIR
+from src.instrumentation import instrumented, span
+from src.retrieval_index import context_token_budget, context_query_size, fit_to_budget
+
+MODEL_NAME = 'gemini-flash-latest'
+GENERATION_CONFIG = {}  # Passed to generate_content; part of the response cache key
+
+LLM_CACHE_PATH = os.path.join(CACHE_DIR, "llm_cache.sqlite3")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("EXAM_GEN_LLM_CACHE_TTL_DAYS", "30")) * 24 * 3600
+LLM_CACHE_MAX_BYTES = int(os.getenv("EXAM_GEN_LLM_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+_llm_cache_lock = threading.Lock()
+
+# The google.generativeai module, imported on first use
+_genai = None
+
+def get_genai():
+    """
+    Returns the google.generativeai module, importing it on first use so
+    that importing this module does not slow down app startup.
+    """
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        _genai = genai
+    return _genai
 
 def configure_llm():
     """
@@ -12,17 +43,132 @@ def configure_llm():
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
         raise ValueError("GOOGLE_API_KEY not found. Please set it in your .env file.")
-    genai.configure(api_key=api_key)
+    get_genai().configure(api_key=api_key)
 
-def generate_question_from_context(vector_store, marks, difficulty, topic):
+def is_quota_error(error):
     """
-    Generates a single question by retrieving context from the vector store
-    and prompting the LLM.
+    Checks whether an exception raised by the Gemini client is a rate-limit
+    or quota error (HTTP 429 / ResourceExhausted) that is worth retrying.
     """
-    
-    results = vector_store.query(query_texts=[topic], n_results=3)
-    context = " ".join(results['documents'][0])
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "rate limit" in message
+
+@contextmanager
+def _llm_cache_connection():
+    """Opens the response cache database, commits on success and always closes it."""
+    os.makedirs(os.path.dirname(LLM_CACHE_PATH), exist_ok=True)
+    with _llm_cache_lock:
+        connection = sqlite3.connect(LLM_CACHE_PATH, timeout=30)
+        try:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, "
+                "last_access REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            yield connection
+            connection.commit()
+        finally:
+            connection.close()
 
+def is_error_question(question_data):
+    """Checks whether a question dict is the placeholder returned after a failed generation."""
+    return question_data.get("answer") == "N/A" and question_data.get("question", "").startswith("Error generating question")
+
+def llm_cache_key(prompt, cache_variant=0):
+    """
+    Hashes everything that determines an LLM response: the rendered prompt,
+    model name and generation config. cache_variant distinguishes repeated
+    identical prompts within one exam so they still get different questions.
+    """
+    payload = json.dumps({
+        "prompt": prompt,
+        "model": MODEL_NAME,
+        "config": GENERATION_CONFIG,
+        "variant": cache_variant,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get_cached_response(key):
+    """Returns the cached response text for key, or None if missing or expired."""
+    with _llm_cache_connection() as connection:
+        row = connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[1] > LLM_CACHE_TTL_SECONDS:
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+        connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+def store_cached_response(key, response_text):
+    """
+    Stores a response and evicts expired and least recently used entries once
+    the cache grows beyond LLM_CACHE_MAX_BYTES.
+    """
+    now = time.time()
+    size = len(response_text.encode("utf-8"))
+    with _llm_cache_connection() as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO responses (key, response, created, last_access, size) VALUES (?, ?, ?, ?, ?)",
+            (key, response_text, now, now, size)
+        )
+        connection.execute("DELETE FROM responses WHERE created < ?", (now - LLM_CACHE_TTL_SECONDS,))
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > LLM_CACHE_MAX_BYTES:
+            rows = connection.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+            for old_key, old_size in rows:
+                if total <= LLM_CACHE_MAX_BYTES:
+                    break
+                connection.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                total -= old_size
+
+def drop_cached_response(key):
+    """Removes a cached response, e.g. because it failed to parse."""
+    with _llm_cache_connection() as connection:
+        connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+def generate_text(prompt, fresh=False, cache_variant=0, limiter=None):
+    """
+    Sends a prompt to Gemini, serving repeated prompts from the response cache.
+
+    Args:
+        prompt: The fully rendered prompt.
+        fresh: Skip the cache lookup (the new response still replaces the cached one).
+        cache_variant: See llm_cache_key.
+        limiter: Optional rate limiter (see TokenBucketLimiter). A token is
+                 only taken when a request is actually sent to Gemini, so
+                 cache hits are never throttled.
+
+    Returns:
+        A (response_text, cache_key, cache_hit) tuple.
+    """
+    key = llm_cache_key(prompt, cache_variant)
+    if not fresh:
+        with span("llm.cache_lookup") as s:
+            cached = get_cached_response(key)
+            s.set(hit=cached is not None)
+        if cached is not None:
+            return cached, key, True
+
+    if limiter is not None:
+        limiter.acquire()
+    with span("llm.request", model=MODEL_NAME, prompt_chars=len(prompt)) as s:
+        model = get_genai().GenerativeModel(MODEL_NAME)
+        response = model.generate_content(prompt, generation_config=GENERATION_CONFIG or None)
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            s.set(prompt_tokens=getattr(usage, "prompt_token_count", None),
+                  output_tokens=getattr(usage, "candidates_token_count", None))
+    store_cached_response(key, response.text)
+    return response.text, key, False
+
+def get_mark_instructions(marks):
+    """
+    Returns the (creative_instruction, marks_instruction) prompt lines that
+    tailor a question and its answer to the mark value.
+    """
     # --- DYNAMIC PROMPT ENGINEERING BASED ON MARKS ---
     creative_instruction = ""
     marks_instruction = ""
@@ -39,7 +185,35 @@ def generate_question_from_context(vector_store, marks, difficulty, topic):
     else:  # For 10 marks
         creative_instruction = "This is a high-value essay question. It MUST require in-depth analysis, synthesis of multiple concepts from the context, or an evaluation of a topic. Ask a comprehensive question that demands a structured, detailed response."
         marks_instruction = f"Provide a comprehensive, multi-paragraph answer with a clear structure (introduction, body, conclusion) suitable for a detailed {marks}-mark marking scheme. Break down the marks allocation in the answer."
+
+    return creative_instruction, marks_instruction
+
+@instrumented("llm.generate_question")
+def generate_question_from_context(vector_store, marks, difficulty, topic, raise_errors=False,
+                                   fresh=False, cache_variant=0, context_chunks=None, limiter=None):
+    """
+    Generates a single question by retrieving context from the vector store
+    and prompting the LLM.
+
+    If raise_errors is True, LLM and parsing errors are raised to the caller
+    (used by the generation scheduler to retry on quota errors) instead of
+    being turned into an error question.
+
+    Responses are served from the LLM response cache unless fresh is True;
+    the returned dict has a "cached" flag telling whether it was reused.
+
+    If context_chunks is given (pre-fetched by the generation scheduler), the
+    vector store is not queried. limiter is passed to generate_text.
+    """
     
+    if context_chunks is None:
+        token_budget = context_token_budget(marks)
+        results = vector_store.query(query_texts=[topic], n_results=context_query_size(token_budget))
+        context_chunks = fit_to_budget(results['documents'][0], token_budget)
+    context = " ".join(context_chunks)
+
+    creative_instruction, marks_instruction = get_mark_instructions(marks)
+
     prompt_template = f"""
     You are an expert educator and question paper setter.
     Your task is to generate ONE single question based on the following context.
@@ -63,24 +237,147 @@ def generate_question_from_context(vector_store, marks, difficulty, topic):
     }}
     """
     
+    cache_key = None
     try:
-        model = genai.GenerativeModel('gemini-flash-latest')
-        response = model.generate_content(prompt_template)
+        response_text, cache_key, cache_hit = generate_text(prompt_template, fresh, cache_variant, limiter)
         
         # Robust JSON parsing
-        match = re.search(r"\{.*\}", response.text, re.DOTALL)
+        match = re.search(r"\{.*\}", response_text, re.DOTALL)
         if match:
             json_str = match.group(0)
             question_data = json.loads(json_str)
             if "question" not in question_data or "answer" not in question_data:
                 raise ValueError("LLM response did not contain 'question' or 'answer' keys.")
+            question_data["cached"] = cache_hit
             return question_data
         else:
-            raise ValueError(f"Could not find a valid JSON object in the LLM response: {response.text}")
+            raise ValueError(f"Could not find a valid JSON object in the LLM response: {response_text}")
         
     except Exception as e:
+        if cache_key is not None:
+            drop_cached_response(cache_key)
+        if raise_errors:
+            raise
         print(f"Error during LLM call or JSON parsing: {e}")
         return {
             "question": f"Error generating question: {e}",
             "answer": "N/A"
-        }
\ No newline at end of file
+        }
+
+def is_valid_question(question_data):
+    """Checks that a parsed LLM element has non-empty 'question' and 'answer' strings."""
+    return (
+        isinstance(question_data, dict)
+        and isinstance(question_data.get("question"), str) and question_data["question"].strip() != ""
+        and isinstance(question_data.get("answer"), str) and question_data["answer"].strip() != ""
+    )
+
+@instrumented("llm.generate_questions_batch", items=len)
+def generate_questions_batch(vector_store, marks, difficulty, topics, n_results=None, raise_errors=False,
+                             fresh=False, cache_variant=0, contexts=None, limiter=None):
+    """
+    Generates several questions of the same mark value with a single LLM call.
+
+    Context is retrieved for every topic in one batched query (unless
+    pre-fetched contexts are passed in). Passages shared
+    between topics are included only once and each question is pointed at its
+    own passages, so the prompt stays compact.
+
+    Args:
+        vector_store: The ChromaDB collection to retrieve context from.
+        marks: The mark value shared by all questions in the batch.
+        difficulty: The difficulty label shared by all questions in the batch.
+        topics: One topic query per question to generate.
+        n_results: Number of passages retrieved per topic; defaults to enough
+                   to fill the context token budget for the mark value.
+        raise_errors: Raise quota errors instead of returning all-None results.
+        fresh: Bypass the LLM response cache.
+        cache_variant: See llm_cache_key.
+        contexts: Optional pre-fetched context chunks per topic; skips retrieval.
+        limiter: Optional rate limiter, taken only on a cache miss (see generate_text).
+
+    Returns:
+        A list aligned with topics, holding a question dict for every element
+        that parsed and validated, and None for every element that did not.
+    """
+    if contexts is None:
+        token_budget = context_token_budget(marks)
+        results = vector_store.query(query_texts=list(topics), n_results=n_results or context_query_size(token_budget))
+        contexts = [fit_to_budget(documents, token_budget) for documents in results['documents']]
+
+    # Number each distinct passage once and map every question to its passages
+    passages = []
+    passage_numbers = {}
+    question_passages = []
+    for documents in contexts:
+        numbers = []
+        for document in documents:
+            if document not in passage_numbers:
+                passages.append(document)
+                passage_numbers[document] = len(passages)
+            numbers.append(passage_numbers[document])
+        question_passages.append(numbers)
+
+    context = "\n\n".join(f"[Passage {i}]\n{passage}" for i, passage in enumerate(passages, start=1))
+    question_plan = "\n".join(
+        f"    Question {i}: use Passage(s) {', '.join(str(n) for n in numbers)}."
+        for i, numbers in enumerate(question_passages, start=1)
+    )
+    creative_instruction, marks_instruction = get_mark_instructions(marks)
+
+    prompt_template = f"""
+    You are an expert educator and question paper setter.
+    Your task is to generate {len(topics)} different questions based on the following passages.
+    
+    ---
+    {context}
+    ---
+    
+    Question plan:
+{question_plan}
+    
+    Task:
+    1. Generate exactly {len(topics)} questions, each fitting the Marks ({marks}) and Difficulty ({difficulty}), following the question plan above.
+    2. Questions MUST NOT include phrases like "Based on the text", "According to the context" or "In the passage".
+    3. {creative_instruction}
+    4. {marks_instruction}
+    5. Every question must be distinct from the others.
+    
+    Format:
+    Return the output strictly as a JSON array with one object per question, in plan order. Do not include any other text.
+    [
+      {{
+        "question": "Your generated question here",
+        "answer": "Your detailed answer/marking scheme here"
+      }}
+    ]
+    """
+
+    cache_key = None
+    try:
+        response_text, cache_key, cache_hit = generate_text(prompt_template, fresh, cache_variant, limiter)
+
+        match = re.search(r"\[.*\]", response_text, re.DOTALL)
+        if not match:
+            raise ValueError(f"Could not find a valid JSON array in the LLM response: {response_text}")
+        elements = json.loads(match.group(0))
+        if not isinstance(elements, list):
+            raise ValueError("LLM response was not a JSON array.")
+    except Exception as e:
+        if cache_key is not None:
+            drop_cached_response(cache_key)
+        if raise_errors and is_quota_error(e):
+            raise
+        print(f"Error during batched LLM call or JSON parsing: {e}")
+        return [None] * len(topics)
+
+    # Missing or malformed elements are returned as None for single-question fallback
+    questions = []
+    for i in range(len(topics)):
+        element = elements[i] if i < len(elements) else None
+        if is_valid_question(element):
+            element["cached"] = cache_hit
+            questions.append(element)
+        else:
+            questions.append(None)
+    return questions
@@ -1,33 +1,135 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
 from fpdf import FPDF
 
-def create_pdf(title, content):
+from src.instrumentation import instrumented
+
+# A Unicode TrueType font is used when available; otherwise the built-in
+# Arial/Helvetica core font is used and unsupported characters are replaced.
+PDF_FONT_PATH = os.getenv("EXAM_GEN_PDF_FONT")
+PDF_BOLD_FONT_PATH = os.getenv("EXAM_GEN_PDF_BOLD_FONT")
+FONT_CANDIDATES = [
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"),
+    ("/usr/share/fonts/dejavu/DejaVuSans.ttf", "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf"),
+    ("/Library/Fonts/Arial Unicode.ttf", None),
+    ("C:\\Windows\\Fonts\\arial.ttf", "C:\\Windows\\Fonts\\arialbd.ttf"),
+]
+PDF_CACHE_SIZE = 16  # Rendered PDFs kept in memory
+
+_pdf_cache = OrderedDict()
+_pdf_cache_lock = threading.Lock()
+
+def find_unicode_font():
     """
-    Creates a PDF document from a list of strings and returns it as bytes.
-    
-    Args:
-        title (str): The title of the document.
-        content (list): A list of strings, where each string is a paragraph.
-        
-    Returns:
-        bytes: The generated PDF file as a byte string.
+    Returns the (regular, bold) TTF paths to render with, or (None, None) to
+    use the core font. The bold path may be None if only a regular face exists.
+    """
+    if PDF_FONT_PATH and os.path.exists(PDF_FONT_PATH):
+        bold = PDF_BOLD_FONT_PATH if PDF_BOLD_FONT_PATH and os.path.exists(PDF_BOLD_FONT_PATH) else None
+        return PDF_FONT_PATH, bold
+    for regular, bold in FONT_CANDIDATES:
+        if os.path.exists(regular):
+            return regular, bold if bold and os.path.exists(bold) else None
+    return None, None
+
+def pdf_cache_key(title, content):
+    """Hashes everything that determines the rendered PDF: title, content and font."""
+    payload = json.dumps({"title": title, "content": list(content), "font": find_unicode_font()})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _split_bold(text):
+    """
+    Splits markdown text into (segment, is_bold) pairs on '**' markers. An
+    unmatched trailing '**' is kept as literal text.
     """
+    parts = text.split("**")
+    if len(parts) % 2 == 0:
+        parts[-2:] = ["**".join(parts[-2:])]
+    return [(part, i % 2 == 1) for i, part in enumerate(parts) if part]
+
+def _render_pdf(title, content):
     pdf = FPDF()
     pdf.add_page()
-    
+
+    regular_font, bold_font = find_unicode_font()
+    if regular_font:
+        family = "ExamFont"
+        pdf.add_font(family, "", regular_font)
+        pdf.add_font(family, "B", bold_font or regular_font)
+        clean = lambda text: text
+    else:
+        family = "Arial"
+        # The core font only covers latin-1, so other characters are replaced
+        clean = lambda text: text.encode('latin-1', 'replace').decode('latin-1')
+
     # Set title
-    pdf.set_font("Arial", 'B', 16)
-    pdf.cell(0, 10, title, 0, 1, 'C')
+    pdf.set_font(family, 'B', 16)
+    pdf.cell(0, 10, clean(title), 0, 1, 'C')
     pdf.ln(10) # Add a little space
 
-    # Set content font
-    pdf.set_font("Arial", '', 12)
-    
     for item in content:
-        # This encoding handles special characters for writing to the PDF cell
-        cleaned_item = item.encode('latin-1', 'replace').decode('latin-1')
-        pdf.multi_cell(0, 10, cleaned_item)
+        # Markdown bold (e.g. "**Q1.**") is rendered in bold instead of printing the asterisks
+        for segment, is_bold in _split_bold(clean(item)):
+            pdf.set_font(family, 'B' if is_bold else '', 12)
+            pdf.write(10, segment)
+        pdf.ln(10)
         pdf.ln(5) # Add space between questions/answers
 
     # Return the PDF content as bytes, which is what Streamlit's download button needs.
     # We explicitly convert the bytearray from .output() into bytes.
-    return bytes(pdf.output(dest='S'))
\ No newline at end of file
+    return bytes(pdf.output())
+
+@instrumented("pdf_rendering.create_pdf")
+def create_pdf(title, content):
+    """
+    Creates a PDF document from a list of strings and returns it as bytes.
+
+    Rendered PDFs are memoized by a hash of the title and content, so the
+    same paper is only laid out once per process.
+
+    Args:
+        title (str): The title of the document.
+        content (list): A list of strings, where each string is a paragraph.
+                        Markdown bold (**text**) is rendered in bold.
+
+    Returns:
+        bytes: The generated PDF file as a byte string.
+    """
+    key = pdf_cache_key(title, content)
+    with _pdf_cache_lock:
+        if key in _pdf_cache:
+            _pdf_cache.move_to_end(key)
+            return _pdf_cache[key]
+
+    pdf_bytes = _render_pdf(title, content)
+    with _pdf_cache_lock:
+        _pdf_cache[key] = pdf_bytes
+        while len(_pdf_cache) > PDF_CACHE_SIZE:
+            _pdf_cache.popitem(last=False)
+    return pdf_bytes
+
+@instrumented("pdf_rendering.create_pdf_bundle", items=len)
+def create_pdf_bundle(documents):
+    """
+    Renders several PDFs in one pass, e.g. the question papers and answer
+    keys of all paper variants, and packs them into a zip archive.
+
+    Args:
+        documents (list): (file_name, title, content) tuples; see create_pdf.
+
+    Returns:
+        tuple: A dict mapping each file name to its PDF bytes, and the zip
+               archive of all of them as bytes.
+    """
+    pdfs = {file_name: create_pdf(title, content) for file_name, title, content in documents}
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        for file_name, pdf_bytes in pdfs.items():
+            zf.writestr(file_name, pdf_bytes)
+    return pdfs, archive.getvalue()
@@ -0,0 +1,275 @@
+import os
+from collections import Counter
+
+import numpy as np
+
+from src.document_processor import iter_pdf_pages, iter_text_chunks, CHUNKING_PARAMS
+from src.chunk_dedup import strip_boilerplate, deduplicate_chunks, NearDuplicateIndex, DEDUP_PARAMS
+from src.embedding_handler import embedding_model_id
+from src.llm_handler import is_error_question
+from src.ingestion_cache import file_sha256, compute_cache_key, load_ingestion, save_ingestion
+from src.vector_store import get_file_collections, make_chunk_ids, embed_new_chunks, add_chunks, DocumentSetIndex
+from src.uniqueness_filter import select_unique_questions, embed_questions, select_diverse_indices
+from src.topic_modeler import get_document_topics
+from src.retrieval_index import build_topic_index
+from src.instrumentation import instrumented
+
+# Everything that determines the stored chunks and their vectors; part of the cache key, the
+# chunk ids and the collection names, so switching the embedding backend never mixes vectors
+INGESTION_PARAMS = {**CHUNKING_PARAMS, **DEDUP_PARAMS, "embedding_model": embedding_model_id()}
+
+VARIANT_LABELS = "ABCDEFGH"  # Names of the paper variants; also caps their number
+
+# Per mark value: (difficulty, topic_base, over_gen_count)
+MARK_LEVELS = {
+    1: ("very easy", "a key-term definition", 2),
+    2: ("easy", "a simple definition or concept", 3),
+    3: ("short answer", "a concept with an example", 3),
+    4: ("medium", "an explanation of a process", 2),
+    5: ("long answer", "an application or comparison", 2),
+    10: ("essay", "a detailed analysis or synthesis", 1),
+}
+
+def build_exam_structure(counts):
+    """
+    Builds the exam structure used by the generation scheduler.
+
+    Args:
+        counts: A dict mapping marks to the number of questions wanted.
+
+    Returns:
+        A dict mapping marks to (count, difficulty, topic_base, over_gen_count).
+    """
+    return {
+        marks: (counts.get(marks, 0), difficulty, topic_base, over_gen_count)
+        for marks, (difficulty, topic_base, over_gen_count) in MARK_LEVELS.items()
+    }
+
+def _record_page_texts(pages, page_texts):
+    """Passes a page stream through while keeping each page's text for the ingestion cache."""
+    for page_number, text in pages:
+        page_texts.append(text)
+        yield page_number, text
+
+@instrumented("ingestion")
+def ingest_documents(pdf_files, progress=print, topic_mode="auto"):
+    """
+    Runs the ingestion pipeline (extraction, boilerplate stripping, chunking,
+    near-duplicate removal, embedding, topic modeling and indexing) for a set
+    of PDFs, reusing cached results.
+
+    Args:
+        pdf_files: Uploaded PDF file objects or open binary files.
+        progress: Callback receiving human-readable status messages.
+        topic_mode: Topic modeling mode, see get_document_topics.
+
+    Returns:
+        A dict with collection (a DocumentSetIndex), topics, file_hashes, chunks, chunk_ids,
+        chunk_metadata, embeddings, chunk_topics, topic_index and
+        dedup_stats (boilerplate lines and duplicate chunks removed).
+    """
+    file_hashes = [file_sha256(pdf) for pdf in pdf_files]
+    cache_key = compute_cache_key(file_hashes, {**INGESTION_PARAMS, "topic_mode": topic_mode})
+    collections = get_file_collections(file_hashes, INGESTION_PARAMS)
+    cached = load_ingestion(cache_key)
+    if cached is not None:
+        progress("Loading previously processed documents from cache...")
+        text_chunks = cached["chunks"]
+        chunk_ids = cached["chunk_ids"]
+        chunk_metadata = cached["chunk_metadata"]
+        embeddings = cached["embeddings"]
+        topics = cached["topics"]
+        chunk_topics = cached["chunk_topics"]
+        dedup_stats = cached["stats"]
+    else:
+        progress("Reading and chunking text...")
+        raw_texts, text_chunks, chunk_ids, chunk_metadata, chunk_files = [], [], [], [], []
+        dedup_stats = {"boilerplate_lines": 0, "chunks_before": 0, "duplicate_chunks": 0}
+        duplicate_index = NearDuplicateIndex()  # Shared, so duplicates across files are caught too
+        for pdf, file_hash in zip(pdf_files, file_hashes):
+            page_texts = []
+            pages = strip_boilerplate(_record_page_texts(iter_pdf_pages(pdf), page_texts), dedup_stats)
+            file_chunks = list(iter_text_chunks(pages, os.path.basename(pdf.name)))
+            raw_texts.append("".join(page_texts))
+            # Ids are assigned before deduplication, so a chunk's id only depends on its own file
+            file_ids = make_chunk_ids(file_hash, len(file_chunks), INGESTION_PARAMS)
+            kept = deduplicate_chunks([chunk for chunk, _ in file_chunks], duplicate_index)
+            dedup_stats["chunks_before"] += len(file_chunks)
+            dedup_stats["duplicate_chunks"] += len(file_chunks) - len(kept)
+            text_chunks.extend(file_chunks[i][0] for i in kept)
+            chunk_metadata.extend(file_chunks[i][1] for i in kept)
+            chunk_ids.extend(file_ids[i] for i in kept)
+            chunk_files.extend([file_hash] * len(kept))
+        progress(f"Removed {dedup_stats['boilerplate_lines']} header/footer lines and "
+                 f"{dedup_stats['duplicate_chunks']} near-duplicate chunks "
+                 f"({len(text_chunks)} of {dedup_stats['chunks_before']} chunks kept).")
+
+        progress("Creating text embeddings...")
+        embeddings, num_new = embed_new_chunks(collections, chunk_ids, text_chunks)
+        progress(f"Embedded {num_new} new chunks, reused {len(chunk_ids) - num_new} already indexed.")
+
+        progress("Identifying main topics...")
+        topics, chunk_topics = get_document_topics(
+            text_chunks, embeddings=embeddings, return_assignments=True,
+            mode=topic_mode, document_ids=chunk_files)
+        save_ingestion(cache_key, "".join(raw_texts), text_chunks, chunk_ids,
+                       chunk_metadata, embeddings, topics, chunk_topics, stats=dedup_stats)
+
+    progress("Building the vector knowledge base...")
+    add_chunks(collections, chunk_ids, text_chunks, embeddings, chunk_metadata)
+
+    progress("Precomputing topic retrieval neighborhoods...")
+    topic_index = build_topic_index(text_chunks, embeddings, topics, chunk_topics,
+                                    chunk_metadata=chunk_metadata)
+    return {
+        "collection": DocumentSetIndex(collections, chunk_ids),
+        "topics": topics,
+        "file_hashes": file_hashes,
+        "chunks": text_chunks,
+        "chunk_ids": chunk_ids,
+        "chunk_metadata": chunk_metadata,
+        "embeddings": embeddings,
+        "chunk_topics": chunk_topics,
+        "topic_index": topic_index,
+        "dedup_stats": dedup_stats,
+    }
+
+def _count_shortfall(stats, marks, wanted, selected):
+    if selected < wanted:
+        shortfall = stats.setdefault("shortfall", {})
+        shortfall[marks] = shortfall.get(marks, 0) + wanted - selected
+
+@instrumented("dedup.select_paper_questions", items=len)
+def select_paper_questions(pools, exam_structure, stats=None):
+    """
+    Picks the final questions for each mark bucket from the over-generated
+    pools, filtering duplicates both within and across buckets. Placeholders
+    of failed generations (see is_error_question) are never selected.
+
+    Args:
+        pools: A dict mapping marks to candidate question dicts.
+        exam_structure: See build_exam_structure.
+        stats: Optional dict; "failed_questions" counts the dropped
+               placeholders, and "shortfall" maps marks to the number of
+               questions missing from that bucket.
+
+    Returns:
+        A list of (marks, question_data) tuples in paper order.
+    """
+    stats = stats if stats is not None else {}
+    selected = []
+    accepted_embeddings = None  # Paper-wide, so duplicates across mark buckets are caught
+    for marks, config in exam_structure.items():
+        count = config[0]
+        if count > 0:
+            pool = pools.get(marks, [])
+            candidates = [q_data for q_data in pool if not is_error_question(q_data)]
+            stats["failed_questions"] = stats.get("failed_questions", 0) + len(pool) - len(candidates)
+            unique_questions, selected_embeddings = select_unique_questions(
+                candidates, count,
+                accepted_embeddings=accepted_embeddings, return_embeddings=True)
+            if selected_embeddings is not None and len(selected_embeddings):
+                accepted_embeddings = selected_embeddings if accepted_embeddings is None \
+                    else np.vstack([accepted_embeddings, selected_embeddings])
+            selected.extend((marks, q_data) for q_data in unique_questions)
+            _count_shortfall(stats, marks, count, len(unique_questions))
+    return selected
+
+def _deal_to_variants(candidates, count, num_variants):
+    """
+    Deals (topic, question_data) candidates to variants of count questions.
+
+    Candidates are dealt longest answer first, and variant sizes never differ
+    by more than one, so every variant gets a similar mix of demanding and
+    quick questions. Each candidate goes to the variant with the fewest
+    questions on its topic among those that may take one.
+
+    Returns:
+        One list of candidate positions per variant, in pool order.
+    """
+    order = sorted(range(len(candidates)), key=lambda i: -len(candidates[i][1]["answer"]))
+    assigned = [[] for _ in range(num_variants)]
+    topic_counts = [Counter() for _ in range(num_variants)]
+    for i in order:
+        open_variants = [v for v in range(num_variants) if len(assigned[v]) < count]
+        if not open_variants:
+            break
+        smallest = min(len(assigned[v]) for v in open_variants)
+        open_variants = [v for v in open_variants if len(assigned[v]) <= smallest + 1]
+        topic = candidates[i][0]
+        variant = min(open_variants, key=lambda v: (topic_counts[v][topic], len(assigned[v]), v))
+        assigned[variant].append(i)
+        topic_counts[variant][topic] += 1
+    return [sorted(positions) for positions in assigned]
+
+@instrumented("dedup.select_variant_questions", items=len)
+def select_variant_questions(results, exam_structure, num_variants, stats=None):
+    """
+    Assigns the questions of one shared candidate pool to several equivalent
+    paper variants (sets A, B, ...), see plan_generation_tasks.
+
+    All candidates of a bucket are embedded once, and the questions used on
+    any variant are kept mutually dissimilar across all variants and buckets,
+    so no two variants (and no two questions of one paper) share a question.
+    Every variant has the same mark structure, and so the same difficulty
+    levels; topics are spread evenly across variants (see _deal_to_variants).
+    Placeholders of failed generations are dropped from the pool first.
+
+    Args:
+        results: (task, question_data) tuples from run_generation_plan.
+        exam_structure: See build_exam_structure; counts are per variant.
+        num_variants: Number of variants, at most len(VARIANT_LABELS).
+        stats: Optional dict, see select_paper_questions; the shortfall is
+               summed over all variants.
+
+    Returns:
+        One list of (marks, question_data) tuples per variant, in paper order.
+        If the pool holds too few distinct questions, the shortfall is spread
+        over the variants.
+    """
+    stats = stats if stats is not None else {}
+    pools = {}
+    for task, q_data in sorted(results, key=lambda r: r[0]["index"]):
+        if is_error_question(q_data):
+            stats["failed_questions"] = stats.get("failed_questions", 0) + 1
+            continue
+        pools.setdefault(task["marks"], []).append((task["topic"], q_data))
+
+    variants = [[] for _ in range(num_variants)]
+    accepted_embeddings = None  # Across variants and buckets
+    for marks, config in exam_structure.items():
+        count = config[0]
+        candidates = pools.get(marks, [])
+        if count <= 0:
+            continue
+        if not candidates:
+            _count_shortfall(stats, marks, count * num_variants, 0)
+            continue
+        embeddings = embed_questions([q_data for _, q_data in candidates])
+        indices = select_diverse_indices(embeddings, count * num_variants, accepted_embeddings=accepted_embeddings)
+        if indices:
+            accepted_embeddings = embeddings[indices] if accepted_embeddings is None \
+                else np.vstack([accepted_embeddings, embeddings[indices]])
+        unique = [candidates[i] for i in sorted(indices)]
+        dealt = _deal_to_variants(unique, count, num_variants)
+        for variant, positions in zip(variants, dealt):
+            variant.extend((marks, unique[i][1]) for i in positions)
+        _count_shortfall(stats, marks, count * num_variants, sum(len(positions) for positions in dealt))
+    return variants
+
+def format_exam(selected):
+    """
+    Formats selected questions as numbered question paper and answer key entries.
+
+    Args:
+        selected: A list of (marks, question_data) tuples.
+
+    Returns:
+        A (question_paper, answer_key) tuple of lists of markdown strings.
+    """
+    question_paper = []
+    answer_key = []
+    for marks, q_data in selected:
+        question_paper.append(f"**Q{len(question_paper) + 1}.** {q_data['question']} ({marks} Marks)")
+        answer_key.append(f"**A{len(answer_key) + 1}.** {q_data['answer']}")
+    return question_paper, answer_key
@@ -0,0 +1,188 @@
+import json
+import os
+import random
+
+from src.generation_scheduler import run_generation_plan
+from src.ingestion_cache import CACHE_DIR
+from src.llm_handler import is_error_question
+from src.pipeline import MARK_LEVELS
+from src.uniqueness_filter import embed_questions, select_first_unique_indices
+from src.instrumentation import instrumented
+
+BANK_DIR = os.path.join(CACHE_DIR, "question_banks")
+
+def _bank_paths(document_set_id):
+    """Returns the (checkpoint_path, bank_path) for a document set."""
+    base = os.path.join(BANK_DIR, document_set_id)
+    return f"{base}.checkpoint.jsonl", f"{base}.bank.json"
+
+def plan_bank_tasks(topics, marks_levels=None, questions_per_topic=2):
+    """
+    Plans one generation task per (topic, mark level, repetition), so every
+    topic is covered at every requested mark level.
+
+    Each task has a stable "key" that does not depend on its position, which
+    is what makes interrupted builds resumable.
+
+    Args:
+        topics: The list of topic names from get_document_topics.
+        marks_levels: Mark values to cover. Defaults to every level in MARK_LEVELS.
+        questions_per_topic: Questions generated per topic and mark level.
+
+    Returns:
+        A list of task dicts in the generation scheduler's format.
+    """
+    tasks = []
+    for marks in (marks_levels or list(MARK_LEVELS)):
+        difficulty, topic_base, _ = MARK_LEVELS[marks]
+        for topic in topics:
+            for variant in range(questions_per_topic):
+                tasks.append({
+                    "index": len(tasks),
+                    "key": f"{marks}|{topic}|{variant}",
+                    "marks": marks,
+                    "difficulty": difficulty,
+                    "topic": topic,
+                    "topic_query": f"{topic_base} related to '{topic}'",
+                    "variant": variant,
+                })
+    return tasks
+
+def _load_checkpoint(checkpoint_path):
+    """Reads completed bank records from the checkpoint file, keyed by task key."""
+    done = {}
+    if not os.path.exists(checkpoint_path):
+        return done
+    with open(checkpoint_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A partially written last line from an interrupted run
+            done[record["key"]] = record
+    return done
+
+@instrumented("dedup.deduplicate_bank", items=len)
+def deduplicate_bank(records):
+    """
+    Removes near-duplicate questions across the whole bank, keeping the first
+    occurrence of each (see select_first_unique_indices).
+
+    Returns:
+        The list of unique records, in their original order.
+    """
+    if not records:
+        return []
+    embeddings = embed_questions(records)
+    return [records[i] for i in select_first_unique_indices(embeddings)]
+
+@instrumented("question_bank.build", items=len)
+def build_question_bank(vector_store, topics, document_set_id, marks_levels=None, questions_per_topic=2,
+                        max_workers=4, requests_per_minute=15, batch_size=4, topic_index=None, progress=print):
+    """
+    Pre-generates a deduplicated question bank for a document set.
+
+    Every finished question is appended to a checkpoint file immediately, so
+    an interrupted build resumes where it stopped. Failed generations are not
+    checkpointed and are retried on the next run.
+
+    Args:
+        vector_store: The ChromaDB collection of the document set.
+        topics: The list of topic names from get_document_topics.
+        document_set_id: The content hash of the document set (see document_set_id).
+        marks_levels: Mark values to cover. Defaults to every level.
+        questions_per_topic: Questions generated per topic and mark level.
+        max_workers, requests_per_minute, batch_size, topic_index: Passed to run_generation_plan.
+        progress: Callback receiving human-readable status messages.
+
+    Returns:
+        The list of bank records (dicts with key, marks, topic, question and answer).
+    """
+    os.makedirs(BANK_DIR, exist_ok=True)
+    checkpoint_path, bank_path = _bank_paths(document_set_id)
+    tasks = plan_bank_tasks(topics, marks_levels, questions_per_topic)
+    done = _load_checkpoint(checkpoint_path)
+    pending = [task for task in tasks if task["key"] not in done]
+    progress(f"{len(tasks) - len(pending)} of {len(tasks)} bank questions already generated.")
+
+    failed = 0
+    with open(checkpoint_path, "a+", encoding="utf-8") as checkpoint:
+        if checkpoint.tell():
+            checkpoint.seek(checkpoint.tell() - 1)
+            if checkpoint.read(1) != "\n":
+                checkpoint.write("\n")  # End a partially written line from an interrupted run
+        for task, q_data in run_generation_plan(
+                vector_store, pending, max_workers=max_workers,
+                requests_per_minute=requests_per_minute, batch_size=batch_size, topic_index=topic_index):
+            if is_error_question(q_data):
+                failed += 1
+                continue
+            record = {
+                "key": task["key"],
+                "marks": task["marks"],
+                "topic": task["topic"],
+                "question": q_data["question"],
+                "answer": q_data["answer"],
+            }
+            checkpoint.write(json.dumps(record) + "\n")
+            checkpoint.flush()
+            done[task["key"]] = record
+            progress(f"Generated {len(done)} of {len(tasks)} bank questions.")
+
+    if failed:
+        progress(f"{failed} generations failed; rerun the build to retry them.")
+
+    ordered = [done[task["key"]] for task in tasks if task["key"] in done]
+    bank = deduplicate_bank(ordered)
+    progress(f"Removed {len(ordered) - len(bank)} near-duplicate questions; bank has {len(bank)}.")
+
+    tmp_path = f"{bank_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(bank, f)
+    os.replace(tmp_path, bank_path)
+    return bank
+
+def load_question_bank(document_set_id):
+    """Returns the built question bank for a document set, or None if there is none."""
+    _, bank_path = _bank_paths(document_set_id)
+    if not os.path.exists(bank_path):
+        return None
+    with open(bank_path, encoding="utf-8") as f:
+        return json.load(f)
+
+def sample_paper(bank, exam_structure, seed=None):
+    """
+    Assembles a paper by sampling the question bank, rotating through topics
+    within each mark bucket so the paper stays balanced.
+
+    Args:
+        bank: The list of bank records.
+        exam_structure: See build_exam_structure; only the counts are used.
+        seed: Optional random seed for reproducible papers.
+
+    Returns:
+        A list of (marks, question_data) tuples in paper order. A bucket gets
+        fewer questions if the bank does not hold enough for it.
+    """
+    rng = random.Random(seed)
+    selected = []
+    for marks, config in exam_structure.items():
+        count = config[0]
+        if count <= 0:
+            continue
+        by_topic = {}
+        for record in bank:
+            if record["marks"] == marks:
+                by_topic.setdefault(record["topic"], []).append(record)
+        topic_queues = list(by_topic.values())
+        rng.shuffle(topic_queues)
+        for queue in topic_queues:
+            rng.shuffle(queue)
+
+        picked = 0
+        while picked < count and any(topic_queues):
+            for queue in topic_queues:
+                if queue and picked < count:
+                    selected.append((marks, queue.pop()))
+                    picked += 1
+    return selected
@@ -0,0 +1,214 @@
+import numpy as np
+
+from src.embedding_handler import normalize_embeddings
+from src.instrumentation import instrumented
+
+TOPIC_NEIGHBORS = 15  # Chunks precomputed per topic neighborhood
+QUERY_BATCH_SIZE = 64  # Query texts sent to Chroma per query() call
+
+# Context token budget per question: CONTEXT_BASE_TOKENS + CONTEXT_TOKENS_PER_MARK * marks,
+# i.e. ~470 tokens for a 1-mark definition and ~2,000 for a 10-mark essay.
+CONTEXT_BASE_TOKENS = 300
+CONTEXT_TOKENS_PER_MARK = 170
+CHARS_PER_TOKEN = 4  # Rough estimate for English text; avoids a tokenizer dependency
+CONTEXT_SEEDS = 3  # Most relevant chunks taken before expanding to neighboring chunks
+MIN_MERGE_OVERLAP = 20  # Shortest repeated text treated as overlap when merging adjacent chunks
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def context_token_budget(marks):
+    """Returns how many context tokens a question of the given mark value gets."""
+    return CONTEXT_BASE_TOKENS + CONTEXT_TOKENS_PER_MARK * marks
+
+def context_query_size(token_budget, minimum=CONTEXT_SEEDS):
+    """Returns how many chunks to retrieve so that fit_to_budget can fill token_budget."""
+    return max(minimum, token_budget // (CONTEXT_BASE_TOKENS // 2))
+
+def _merge_overlap(previous, following):
+    """Joins two consecutive passages, dropping text the second repeats from the end of the first."""
+    for size in range(min(len(previous), len(following)), MIN_MERGE_OVERLAP - 1, -1):
+        if previous.endswith(following[:size]):
+            return previous + following[size:]
+    return previous + " " + following
+
+def fit_to_budget(documents, token_budget):
+    """
+    Takes retrieved documents in relevance order until the token budget is
+    used up, skipping exact duplicates and documents contained in one
+    already taken. The most relevant document is always kept.
+    """
+    passages = []
+    used = 0
+    for document in dict.fromkeys(documents):
+        if any(document in passage for passage in passages):
+            continue
+        cost = estimate_tokens(document)
+        if passages and used + cost > token_budget:
+            continue
+        passages.append(document)
+        used += cost
+    return passages
+
+@instrumented("retrieval.build_topic_index")
+def build_topic_index(chunks, embeddings, topics, chunk_topics=None, n_neighbors=TOPIC_NEIGHBORS,
+                      chunk_metadata=None):
+    """
+    Precomputes a retrieval neighborhood for every topic at ingestion time.
+
+    Each topic's centroid is the mean embedding of the chunks BERTopic
+    assigned to it (or of all chunks, if the topic has no assigned chunks).
+    Its neighborhood is the n_neighbors chunks closest to that centroid.
+
+    Args:
+        chunks: The list of text chunks.
+        embeddings: The chunk embeddings, aligned with chunks.
+        topics: The list of topic names.
+        chunk_topics: The topic name of every chunk, from get_document_topics.
+        n_neighbors: How many chunks to keep per topic.
+        chunk_metadata: Per-chunk provenance ("source" keys), so context
+                        expansion never joins chunks of different files.
+
+    Returns:
+        A dict with "chunks", "sources" and "neighbors" (topic name -> list
+        of chunk positions, most similar first).
+    """
+    normalized = normalize_embeddings(embeddings)
+    global_centroid = normalized.mean(axis=0)
+
+    centroids = []
+    for topic in topics:
+        members = [i for i, t in enumerate(chunk_topics or []) if t == topic]
+        centroids.append(normalized[members].mean(axis=0) if members else global_centroid)
+    similarities = normalize_embeddings(centroids) @ normalized.T
+
+    k = min(n_neighbors, len(chunks))
+    neighbors = {}
+    for topic, row in zip(topics, similarities):
+        top = np.argpartition(-row, k - 1)[:k]
+        neighbors[topic] = [int(i) for i in top[np.argsort(-row[top])]]
+    sources = [metadata.get("source") for metadata in chunk_metadata] if chunk_metadata is not None else None
+    return {"chunks": chunks, "sources": sources, "neighbors": neighbors}
+
+def get_topic_context(topic_index, topic, token_budget, rotation=0, n_seeds=CONTEXT_SEEDS):
+    """
+    Assembles the context for a topic under a token budget.
+
+    The n_seeds most relevant chunks of the topic's neighborhood are taken
+    first, then expanded with their neighboring chunks in the document
+    (the text just before and after), then further neighborhood chunks,
+    until the budget is used. Adjacent chunks are merged into one passage
+    with any overlapping text removed.
+
+    Successive rotations start at different chunks of the neighborhood, so
+    repeated questions on a topic see different context.
+
+    Returns:
+        A list of passages, most relevant first, or None if the topic has
+        no neighborhood.
+    """
+    neighborhood = topic_index["neighbors"].get(topic)
+    if not neighborhood:
+        return None
+    chunks = topic_index["chunks"]
+    sources = topic_index.get("sources")
+    start = (rotation * n_seeds) % len(neighborhood)
+    seeds = neighborhood[start:] + neighborhood[:start]
+
+    selected = []  # Chunk positions in selection (relevance) order
+    used = 0
+
+    def try_add(position):
+        nonlocal used
+        if position in selected or not 0 <= position < len(chunks):
+            return
+        cost = estimate_tokens(chunks[position])
+        if selected and used + cost > token_budget:
+            return
+        selected.append(position)
+        used += cost
+
+    def same_document(a, b):
+        return sources is None or sources[a] == sources[b]
+
+    for position in seeds[:n_seeds]:
+        try_add(position)
+    for position in seeds:
+        try_add(position)
+        if position in selected:
+            for neighbor in (position - 1, position + 1):
+                if 0 <= neighbor < len(chunks) and same_document(position, neighbor):
+                    try_add(neighbor)
+        if used >= token_budget:
+            break
+
+    # Merge runs of adjacent chunks into passages, ordered by their most relevant chunk
+    rank = {position: i for i, position in enumerate(selected)}
+    runs = []
+    for position in sorted(selected):
+        if runs and position == runs[-1][-1] + 1 and same_document(runs[-1][-1], position):
+            runs[-1].append(position)
+        else:
+            runs.append([position])
+    runs.sort(key=lambda run: min(rank[p] for p in run))
+
+    passages = []
+    for run in runs:
+        passage = chunks[run[0]]
+        for position in run[1:]:
+            passage = _merge_overlap(passage, chunks[position])
+        passages.append(passage)
+    return passages
+
+@instrumented("retrieval.query", items=len)
+def query_contexts(vector_store, query_texts, n_results=3):
+    """
+    Runs one batched vector search for many query texts.
+
+    Returns:
+        A dict mapping each distinct query text to its list of documents.
+    """
+    unique_queries = list(dict.fromkeys(query_texts))
+    contexts = {}
+    for start in range(0, len(unique_queries), QUERY_BATCH_SIZE):
+        batch = unique_queries[start:start + QUERY_BATCH_SIZE]
+        results = vector_store.query(query_texts=batch, n_results=n_results)
+        contexts.update(zip(batch, results['documents']))
+    return contexts
+
+@instrumented("retrieval.attach_contexts", items=len)
+def attach_contexts(tasks, vector_store=None, topic_index=None, n_results=CONTEXT_SEEDS):
+    """
+    Pre-fetches the retrieval context of every planned task before generation
+    starts, so LLM workers never wait on vector search.
+
+    Every task gets a context token budget that scales with its marks (see
+    context_token_budget). With a topic index, each task's context is
+    assembled from its topic's precomputed neighborhood, rotating per mark
+    value and topic, so tasks added to one bucket never shift the contexts
+    (and cached prompts) of another.
+    Otherwise all task queries are resolved with one batched vector search,
+    retrieving enough results to fill the largest budget.
+
+    Tasks that already carry context (e.g. when a paused generation is
+    resumed) keep it, so their prompts stay the same.
+    """
+    if topic_index is not None:
+        rotations = {}
+        for task in tasks:
+            key = (task["marks"], task["topic"])
+            rotation = rotations.get(key, 0)
+            rotations[key] = rotation + 1
+            if not task.get("context_chunks"):
+                # Offset by marks, so buckets asking about the same topic start at different chunks
+                task["context_chunks"] = get_topic_context(
+                    topic_index, task["topic"], context_token_budget(task["marks"]), rotation + task["marks"], n_results)
+
+    missing = [task for task in tasks if not task.get("context_chunks")]
+    if missing and vector_store is not None:
+        largest_budget = max(context_token_budget(task["marks"]) for task in missing)
+        contexts = query_contexts(vector_store, [task["topic_query"] for task in missing],
+                                  context_query_size(largest_budget, n_results))
+        for task in missing:
+            task["context_chunks"] = fit_to_budget(contexts[task["topic_query"]], context_token_budget(task["marks"]))
+    return tasks
@@ -0,0 +1,359 @@
+"""
+Job queue and worker pool behind the HTTP API (see api.py).
+
+Documents are ingested and exams generated as background jobs, so API
+requests return immediately and clients poll or stream job progress. Jobs
+are scheduled round-robin across tenants, and all jobs of the process share
+the embedding model, the vector store collections and one LLM rate limit.
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import closing
+
+from src.generation_scheduler import TokenBucketLimiter, plan_generation_tasks, run_generation_plan, group_results_by_marks
+from src.ingestion_cache import CACHE_DIR
+from src.instrumentation import trace_run
+from src.pipeline import (ingest_documents, build_exam_structure, select_paper_questions, select_variant_questions,
+                          format_exam, VARIANT_LABELS)
+from src.vector_store import document_set_id
+
+UPLOAD_DIR = os.path.join(CACHE_DIR, "uploads")
+SERVICE_WORKERS = int(os.getenv("EXAM_GEN_API_WORKERS", "2"))  # Jobs running at once per process
+SERVICE_REQUESTS_PER_MINUTE = int(os.getenv("EXAM_GEN_API_RPM", "15"))  # Shared by all jobs
+MAX_FINISHED_JOBS = 1000  # Finished jobs kept for polling before the oldest are forgotten
+FINISHED_STATES = ("complete", "failed", "cancelled")
+
+
+class FairJobQueue:
+    """
+    A blocking job queue with one FIFO per tenant. get() serves tenants
+    round-robin, so one tenant submitting many jobs cannot starve the others.
+    """
+
+    def __init__(self):
+        self._queues = {}
+        self._tenants = deque()  # Tenants with pending jobs, in serving order
+        self._condition = threading.Condition()
+
+    def put(self, tenant, job_id):
+        with self._condition:
+            if tenant not in self._queues:
+                self._queues[tenant] = deque()
+                self._tenants.append(tenant)
+            self._queues[tenant].append(job_id)
+            self._condition.notify()
+
+    def get(self):
+        """Blocks until a job is pending and returns the next job id in fair order."""
+        with self._condition:
+            while not self._tenants:
+                self._condition.wait()
+            tenant = self._tenants.popleft()
+            queue = self._queues[tenant]
+            job_id = queue.popleft()
+            if queue:
+                self._tenants.append(tenant)
+            else:
+                del self._queues[tenant]
+            return job_id
+
+    def __len__(self):
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+
+class ExamService:
+    """
+    Runs ingestion and exam generation jobs on a pool of worker threads.
+
+    Args:
+        num_workers: Number of jobs processed concurrently.
+        requests_per_minute: LLM rate limit shared by all running jobs.
+    """
+
+    def __init__(self, num_workers=SERVICE_WORKERS, requests_per_minute=SERVICE_REQUESTS_PER_MINUTE):
+        self.jobs = {}
+        self.document_sets = {}
+        self.lock = threading.Lock()
+        self.queue = FairJobQueue()
+        self.limiter = TokenBucketLimiter(requests_per_minute)
+        self.workers = [
+            threading.Thread(target=self._work, name=f"exam-gen-job-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    # --- SUBMISSION ---
+
+    def _job(self, tenant, kind, params):
+        return {
+            "id": uuid.uuid4().hex,
+            "tenant": tenant,
+            "kind": kind,
+            "status": "queued",
+            "progress": {},
+            "error": None,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "updated": time.time(),
+            "params": params,
+            "result": None,
+            "cancel_requested": False,
+        }
+
+    def _new_job(self, tenant, kind, params):
+        job = self._job(tenant, kind, params)
+        with self.lock:
+            self.jobs[job["id"]] = job
+            self._forget_old_jobs()
+        self.queue.put(tenant, job["id"])
+        return job
+
+    def _forget_old_jobs(self):
+        finished = [job for job in self.jobs.values() if job["status"] in FINISHED_STATES]
+        for job in sorted(finished, key=lambda j: j["finished"])[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job["id"]]
+
+    def submit_ingestion(self, tenant, files, topic_mode="auto"):
+        """
+        Stores uploaded PDFs and queues their ingestion.
+
+        Args:
+            tenant: The tenant submitting the job.
+            files: A list of (filename, pdf_bytes) tuples.
+            topic_mode: Topic modeling mode, see get_document_topics.
+
+        Returns:
+            A (document_set_id, job) tuple. If the same documents are already
+            ingested or being ingested, they are not ingested again: the
+            tenant gets a job that is already complete, or one that follows
+            the running ingestion.
+        """
+        file_hashes = [hashlib.sha256(data).hexdigest() for _, data in files]
+        set_id = document_set_id(file_hashes)
+        with self.lock:
+            existing = self.document_sets.get(set_id)
+            if existing is not None and existing["status"] != "failed":
+                # Not queued: the tenant's job completes with (or already has) the existing ingestion
+                existing["tenants"].add(tenant)
+                job = self._job(tenant, "ingest", {"document_set_id": set_id, "follows": True})
+                if existing["status"] == "ready":
+                    job.update(status="complete", progress={"message": "Documents were already ingested."},
+                               started=job["created"], finished=job["created"])
+                else:
+                    existing["followers"].append(job["id"])
+                    self._mirror(self.jobs[existing["job_id"]], job)
+                self.jobs[job["id"]] = job
+                self._forget_old_jobs()
+                return set_id, job
+            # Registered before the files are stored and the job is queued, so identical uploads are not ingested twice
+            job = self._job(tenant, "ingest", {"document_set_id": set_id, "topic_mode": topic_mode})
+            self.jobs[job["id"]] = job
+            self._forget_old_jobs()
+            tenants = existing["tenants"] if existing is not None else set()
+            self.document_sets[set_id] = {"status": "ingesting", "job_id": job["id"], "followers": [],
+                                          "tenants": tenants | {tenant}, "files": [name for name, _ in files]}
+
+        set_dir = os.path.join(UPLOAD_DIR, set_id[:32])
+        os.makedirs(set_dir, exist_ok=True)
+        paths = []
+        for i, (filename, data) in enumerate(files):
+            path = os.path.join(set_dir, f"{i}-{os.path.basename(filename or 'document.pdf')}")
+            with open(path, "wb") as f:
+                f.write(data)
+            paths.append(path)
+
+        job["params"]["paths"] = paths
+        self.queue.put(tenant, job["id"])
+        return set_id, job
+
+    def submit_exam(self, tenant, set_id, counts, batch_size=4, max_workers=4, fresh=False, num_variants=1):
+        """
+        Queues an exam generation job for an ingested document set.
+
+        Args:
+            counts: A dict mapping marks to the number of questions wanted.
+            num_variants: Number of paper variants (sets A, B, ...) generated
+                          from one shared question pool.
+
+        Raises:
+            KeyError: If the document set is unknown (or was not uploaded by the tenant).
+            ValueError: If the document set is not ingested (yet).
+        """
+        with self.lock:
+            document_set = self.document_sets.get(set_id)
+        if document_set is None or tenant not in document_set["tenants"]:
+            raise KeyError(set_id)
+        if document_set["status"] != "ready":
+            raise ValueError(f"Document set is {document_set['status']}, not ready.")
+        return self._new_job(tenant, "exam", {
+            "document_set_id": set_id, "counts": counts,
+            "batch_size": batch_size, "max_workers": max_workers, "fresh": fresh,
+            "num_variants": num_variants,
+        })
+
+    # --- QUERIES ---
+
+    def get_job(self, job_id, tenant=None):
+        """Returns a JSON-serializable snapshot of a job, or None if unknown (or owned by another tenant)."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or (tenant is not None and job["tenant"] != tenant):
+                return None
+            snapshot = {key: value for key, value in job.items() if key not in ("params", "cancel_requested")}
+            snapshot["document_set_id"] = job["params"]["document_set_id"]
+            return snapshot
+
+    def get_document_set(self, set_id, tenant=None):
+        """Returns the status, files and topics of a document set, or None if unknown (or not uploaded by the tenant)."""
+        with self.lock:
+            document_set = self.document_sets.get(set_id)
+            if document_set is None or (tenant is not None and tenant not in document_set["tenants"]):
+                return None
+            hidden = ("collection", "topic_index", "tenants", "followers")
+            return {"document_set_id": set_id,
+                    **{key: value for key, value in document_set.items() if key not in hidden}}
+
+    def cancel_job(self, job_id, tenant=None):
+        """
+        Cancels a queued job, or stops a running exam job after its in-flight
+        LLM requests (a running ingestion always completes). Returns False if
+        the job is unknown.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or (tenant is not None and job["tenant"] != tenant):
+                return False
+            if job["params"].get("follows"):
+                # Only this tenant's job is cancelled; the ingestion itself continues for the others
+                if job["status"] not in FINISHED_STATES:
+                    self.document_sets[job["params"]["document_set_id"]]["followers"].remove(job["id"])
+                    self._finish(job, "cancelled")
+            elif job["status"] == "queued":
+                self._finish(job, "cancelled")
+                if job["kind"] == "ingest":
+                    self.document_sets[job["params"]["document_set_id"]].update(status="failed", error="Ingestion was cancelled.")
+            elif job["status"] == "running" and job["kind"] == "exam":
+                job["cancel_requested"] = True
+            return True
+
+    # --- WORKERS ---
+
+    def _mirror(self, job, follower):
+        # Called with self.lock held
+        follower.update({key: job[key] for key in ("status", "progress", "error", "started", "finished", "updated")})
+
+    def _sync_followers(self, job):
+        # Called with self.lock held; other tenants' jobs waiting on the same ingestion
+        if job["kind"] != "ingest":
+            return
+        document_set = self.document_sets.get(job["params"]["document_set_id"])
+        if document_set is None or document_set["job_id"] != job["id"]:
+            return
+        for follower_id in document_set["followers"]:
+            if follower_id in self.jobs:
+                self._mirror(job, self.jobs[follower_id])
+
+    def _update(self, job, **fields):
+        with self.lock:
+            job.update(fields, updated=time.time())
+            self._sync_followers(job)
+
+    def _finish(self, job, status, error=None):
+        # Called with self.lock held
+        job.update(status=status, error=error, finished=time.time(), updated=time.time())
+        self._sync_followers(job)
+
+    def _work(self):
+        while True:
+            job_id = self.queue.get()
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is None or job["status"] != "queued":
+                    continue  # Cancelled (or forgotten) while queued
+                job.update(status="running", started=time.time(), updated=time.time())
+                self._sync_followers(job)
+
+            try:
+                with trace_run(job["id"]):
+                    if job["kind"] == "ingest":
+                        self._run_ingestion(job)
+                    else:
+                        self._run_exam(job)
+                with self.lock:
+                    self._finish(job, "cancelled" if job["cancel_requested"] else "complete")
+            except Exception as e:
+                with self.lock:
+                    self._finish(job, "failed", error=str(e))
+                    if job["kind"] == "ingest":
+                        self.document_sets[job["params"]["document_set_id"]].update(status="failed", error=str(e))
+
+    def _run_ingestion(self, job):
+        params = job["params"]
+        files = [open(path, "rb") for path in params["paths"]]
+        try:
+            ingestion = ingest_documents(
+                files, progress=lambda message: self._update(job, progress={"message": message}),
+                topic_mode=params["topic_mode"])
+        finally:
+            for f in files:
+                f.close()
+
+        # The collection and topic index are kept in memory and shared by all exam jobs on this set
+        with self.lock:
+            self.document_sets[params["document_set_id"]].update(
+                status="ready", topics=ingestion["topics"], num_chunks=len(ingestion["chunks"]),
+                dedup_stats=ingestion["dedup_stats"],
+                collection=ingestion["collection"], topic_index=ingestion["topic_index"])
+
+    def _run_exam(self, job):
+        params = job["params"]
+        with self.lock:
+            document_set = self.document_sets[params["document_set_id"]]
+        exam_structure = build_exam_structure(params["counts"])
+        num_variants = params.get("num_variants", 1)
+        tasks = plan_generation_tasks(exam_structure, document_set["topics"], num_variants)
+
+        totals, done = {}, {}
+        for task in tasks:
+            totals[task["marks"]] = totals.get(task["marks"], 0) + 1
+            done[task["marks"]] = 0
+
+        def progress():
+            by_marks = {marks: {"done": done[marks], "total": totals[marks]} for marks in totals}
+            return {"done": sum(done.values()), "total": len(tasks), "by_marks": by_marks}
+
+        self._update(job, progress=progress())
+        results = []
+        with closing(run_generation_plan(
+                document_set["collection"], tasks, max_workers=params["max_workers"],
+                batch_size=params["batch_size"], fresh=params["fresh"],
+                topic_index=document_set["topic_index"], limiter=self.limiter)) as stream:
+            for task, q_data in stream:
+                results.append((task, q_data))
+                done[task["marks"]] += 1
+                self._update(job, progress=progress())
+                if job["cancel_requested"]:
+                    return
+
+        stats = {}
+        if num_variants > 1:
+            variants = [
+                dict(zip(("label", "question_paper", "answer_key"), (VARIANT_LABELS[i], *format_exam(selected))))
+                for i, selected in enumerate(select_variant_questions(results, exam_structure, num_variants, stats=stats))
+            ]
+        else:
+            selected = select_paper_questions(group_results_by_marks(results), exam_structure, stats=stats)
+            question_paper, answer_key = format_exam(selected)
+            variants = [{"label": None, "question_paper": question_paper, "answer_key": answer_key}]
+        # The top-level paper is the first variant, so single-paper clients need no changes
+        self._update(job, result={"question_paper": variants[0]["question_paper"],
+                                  "answer_key": variants[0]["answer_key"], "variants": variants,
+                                  "failed_questions": stats.get("failed_questions", 0),
+                                  "shortfall": stats.get("shortfall", {})})
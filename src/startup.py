@@ -0,0 +1,94 @@
+"""
+Model preloading for fast first requests.
+
+Heavy libraries are imported lazily by the modules that use them; warmup()
+pays those costs up front (ideally in a background thread while the UI is
+already rendered) and reports how long each step took.
+
+Run `python -m src.startup` to measure cold start on this machine.
+"""
+import importlib
+import json
+import os
+import threading
+import time
+
+from src.instrumentation import span
+
+WARMUP_ENABLED = os.getenv("EXAM_GEN_WARMUP", "1") != "0"
+HEAVY_MODULES = ("sentence_transformers", "chromadb", "google.generativeai", "bertopic")
+WARMUP_TEXTS = ["Warming up the embedding model.", "A second sentence so a real batch is encoded."]
+
+_status = {"state": "idle", "steps": {}, "error": None}
+_status_lock = threading.Lock()
+
+def _set_status(**fields):
+    with _status_lock:
+        _status.update(fields)
+
+def _timed_step(name, func):
+    start = time.perf_counter()
+    with span(f"startup.{name}"):
+        func()
+    with _status_lock:
+        _status["steps"][name] = round(time.perf_counter() - start, 3)
+
+def warmup(progress=print):
+    """
+    Imports the heavy libraries, loads the shared embedding model, encodes a
+    dummy batch and opens the vector store, so the first real request does
+    not pay for any of it.
+
+    Args:
+        progress: Callback receiving human-readable status messages.
+
+    Returns:
+        The readiness status, see get_warmup_status().
+    """
+    from src.embedding_handler import get_embedding_model, encode_texts
+    from src.vector_store import get_chroma_client
+
+    _set_status(state="warming", error=None)
+    started = time.perf_counter()
+    try:
+        for module in HEAVY_MODULES:
+            progress(f"Importing {module}...")
+            _timed_step(f"import {module}", lambda: importlib.import_module(module))
+        progress("Loading the embedding model...")
+        _timed_step("load embedding model", get_embedding_model)
+        _timed_step("encode dummy batch", lambda: encode_texts(WARMUP_TEXTS))
+        _timed_step("open vector store", get_chroma_client)
+    except Exception as e:
+        _set_status(state="error", error=str(e))
+        progress(f"Warmup failed: {e}")
+        return get_warmup_status()
+
+    _set_status(state="ready", total_s=round(time.perf_counter() - started, 3))
+    progress("Models are ready.")
+    return get_warmup_status()
+
+def start_background_warmup():
+    """
+    Runs warmup() in a daemon thread, at most once per process.
+
+    Returns:
+        True if a warmup was started, False if one already ran or is disabled.
+    """
+    with _status_lock:
+        if not WARMUP_ENABLED or _status["state"] != "idle":
+            return False
+        _status["state"] = "warming"
+    threading.Thread(target=warmup, kwargs={"progress": lambda message: None},
+                     name="exam-gen-warmup", daemon=True).start()
+    return True
+
+def get_warmup_status():
+    """
+    Returns a snapshot of the warmup state: "idle", "warming", "ready" or
+    "error", the seconds spent per step and the error message, if any.
+    """
+    with _status_lock:
+        return {**_status, "steps": dict(_status["steps"])}
+
+if __name__ == "__main__":
+    print(json.dumps(warmup(), indent=2))
@@ -1,47 +1,270 @@
-from bertopic import BERTopic
-from sklearn.feature_extraction.text import CountVectorizer
-import nltk
+import hashlib
+import json
+import os
+import pickle
 
-# Download the stopwords list (only needs to be done once)
-try:
-    nltk.data.find('corpora/stopwords')
-except nltk.downloader.DownloadError:
-    nltk.download('stopwords')
+import numpy as np
 
-def get_document_topics(text_chunks, num_topics=20):
+from src.embedding_handler import get_embedding_model, encode_texts, normalize_embeddings
+from src.ingestion_cache import CACHE_DIR, TEMP_PREFIX, make_temp_dir, install_dir, evict_lru
+from src.instrumentation import instrumented
+
+TOPIC_MODEL_DIR = os.path.join(CACHE_DIR, "topic_models")
+TOPIC_MODEL_MAX_BYTES = int(os.getenv("EXAM_GEN_TOPIC_MODEL_CACHE_MAX_MB", "1024")) * 1024 * 1024
+TOPIC_MODES = ("auto", "bertopic", "online", "fast")
+BERTOPIC_MAX_CHUNKS = 2000  # In "auto" mode, larger corpora use the fast fallback
+ONLINE_BATCH_SIZE = 500  # Chunks per partial_fit call in online mode
+ONLINE_COMPONENTS = 5  # IncrementalPCA dimensions; smaller corpora cannot start an online model
+TOPIC_LABEL_WORDS = 4  # Words per topic label, like BERTopic's default names
+
+def choose_topic_mode(num_chunks):
+    """Picks the topic modeling mode for "auto": full BERTopic for small corpora, the fast fallback otherwise."""
+    return "bertopic" if num_chunks <= BERTOPIC_MAX_CHUNKS else "fast"
+
+# --- MODEL PERSISTENCE ---
+
+def _model_dir(mode, num_topics, document_ids):
+    key = json.dumps({"mode": mode, "num_topics": num_topics, "documents": sorted(set(document_ids))})
+    return os.path.join(TOPIC_MODEL_DIR, hashlib.sha256(key.encode("utf-8")).hexdigest()[:32])
+
+def _find_saved_model(mode, num_topics, document_ids, allow_subset=False):
     """
-    Analyzes text chunks to find the main topics using BERTopic,
-    while ignoring common English stop words.
+    Finds a persisted model of the given mode for exactly this document set,
+    or (if allow_subset) for the largest subset of it.
+
+    Returns:
+        A (model_dir, meta) tuple, or (None, None).
     """
-    
+    wanted = set(document_ids)
+    exact = _model_dir(mode, num_topics, wanted)
+    if os.path.exists(os.path.join(exact, "meta.json")):
+        with open(os.path.join(exact, "meta.json"), encoding="utf-8") as f:
+            return exact, json.load(f)
+    if not allow_subset or not os.path.isdir(TOPIC_MODEL_DIR):
+        return None, None
+
+    best, best_meta = None, None
+    for name in os.listdir(TOPIC_MODEL_DIR):
+        if name.startswith(TEMP_PREFIX):
+            continue
+        meta_path = os.path.join(TOPIC_MODEL_DIR, name, "meta.json")
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        documents = set(meta["documents"])
+        if (meta["mode"] == mode and meta["num_topics"] == num_topics and documents < wanted
+                and (best_meta is None or len(documents) > len(best_meta["documents"]))):
+            best, best_meta = os.path.join(TOPIC_MODEL_DIR, name), meta
+    return best, best_meta
+
+def _save_model(model, mode, num_topics, document_ids):
+    """Persists a fitted topic model (BERTopic or fast-mode state) for later reuse."""
+    model_dir = _model_dir(mode, num_topics, document_ids)
+    tmp_dir = make_temp_dir(TOPIC_MODEL_DIR)
+    if mode == "fast":
+        with open(os.path.join(tmp_dir, "model.pkl"), "wb") as f:
+            pickle.dump(model, f)
+    else:
+        model.save(os.path.join(tmp_dir, "model"), serialization="pickle", save_embedding_model=False)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"mode": mode, "num_topics": num_topics, "documents": sorted(set(document_ids))}, f)
+    install_dir(tmp_dir, model_dir)
+    evict_lru(TOPIC_MODEL_MAX_BYTES, TOPIC_MODEL_DIR)
+
+def _load_model(model_dir, mode):
+    os.utime(os.path.join(model_dir, "meta.json"), None)  # Marks the model as recently used for eviction
+    if mode == "fast":
+        with open(os.path.join(model_dir, "model.pkl"), "rb") as f:
+            return pickle.load(f)
+    from bertopic import BERTopic
+    return BERTopic.load(os.path.join(model_dir, "model"), embedding_model=get_embedding_model())
+
+# --- TOPIC MODELING MODES ---
+
+def _bertopic_topics(topic_model, text_chunks, embeddings, refit):
+    """Returns (topic_names, chunk_topics) from a BERTopic model, fitting or just transforming."""
+    if refit:
+        topic_model.fit_transform(text_chunks, embeddings=embeddings)
+        # topics_ reflects the nr_topics reduction, unlike the raw clustering
+        topic_ids = topic_model.topics_
+    else:
+        topic_ids, _ = topic_model.transform(text_chunks, embeddings=embeddings)
+
+    # Get the topic info
+    topic_info = topic_model.get_topic_info()
+
+    # Extract and clean the topic names
+    names_by_id = {}
+    for index, row in topic_info.iterrows():
+        if row['Topic'] != -1:
+            words = [word for word, _ in (topic_model.get_topic(row['Topic']) or []) if word][:TOPIC_LABEL_WORDS]
+            names_by_id[row['Topic']] = ", ".join(words) if words else row['Name'].split('_', 1)[1].replace('_', ', ')
+    return list(names_by_id.values()), [names_by_id.get(topic_id) for topic_id in topic_ids]
+
+def _make_bertopic_model(num_topics):
+    # bertopic (with UMAP and HDBSCAN) and scikit-learn are slow to import, so they are only loaded when needed
+    from bertopic import BERTopic
+    from sklearn.feature_extraction.text import CountVectorizer
+
     # --- TOPIC MODEL IMPROVEMENT ---
     # Create a vectorizer that knows to ignore common English words.
     # This is the key to generating clean, meaningful topics.
     vectorizer_model = CountVectorizer(stop_words="english")
 
     # Initialize BERTopic with our new vectorizer.
-    topic_model = BERTopic(
+    return BERTopic(
         vectorizer_model=vectorizer_model,
-        min_topic_size=3, 
-        nr_topics=num_topics, 
+        embedding_model=get_embedding_model(),
+        min_topic_size=3,
+        nr_topics=num_topics,
         verbose=True
     )
-    # --- END OF IMPROVEMENT ---
 
-    # Fit the model to find topics
-    topics, _ = topic_model.fit_transform(text_chunks)
+def _make_online_model(num_topics):
+    """
+    An incrementally trainable BERTopic: IncrementalPCA instead of UMAP,
+    MiniBatchKMeans instead of HDBSCAN and a decaying online vectorizer.
+    """
+    from bertopic import BERTopic
+    from bertopic.vectorizers import OnlineCountVectorizer
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.decomposition import IncrementalPCA
+
+    return BERTopic(
+        umap_model=IncrementalPCA(n_components=ONLINE_COMPONENTS),
+        hdbscan_model=MiniBatchKMeans(n_clusters=num_topics, random_state=42, n_init=3),
+        vectorizer_model=OnlineCountVectorizer(stop_words="english", decay=.01),
+        embedding_model=get_embedding_model(),
+        verbose=False
+    )
+
+def _partial_fit_online(topic_model, text_chunks, embeddings, positions, min_batch):
+    """
+    Feeds the chunks at the given positions to partial_fit in batches. Batches
+    smaller than min_batch (the cluster count) are padded with other chunks,
+    because the incremental estimators reject batches with fewer samples.
+    """
+    rng = np.random.default_rng(42)
+    for start in range(0, len(positions), ONLINE_BATCH_SIZE):
+        batch = list(positions[start:start + ONLINE_BATCH_SIZE])
+        if len(batch) < min_batch:
+            others = np.setdiff1d(np.arange(len(text_chunks)), batch)
+            batch += rng.choice(others, size=min(min_batch - len(batch), len(others)), replace=False).tolist()
+        topic_model.partial_fit([text_chunks[i] for i in batch], embeddings=embeddings[batch])
+
+def _c_tf_idf_labels(text_chunks, labels, num_clusters):
+    """
+    Labels clusters with class-based TF-IDF: each cluster's chunks are treated
+    as one document, and words frequent in a cluster but rare across clusters
+    score highest.
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    class_documents = [" ".join(text_chunks[i] for i in np.flatnonzero(labels == c)) for c in range(num_clusters)]
+    vectorizer = CountVectorizer(stop_words="english")
+    counts = vectorizer.fit_transform(class_documents).toarray().astype(np.float64)
+    words = vectorizer.get_feature_names_out()
+
+    term_frequency = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+    average_words = counts.sum() / max(num_clusters, 1)
+    idf = np.log(1 + average_words / np.maximum(counts.sum(axis=0), 1))
+    scores = term_frequency * idf
+
+    names = []
+    for row in scores:
+        top = [words[i] for i in np.argsort(-row)[:TOPIC_LABEL_WORDS] if row[i] > 0]
+        names.append(", ".join(top) if top else "general concepts")
+    return names
+
+def _fast_topics(text_chunks, embeddings, num_topics, model=None):
+    """
+    The lightweight fallback: MiniBatchKMeans over normalized chunk embeddings
+    plus c-TF-IDF labels. Runs in seconds even for very large corpora.
+
+    Returns:
+        (topic_names, chunk_topics, model), where model can be persisted and
+        passed back in to assign topics without refitting.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    normalized = normalize_embeddings(embeddings)
+    if model is None:
+        num_clusters = max(1, min(num_topics, len(text_chunks) // 3))
+        kmeans = MiniBatchKMeans(n_clusters=num_clusters, random_state=42, n_init=3, batch_size=1024)
+        labels = kmeans.fit_predict(normalized)
+        model = {"kmeans": kmeans, "names": _c_tf_idf_labels(text_chunks, labels, num_clusters)}
+    else:
+        labels = model["kmeans"].predict(normalized)
+    names = model["names"]
+    used = sorted(set(labels.tolist()))
+    return [names[c] for c in used], [names[c] for c in labels], model
+
+@instrumented("topic_modeling")
+def get_document_topics(text_chunks, num_topics=20, embeddings=None, return_assignments=False,
+                        mode="auto", document_ids=None):
+    """
+    Analyzes text chunks to find the main topics, while ignoring common
+    English stop words.
+
+    If the chunk embeddings have already been computed (see create_embeddings),
+    pass them in so the chunks are not encoded a second time.
+
+    Modes:
+        "bertopic": full BERTopic (UMAP + HDBSCAN), best quality.
+        "online": incremental BERTopic; when documents are appended to an
+                  already modeled set, only the new chunks are fitted.
+        "fast": MiniBatchKMeans + c-TF-IDF labels, for large corpora.
+        "auto": "bertopic" or "fast", depending on the corpus size.
+
+    An "online" request for a first upload of fewer than ONLINE_COMPONENTS
+    chunks uses "fast", since no online model can be fitted on it.
+
+    If document_ids (the source document of every chunk) is given, the fitted
+    model is persisted per document set and reused on the next call.
+
+    If return_assignments is True, a (topic_names, chunk_topics) tuple is
+    returned, where chunk_topics gives the topic name of every chunk (None
+    for outlier chunks).
+    """
+    if mode == "auto":
+        mode = choose_topic_mode(len(text_chunks))
+    if mode not in TOPIC_MODES:
+        raise ValueError(f"Unknown topic modeling mode '{mode}'. Choose from {TOPIC_MODES}.")
+    if mode == "online" and len(text_chunks) < ONLINE_COMPONENTS:
+        mode = "fast"
+
+    # UMAP expects float32 input, even if the embeddings were stored as float16
+    if embeddings is not None:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+    elif mode != "bertopic":
+        embeddings = encode_texts(text_chunks)
+
+    model_dir, meta = (None, None)
+    if document_ids is not None:
+        model_dir, meta = _find_saved_model(mode, num_topics, document_ids, allow_subset=(mode == "online"))
+
+    if mode == "fast":
+        saved = _load_model(model_dir, mode) if model_dir else None
+        topic_names, chunk_topics, model = _fast_topics(text_chunks, embeddings, num_topics, saved)
+    elif mode == "online":
+        known = set(meta["documents"]) if meta else set()
+        model = _load_model(model_dir, mode) if model_dir else _make_online_model(min(num_topics, len(text_chunks)))
+        positions = [i for i, doc in enumerate(document_ids or [None] * len(text_chunks)) if doc not in known]
+        if positions:
+            _partial_fit_online(model, text_chunks, embeddings, positions, min_batch=max(num_topics, ONLINE_COMPONENTS))
+        topic_names, chunk_topics = _bertopic_topics(model, text_chunks, embeddings, refit=False)
+    else:
+        model = _load_model(model_dir, mode) if model_dir else _make_bertopic_model(num_topics)
+        topic_names, chunk_topics = _bertopic_topics(model, text_chunks, embeddings, refit=model_dir is None)
+
+    if document_ids is not None and (model_dir is None or meta["documents"] != sorted(set(document_ids))):
+        _save_model(model, mode, num_topics, document_ids)
 
-    # Get the topic info
-    topic_info = topic_model.get_topic_info()
-    
-    # Extract and clean the topic names
-    topic_names = []
-    for index, row in topic_info.iterrows():
-        if row['Topic'] != -1:
-            clean_name = row['Name'].split('_', 1)[1].replace('_', ', ')
-            topic_names.append(clean_name)
-            
     if not topic_names:
-        return ["general concepts"] # Fallback
+        topic_names = ["general concepts"] # Fallback
+
+    if return_assignments:
+        return topic_names, chunk_topics
 
-    return topic_names
\ No newline at end of file
+    return topic_names
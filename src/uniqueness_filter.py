@@ -1,56 +1,170 @@
 # In src/uniqueness_filter.py
 
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+import numpy as np
 
-def select_unique_questions(generated_questions, n_required):
+from src.embedding_handler import encode_texts, normalize_embeddings
+from src.instrumentation import instrumented
+
+SIMILARITY_THRESHOLD = 0.95  # Questions more similar than this are considered duplicates
+SIMILARITY_BLOCK_SIZE = 1024  # Rows compared at once when scoring against accepted questions
+# Random-hyperplane LSH for deduplicating large banks: 32 bands of 16 bits make pairs at the
+# 0.95 threshold candidates with ~99.8% probability, and pairs below ~0.5 similarity rarely
+LSH_BANDS = 32
+LSH_BITS_PER_BAND = 16
+
+def embed_questions(questions):
+    """
+    Embeds the question strings of a list of question dicts.
+
+    Returns:
+        A float32 numpy array of L2-normalized embeddings, one row per question,
+        so a dot product between rows is their cosine similarity.
+    """
+    return normalize_embeddings(encode_texts([q['question'] for q in questions]))
+
+def _max_similarity_to(accepted_embeddings, embeddings):
+    """Returns, for every row of embeddings, its highest similarity to any accepted row."""
+    max_similarity = np.full(len(embeddings), -1.0, dtype=np.float32)
+    if accepted_embeddings is None or len(accepted_embeddings) == 0:
+        return max_similarity
+    for start in range(0, len(accepted_embeddings), SIMILARITY_BLOCK_SIZE):
+        block = accepted_embeddings[start:start + SIMILARITY_BLOCK_SIZE]
+        np.maximum(max_similarity, (block @ embeddings.T).max(axis=0), out=max_similarity)
+    return max_similarity
+
+def select_diverse_indices(embeddings, n_required, accepted_embeddings=None,
+                           similarity_threshold=SIMILARITY_THRESHOLD, relevance_scores=None, mmr_lambda=None):
+    """
+    Greedily selects up to n_required mutually dissimilar candidates.
+
+    The highest similarity of each candidate to everything selected so far is
+    tracked incrementally, so each selection costs one matrix-vector product
+    instead of a full pairwise similarity matrix.
+
+    Args:
+        embeddings: L2-normalized candidate embeddings (see embed_questions).
+        n_required: The number of candidates to select.
+        accepted_embeddings: Normalized embeddings of questions already on the
+                             paper (e.g. from other mark buckets); candidates
+                             too similar to these are rejected as well.
+        similarity_threshold: Candidates above this similarity are duplicates.
+        relevance_scores: Optional per-candidate relevance used by MMR.
+                          Defaults to similarity with the candidate centroid.
+        mmr_lambda: If set (0..1), pick by Maximal Marginal Relevance,
+                    lambda * relevance - (1 - lambda) * max_similarity.
+                    If None, candidates are taken in their original order.
+
+    Returns:
+        A list of selected candidate indices, in selection order.
+    """
+    n_candidates = len(embeddings)
+    max_similarity = _max_similarity_to(accepted_embeddings, embeddings)
+    available = np.ones(n_candidates, dtype=bool)
+    selected = []
+
+    if mmr_lambda is not None and relevance_scores is None:
+        centroid = embeddings.mean(axis=0)
+        relevance_scores = embeddings @ normalize_embeddings(centroid)
+
+    while len(selected) < n_required:
+        candidates = available & (max_similarity <= similarity_threshold)
+        if not candidates.any():
+            break
+        if mmr_lambda is None:
+            best = int(np.argmax(candidates))  # First remaining candidate in original order
+        else:
+            scores = mmr_lambda * relevance_scores - (1 - mmr_lambda) * np.maximum(max_similarity, 0)
+            best = int(np.argmax(np.where(candidates, scores, -np.inf)))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, embeddings @ embeddings[best], out=max_similarity)
+
+    return selected
+
+def _lsh_band_keys(embeddings, seed=0):
+    """Returns an (n, LSH_BANDS) array of band hashes; similar embeddings share bands with high probability."""
+    rng = np.random.default_rng(seed)  # Fixed, so the same questions are kept on every run
+    planes = rng.standard_normal((LSH_BANDS * LSH_BITS_PER_BAND, embeddings.shape[1])).astype(np.float32)
+    keys = np.empty((len(embeddings), LSH_BANDS), dtype=np.uint64)
+    weights = np.uint64(1) << np.arange(LSH_BITS_PER_BAND, dtype=np.uint64)
+    for start in range(0, len(embeddings), SIMILARITY_BLOCK_SIZE):
+        bits = (embeddings[start:start + SIMILARITY_BLOCK_SIZE] @ planes.T) > 0
+        bits = bits.reshape(len(bits), LSH_BANDS, LSH_BITS_PER_BAND).astype(np.uint64)
+        keys[start:start + SIMILARITY_BLOCK_SIZE] = (bits * weights).sum(axis=2)
+    return keys
+
+def select_first_unique_indices(embeddings, similarity_threshold=SIMILARITY_THRESHOLD):
+    """
+    Keeps every candidate that is not a near-duplicate of an earlier kept
+    one, like select_diverse_indices with n_required=len(embeddings), but
+    in roughly linear time for large sets such as question banks.
+
+    Kept candidates are bucketed with locality-sensitive hashing (random
+    hyperplanes), so each candidate's exact cosine similarity is only
+    checked against the few kept candidates sharing one of its bands.
+    A duplicate pair right at the threshold is missed with ~0.2%
+    probability; more similar pairs almost never.
+
+    Args:
+        embeddings: L2-normalized candidate embeddings (see embed_questions).
+        similarity_threshold: Candidates above this similarity are duplicates.
+
+    Returns:
+        The indices of the kept candidates, in order.
+    """
+    if len(embeddings) == 0:
+        return []
+    band_keys = _lsh_band_keys(embeddings)
+    buckets = {}
+    kept = []
+    for i, row in enumerate(band_keys):
+        keys = list(enumerate(row.tolist()))
+        candidates = {j for key in keys for j in buckets.get(key, ())}
+        if candidates:
+            candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            if (embeddings[candidates] @ embeddings[i]).max() > similarity_threshold:
+                continue
+        kept.append(i)
+        for key in keys:
+            buckets.setdefault(key, []).append(i)
+    return kept
+
+@instrumented("dedup.select_unique_questions", items=len)
+def select_unique_questions(generated_questions, n_required, accepted_embeddings=None,
+                            mmr_lambda=None, return_embeddings=False):
     """
     Selects a unique set of questions by filtering out semantic duplicates.
-    
+
     Args:
-        generated_questions: A list of question data dictionaries 
+        generated_questions: A list of question data dictionaries
                              (each dict has "question" and "answer").
         n_required: The final number of unique questions needed.
-        
+        accepted_embeddings: Normalized embeddings of questions already accepted
+                             for the paper, so duplicates across mark buckets
+                             are filtered too.
+        mmr_lambda: Optional MMR trade-off between relevance and diversity.
+        return_embeddings: Also return the normalized embeddings of the selection.
+
     Returns:
-        A list containing the required number of unique questions.
+        A list containing the required number of unique questions, or a
+        (questions, embeddings) tuple if return_embeddings is True. If too few
+        candidates pass the similarity threshold, the list is shorter. This
+        includes pools no larger than n_required: they are filtered too (and
+        not returned unchanged), since they must still be checked against
+        each other and against accepted_embeddings.
     """
-    if len(generated_questions) <= n_required:
-        return generated_questions
-
-    # Extract just the question strings for embedding
-    question_strings = [q['question'] for q in generated_questions]
+    if not generated_questions or n_required <= 0:
+        return ([], None) if return_embeddings else []
 
     # 1. Embed all generated questions
-    embedder = SentenceTransformer("all-MiniLM-L6-v2")
-    embeddings = embedder.encode(question_strings, show_progress_bar=False)
-
-    # 2. Calculate cosine similarity between all question pairs
-    # This creates a matrix where similarity_matrix[i][j] is the similarity
-    # between question i and question j.
-    similarity_matrix = cosine_similarity(embeddings)
-
-    # 3. Filter out questions that are too similar
-    unique_indices = set(range(len(question_strings)))
-    indices_to_remove = set()
-    similarity_threshold = 0.95 # We'll consider questions >95% similar as duplicates
-
-    for i in range(len(question_strings)):
-        if i in indices_to_remove:
-            continue
-        for j in range(i + 1, len(question_strings)):
-            if j in indices_to_remove:
-                continue
-            
-            if similarity_matrix[i][j] > similarity_threshold:
-                # Mark the j-th question for removal
-                indices_to_remove.add(j)
-
-    # Create the final list of unique questions
-    final_questions = []
-    for i in range(len(generated_questions)):
-        if i not in indices_to_remove:
-            final_questions.append(generated_questions[i])
-
-    # 4. Return the required number of unique questions
-    return final_questions[:n_required]
\ No newline at end of file
+    embeddings = embed_questions(generated_questions)
+
+    # 2. Greedily pick questions that are not near-duplicates of anything accepted
+    indices = select_diverse_indices(
+        embeddings, n_required, accepted_embeddings=accepted_embeddings, mmr_lambda=mmr_lambda)
+
+    # 3. Return the required number of unique questions
+    final_questions = [generated_questions[i] for i in indices]
+    if return_embeddings:
+        return final_questions, embeddings[indices]
+    return final_questions
@@ -1,30 +1,252 @@
-import chromadb
+import hashlib
+import json
+import os
+import threading
 
-def create_vector_store(chunks, embeddings):
+import numpy as np
+
+from src.embedding_handler import SharedEmbeddingFunction, create_embeddings
+from src.ingestion_cache import CACHE_DIR
+from src.instrumentation import instrumented
+
+CHROMA_DIR = os.getenv("EXAM_GEN_CHROMA_DIR", os.path.join(CACHE_DIR, "chroma"))
+ADD_BATCH_SIZE = 512  # Maximum number of chunks sent to Chroma per add() call
+FILE_COLLECTION_PREFIX = "file-"  # Collections hold the chunks of one file each
+
+# The process-wide persistent client, created lazily on first use
+_chroma_client = None
+_chroma_client_lock = threading.Lock()
+
+def get_chroma_client():
+    """
+    Returns the shared PersistentClient so indexed documents survive restarts
+    and are reused across sessions. chromadb is imported on first use to
+    keep app startup fast.
+    """
+    global _chroma_client
+    if _chroma_client is None:
+        with _chroma_client_lock:
+            if _chroma_client is None:
+                import chromadb
+                _chroma_client = chromadb.PersistentClient(path=CHROMA_DIR)
+    return _chroma_client
+
+def document_set_id(file_hashes):
+    """
+    Returns a content hash identifying a set of documents, independent of
+    upload order.
+    """
+    joined = ",".join(sorted(set(file_hashes)))
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+def chunk_id_prefix(file_hash, chunking_params=None):
+    """
+    Returns the id prefix shared by all chunks of a file; it also names the
+    file's collection (see get_file_collections).
+
+    If chunking_params is given it is folded into the prefix, so changing the
+    chunking configuration never reuses ids that point at different text.
+    """
+    if chunking_params is None:
+        return file_hash[:16]
+    fingerprint = f"{file_hash}:{json.dumps(chunking_params, sort_keys=True)}"
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:16]
+
+def make_chunk_ids(file_hash, num_chunks, chunking_params=None):
+    """
+    Builds stable per-chunk ids from the file's content hash and the chunk's
+    position in that file, so re-indexing the same file never collides.
+    """
+    prefix = chunk_id_prefix(file_hash, chunking_params)
+    return [f"{prefix}-{i}" for i in range(num_chunks)]
+
+def _id_prefix(chunk_id):
+    return chunk_id.rsplit("-", 1)[0]
+
+def _group_positions(ids):
+    """Returns a dict mapping each id prefix (i.e. file) to the positions of its ids."""
+    groups = {}
+    for i, chunk_id in enumerate(ids):
+        groups.setdefault(_id_prefix(chunk_id), []).append(i)
+    return groups
+
+@instrumented("vector_store.get_collections")
+def get_file_collections(file_hashes, chunking_params=None):
+    """
+    Returns the persistent collections of a document set's files, creating
+    them if needed.
+
+    Every file has one collection, named after its chunk id prefix, which is
+    shared by all document sets containing the file. Adding a PDF to an
+    indexed set therefore only encodes and writes the new file's chunks;
+    query the set through a DocumentSetIndex.
+
+    Args:
+        file_hashes: SHA-256 hex digests of the uploaded files.
+        chunking_params: The parameters passed to make_chunk_ids.
+
+    Returns:
+        A dict mapping chunk id prefix to ChromaDB collection.
+    """
+    client = get_chroma_client()
+    collections = {}
+    for file_hash in dict.fromkeys(file_hashes):
+        prefix = chunk_id_prefix(file_hash, chunking_params)
+        collections[prefix] = client.get_or_create_collection(
+            f"{FILE_COLLECTION_PREFIX}{prefix}", embedding_function=SharedEmbeddingFunction())
+    return collections
+
+class DocumentSetIndex:
+    """
+    Queries the collections of a document set's files as one collection.
+
+    A file's collection may also hold chunks that this set does not use
+    (e.g. chunks dropped here as near-duplicates of another file, but kept
+    when the file was uploaded on its own), so results are restricted to
+    the set's chunk ids.
+
+    Args:
+        collections: A dict mapping chunk id prefix to collection, from get_file_collections.
+        ids: The chunk ids of the set.
+    """
+
+    def __init__(self, collections, ids):
+        self.ids = set(ids)
+        groups = _group_positions(ids)
+        self.collections = [(collections[prefix], len(positions)) for prefix, positions in groups.items()]
+
+    def count(self):
+        return len(self.ids)
+
+    def query(self, query_texts, n_results=10):
+        """
+        Returns the n_results nearest chunks of the set for every query text,
+        in the layout of Collection.query (ids, documents, metadatas and
+        distances, one list per query text).
+        """
+        query_embeddings = SharedEmbeddingFunction()(list(query_texts))
+        hits = [[] for _ in query_embeddings]
+        for collection, num_own in self.collections:
+            stored = collection.count()
+            # Chunks of other sets can outrank this set's, so fetch enough to still find n_results of ours
+            results = collection.query(query_embeddings=query_embeddings,
+                                       n_results=min(stored, n_results + stored - num_own),
+                                       include=["documents", "metadatas", "distances"])
+            for query_hits, *columns in zip(hits, results["distances"], results["ids"],
+                                            results["documents"], results["metadatas"]):
+                query_hits.extend(hit for hit in zip(*columns) if hit[1] in self.ids)
+
+        merged = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query_hits in hits:
+            nearest = sorted(query_hits, key=lambda hit: hit[0])[:n_results]
+            merged["distances"].append([hit[0] for hit in nearest])
+            merged["ids"].append([hit[1] for hit in nearest])
+            merged["documents"].append([hit[2] for hit in nearest])
+            merged["metadatas"].append([hit[3] for hit in nearest])
+        return merged
+
+def get_missing_ids(collection, ids):
+    """Returns the subset of ids that are not yet stored in the collection."""
+    existing = set()
+    for start in range(0, len(ids), ADD_BATCH_SIZE):
+        batch = ids[start:start + ADD_BATCH_SIZE]
+        existing.update(collection.get(ids=batch, include=[])["ids"])
+    return [i for i in ids if i not in existing]
+
+def get_stored_embeddings(collection, ids):
+    """
+    Fetches already-indexed embeddings for the given ids.
+
+    Returns:
+        A dict mapping chunk id to its embedding as a numpy array.
+    """
+    stored = {}
+    for start in range(0, len(ids), ADD_BATCH_SIZE):
+        batch = ids[start:start + ADD_BATCH_SIZE]
+        result = collection.get(ids=batch, include=["embeddings"])
+        for chunk_id, embedding in zip(result["ids"], result["embeddings"]):
+            stored[chunk_id] = np.asarray(embedding, dtype=np.float32)
+    return stored
+
+@instrumented("vector_store.embed_new_chunks")
+def embed_new_chunks(collections, ids, chunks):
+    """
+    Builds the embedding matrix for a document set, reusing embeddings that
+    are already stored in the files' collections and encoding only the new
+    chunks.
+
+    Args:
+        collections: A dict mapping chunk id prefix to collection, from get_file_collections.
+
+    Returns:
+        A (embeddings, num_new) tuple, where embeddings is a float32 numpy
+        array aligned with ids.
+
+    Raises:
+        ValueError: If there are no chunks, e.g. for scanned PDFs without a text layer.
+    """
+    if not ids:
+        raise ValueError("No extractable text found in the documents (scanned PDFs are not supported).")
+    stored = {}
+    for prefix, positions in _group_positions(ids).items():
+        stored.update(get_stored_embeddings(collections[prefix], [ids[i] for i in positions]))
+    new_positions = [i for i, chunk_id in enumerate(ids) if chunk_id not in stored]
+    new_embeddings = create_embeddings([chunks[i] for i in new_positions]) if new_positions else None
+
+    dim = new_embeddings.shape[1] if new_embeddings is not None else len(next(iter(stored.values())))
+    embeddings = np.zeros((len(ids), dim), dtype=np.float32)
+    for i, chunk_id in enumerate(ids):
+        if chunk_id in stored:
+            embeddings[i] = stored[chunk_id]
+    if new_embeddings is not None:
+        embeddings[new_positions] = new_embeddings
+    return embeddings, len(new_positions)
+
+@instrumented("vector_store.add_chunks", items=lambda added: added)
+def add_chunks(collections, ids, chunks, embeddings, metadatas=None, batch_size=ADD_BATCH_SIZE):
+    """
+    Adds chunks to their files' collections in bounded batches, skipping ids
+    that are already indexed, so only new chunks are written.
+
+    Args:
+        collections: A dict mapping chunk id prefix to collection, from get_file_collections.
+
+    Returns:
+        The number of chunks actually added.
+    """
+    added = 0
+    for prefix, group in _group_positions(ids).items():
+        collection = collections[prefix]
+        missing = set(get_missing_ids(collection, [ids[i] for i in group]))
+        positions = [i for i in group if ids[i] in missing]
+        for start in range(0, len(positions), batch_size):
+            batch = positions[start:start + batch_size]
+            collection.add(
+                ids=[ids[i] for i in batch],
+                documents=[chunks[i] for i in batch],
+                embeddings=[np.asarray(embeddings[i], dtype=np.float32).tolist() for i in batch],
+                metadatas=[metadatas[i] for i in batch] if metadatas is not None else None
+            )
+        added += len(positions)
+    return added
+
+def create_vector_store(chunks, embeddings, file_hashes=None):
     """
     Creates a vector store from text chunks and their embeddings.
-    
+
     Args:
         chunks: The list of original text chunks.
-        embeddings: The list of embeddings corresponding to the chunks.
-        
+        embeddings: The embeddings corresponding to the chunks (numpy array or list of lists).
+        file_hashes: Content hashes of the source files. Defaults to a hash of the chunks.
+
     Returns:
-        The ChromaDB collection object.
-    """
-    # Create a new in-memory ChromaDB client
-    client = chromadb.Client()
-    
-    # Create a new collection or get it if it already exists
-    collection = client.get_or_create_collection("exam_docs")
-    
-    # Generate unique IDs for each chunk
-    ids = [str(i) for i in range(len(chunks))]
-    
-    # Add the documents and their embeddings to the collection
-    collection.add(
-        documents=chunks,
-        embeddings=embeddings,
-        ids=ids
-    )
-    
-    return collection
\ No newline at end of file
+        A DocumentSetIndex over the indexed chunks.
+    """
+    if file_hashes is None:
+        file_hashes = [hashlib.sha256("\n".join(chunks).encode("utf-8")).hexdigest()]
+    # The chunks are not split by file here, so they are stored as one pseudo-file of the set
+    set_hash = document_set_id(file_hashes)
+    collections = get_file_collections([set_hash])
+    ids = make_chunk_ids(set_hash, len(chunks))
+    add_chunks(collections, ids, chunks, embeddings)
+    return DocumentSetIndex(collections, ids)
@@ -0,0 +1,45 @@
+"""
+Shared fixtures. The LLM is always benchmarks.fake_llm; embeddings are
+replaced by hashes so no model has to be downloaded.
+"""
+import hashlib
+
+import numpy as np
+import pytest
+
+import src.llm_handler as llm_handler
+import src.uniqueness_filter as uniqueness_filter
+from benchmarks.fake_llm import FakeGenerativeModel
+
+TOPICS = ["enzymes", "membranes", "proteins"]
+
+
+def hash_embeddings(texts, **kwargs):
+    """Distinct texts get (almost surely) dissimilar vectors, identical texts identical ones."""
+    return np.array([np.frombuffer(hashlib.sha256(text.encode()).digest(), dtype=np.uint8).astype(np.float32) - 128
+                     for text in texts])
+
+
+def llm_calls():
+    """Number of generate_content() calls made to the fake LLM since it was installed."""
+    return sum(FakeGenerativeModel._call_counts.values())
+
+
+@pytest.fixture
+def llm_cache(tmp_path, monkeypatch):
+    """An empty LLM response cache for the test."""
+    monkeypatch.setattr(llm_handler, "LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite3"))
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    monkeypatch.setattr(uniqueness_filter, "encode_texts", hash_embeddings)
+
+
+@pytest.fixture
+def topic_index():
+    """A topic index (see build_topic_index) of 30 chunks over TOPICS, so no vector store is needed."""
+    chunks = [f"Passage {i} explains {TOPICS[i % len(TOPICS)]} through enzyme kinetics, membrane transport "
+              f"and protein folding in living cells." for i in range(30)]
+    return {"chunks": chunks,
+            "neighbors": {topic: list(range(i, len(chunks), len(TOPICS))) for i, topic in enumerate(TOPICS)}}
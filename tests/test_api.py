@@ -0,0 +1,116 @@
+"""
+End-to-end tests of the HTTP API with the offline fake LLM.
+
+Ingestion and embeddings are replaced by small deterministic fakes, so the
+tests need no API key, no embedding model download and no real PDFs:
+    python -m pytest tests
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+# Read at import time by src.ingestion_cache, src.service and src.startup
+os.environ["EXAM_GEN_CACHE_DIR"] = tempfile.mkdtemp(prefix="exam-gen-test-")
+os.environ["EXAM_GEN_API_RPM"] = "60000"
+os.environ["EXAM_GEN_WARMUP"] = "0"
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import src.service as service
+import src.uniqueness_filter as uniqueness_filter
+
+TOPICS = ["enzymes", "membranes", "proteins"]
+POLL_TIMEOUT_SECONDS = 30
+
+
+def fake_ingest_documents(files, progress=None, topic_mode="auto"):
+    chunks = [f"Chunk {i} on {TOPICS[i % len(TOPICS)]}: enzyme kinetics, membrane transport and protein folding."
+              for i in range(30)]
+    if progress:
+        progress("Reading documents...")
+    return {
+        "topics": TOPICS, "collection": None, "chunks": chunks, "dedup_stats": {},
+        "topic_index": {"chunks": chunks, "neighbors": {topic: list(range(i, 30, len(TOPICS)))
+                                                        for i, topic in enumerate(TOPICS)}},
+    }
+
+
+def fake_encode_texts(texts, **kwargs):
+    """Distinct texts get (almost surely) dissimilar vectors, identical texts identical ones."""
+    return np.array([np.frombuffer(hashlib.sha256(text.encode()).digest(), dtype=np.uint8).astype(np.float32) - 128
+                     for text in texts])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api, "FAKE_LLM", True)
+    monkeypatch.setenv("EXAM_GEN_FAKE_LLM_LATENCY", "0")
+    monkeypatch.setattr(service, "ingest_documents", fake_ingest_documents)
+    monkeypatch.setattr(uniqueness_filter, "encode_texts", fake_encode_texts)
+    with TestClient(api.app) as client:
+        yield client
+
+
+def upload(client, tenant, data=b"%PDF-1.4 biology notes"):
+    response = client.post("/document-sets", files=[("files", ("notes.pdf", data, "application/pdf"))],
+                           headers={"X-Tenant-ID": tenant})
+    assert response.status_code == 202
+    return response.json()
+
+
+def wait_for_job(client, job_id, tenant):
+    deadline = time.monotonic() + POLL_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        response = client.get(f"/jobs/{job_id}", headers={"X-Tenant-ID": tenant})
+        assert response.status_code == 200
+        job = response.json()
+        if job["status"] in service.FINISHED_STATES:
+            return job
+        time.sleep(0.05)
+    pytest.fail(f"Job {job_id} did not finish within {POLL_TIMEOUT_SECONDS}s")
+
+
+def test_exam_job_runs_to_completion(client):
+    uploaded = upload(client, "school-a")
+    assert wait_for_job(client, uploaded["job_id"], "school-a")["status"] == "complete"
+
+    response = client.post("/exams", json={"document_set_id": uploaded["document_set_id"],
+                                           "structure": {"1": 2, "5": 1}, "fresh": True},
+                           headers={"X-Tenant-ID": "school-a"})
+    assert response.status_code == 202
+    job = wait_for_job(client, response.json()["job_id"], "school-a")
+
+    assert job["status"] == "complete", job["error"]
+    assert job["progress"]["done"] == job["progress"]["total"]
+    assert len(job["result"]["question_paper"]) == 3
+    assert len(job["result"]["answer_key"]) == 3
+
+
+def test_second_tenant_gets_pollable_job_for_shared_documents(client):
+    first = upload(client, "school-a", b"%PDF-1.4 shared notes")
+    second = upload(client, "school-b", b"%PDF-1.4 shared notes")
+
+    assert second["document_set_id"] == first["document_set_id"]
+    assert second["job_id"] != first["job_id"]
+    assert wait_for_job(client, second["job_id"], "school-b")["status"] == "complete"
+    assert client.get(f"/jobs/{first['job_id']}", headers={"X-Tenant-ID": "school-b"}).status_code == 404
+
+    # Uploaded again once ready: an already complete job, no second ingestion
+    third = upload(client, "school-b", b"%PDF-1.4 shared notes")
+    assert wait_for_job(client, third["job_id"], "school-b")["status"] == "complete"
+
+
+def test_document_sets_are_private_to_uploading_tenants(client):
+    uploaded = upload(client, "school-a", b"%PDF-1.4 private notes")
+    set_id = uploaded["document_set_id"]
+    wait_for_job(client, uploaded["job_id"], "school-a")
+
+    assert client.get(f"/document-sets/{set_id}", headers={"X-Tenant-ID": "school-a"}).json()["status"] == "ready"
+    assert client.get(f"/document-sets/{set_id}", headers={"X-Tenant-ID": "school-c"}).status_code == 404
+    response = client.post("/exams", json={"document_set_id": set_id, "structure": {"1": 1}},
+                           headers={"X-Tenant-ID": "school-c"})
+    assert response.status_code == 404
@@ -0,0 +1,37 @@
+"""Tests of boilerplate stripping and MinHash near-duplicate detection in src.chunk_dedup."""
+from src.chunk_dedup import NearDuplicateIndex, deduplicate_chunks, strip_boilerplate
+
+TEXT = ("Enzymes are biological catalysts that speed up chemical reactions by lowering the activation energy. "
+        "Each enzyme binds its substrate at the active site, and temperature and pH change how well it works. "
+        "Inhibitors can block the active site or change the shape of the enzyme, slowing the reaction down.")
+
+
+def test_near_duplicates_are_dropped_and_distinct_chunks_kept():
+    near_copy = TEXT.replace("slowing the reaction down", "which slows the reaction")
+    other = ("Cell membranes are made of a phospholipid bilayer with embedded proteins that transport "
+             "ions and molecules, and cholesterol keeps the membrane fluid at low temperatures.")
+
+    assert deduplicate_chunks([TEXT, other, near_copy, TEXT]) == [0, 1]
+
+
+def test_shared_index_catches_duplicates_across_calls():
+    index = NearDuplicateIndex()
+
+    assert deduplicate_chunks([TEXT], index) == [0]
+    assert deduplicate_chunks([TEXT.upper()], index) == []
+
+
+def test_signatures_are_deterministic():
+    assert (NearDuplicateIndex().signature(TEXT) == NearDuplicateIndex().signature(TEXT)).all()
+
+
+def test_running_headers_and_page_numbers_are_stripped():
+    bodies = ["Enzymes speed up reactions.", "Membranes control transport.", "Proteins fold into shapes.",
+              "Mitosis divides the nucleus.", "Photosynthesis stores energy.", "Respiration releases energy."]
+    pages = [(n, f"Biology Notes - Chapter {n}\n{body}\nPage {n} of 6") for n, body in enumerate(bodies, start=1)]
+    stats = {}
+
+    stripped = list(strip_boilerplate(pages, stats))
+
+    assert [text for _, text in stripped] == bodies
+    assert stats["boilerplate_lines"] == 12
@@ -0,0 +1,110 @@
+"""
+Tests of the generation plan and scheduler, run offline with the fake LLM
+from benchmarks.fake_llm.
+"""
+import time
+
+import pytest
+
+import src.generation_scheduler as generation_scheduler
+from benchmarks.fake_llm import fake_llm
+from src.generation_scheduler import plan_generation_tasks, run_generation_plan
+from src.llm_handler import is_error_question
+from src.pipeline import build_exam_structure
+from tests.conftest import TOPICS, llm_calls
+
+
+def generate(structure, topic_index, batch_size=1, **kwargs):
+    tasks = plan_generation_tasks(build_exam_structure(structure), TOPICS)
+    with fake_llm(latency=0):
+        return list(run_generation_plan(None, tasks, max_workers=2, requests_per_minute=60000,
+                                        batch_size=batch_size, topic_index=topic_index, **kwargs))
+
+
+def test_plan_rotates_topics_within_each_bucket():
+    structure = build_exam_structure({1: 4, 2: 1})
+    tasks = plan_generation_tasks(structure, TOPICS)
+
+    assert tasks == plan_generation_tasks(structure, TOPICS)
+    one_mark = [task for task in tasks if task["marks"] == 1]
+    two_mark = [task for task in tasks if task["marks"] == 2]
+    # 4 questions + 2 spares, and 1 + 3 spares; the second bucket starts one topic further
+    assert [task["topic"] for task in one_mark] == TOPICS * 2
+    assert [task["topic"] for task in two_mark] == TOPICS[1:] + TOPICS[:2]
+    assert [task["variant"] for task in one_mark] == [0, 0, 0, 1, 1, 1]
+    assert [task["index"] for task in tasks] == list(range(len(tasks)))
+
+
+@pytest.mark.parametrize("batch_size, expected_misses", [(1, 2), (4, 5)])
+def test_adding_questions_to_one_bucket_reuses_the_other_buckets(llm_cache, topic_index, batch_size, expected_misses):
+    generate({1: 5, 2: 3, 5: 2}, topic_index, batch_size)
+    results = generate({1: 7, 2: 3, 5: 2}, topic_index, batch_size)
+
+    misses = [task for task, q_data in results if not q_data.get("cached")]
+    # Only the grown 1-mark bucket calls the LLM: its new tasks, plus (batched) the batch they complete
+    assert {task["marks"] for task in misses} == {1}
+    assert len(misses) == expected_misses
+
+
+def test_quota_errors_are_retried_with_exponential_backoff(llm_cache, topic_index, monkeypatch):
+    delays = []
+    monkeypatch.setattr(generation_scheduler.time, "sleep", lambda seconds: delays.append(seconds) if seconds else None)
+    tasks = plan_generation_tasks(build_exam_structure({10: 1}), TOPICS)[:1]
+
+    with fake_llm(latency=0, error_rate=1.0):
+        [(_, q_data)] = run_generation_plan(None, tasks, requests_per_minute=60000, max_retries=3,
+                                            base_delay=0.01, topic_index=topic_index)
+        assert llm_calls() == 4
+
+    assert is_error_question(q_data)
+    assert len(delays) == 3
+    for attempt, delay in enumerate(delays):
+        assert 0.01 * 2 ** attempt <= delay <= 0.01 * 2 ** attempt + 0.01
+
+
+def test_transient_quota_errors_do_not_fail_questions(llm_cache, topic_index):
+    tasks = plan_generation_tasks(build_exam_structure({1: 4}), TOPICS)
+
+    with fake_llm(latency=0, error_rate=0.3):
+        results = list(run_generation_plan(None, tasks, requests_per_minute=60000, max_retries=10,
+                                           base_delay=0.001, topic_index=topic_index))
+
+    assert len(results) == len(tasks)
+    assert not any(is_error_question(q_data) for _, q_data in results)
+
+
+def test_closing_the_stream_cancels_pending_requests(llm_cache, topic_index):
+    tasks = plan_generation_tasks(build_exam_structure({1: 20}), TOPICS)
+
+    with fake_llm(latency=0.02, jitter=0):
+        stream = run_generation_plan(None, tasks, max_workers=1, requests_per_minute=60000, topic_index=topic_index)
+        next(stream)
+        stream.close()
+        time.sleep(0.1)  # Let the request that was in flight finish
+        assert llm_calls() < len(tasks) // 2
+
+
+def test_invalid_batch_elements_fall_back_to_single_questions(llm_cache, topic_index, monkeypatch):
+    batch_generate = generation_scheduler.generate_questions_batch
+    single_generate = generation_scheduler.generate_question_from_context
+    single_calls = []
+
+    def drop_second_question(*args, **kwargs):
+        questions = batch_generate(*args, **kwargs)
+        return [None if i == 1 else q_data for i, q_data in enumerate(questions)]
+
+    def count_single_calls(*args, **kwargs):
+        single_calls.append(args[3])
+        return single_generate(*args, **kwargs)
+
+    monkeypatch.setattr(generation_scheduler, "generate_questions_batch", drop_second_question)
+    monkeypatch.setattr(generation_scheduler, "generate_question_from_context", count_single_calls)
+    tasks = plan_generation_tasks(build_exam_structure({1: 6}), TOPICS)  # 6 + 2 spares: batches of 4 and 4
+
+    with fake_llm(latency=0):
+        results = list(run_generation_plan(None, tasks, requests_per_minute=60000, batch_size=4,
+                                           topic_index=topic_index))
+
+    assert len(single_calls) == 2
+    assert sorted(task["index"] for task, _ in results) == [task["index"] for task in tasks]
+    assert not any(q_data is None or is_error_question(q_data) for _, q_data in results)
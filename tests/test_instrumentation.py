@@ -0,0 +1,47 @@
+"""Tests of the spans recorded by src.instrumentation."""
+import time
+
+import pytest
+
+from src.instrumentation import instrumented, trace_run, get_records
+
+
+def spans(run_id, name):
+    return [record for record in get_records(run_id) if record["name"] == name]
+
+
+def test_generator_span_counts_items_and_excludes_consumer_time():
+    @instrumented("test.produce")
+    def produce(n):
+        for i in range(n):
+            time.sleep(0.01)
+            yield i
+
+    with trace_run() as run_id:
+        for _ in produce(5):
+            time.sleep(0.05)  # Consumer time, not the generator's
+
+    [record] = spans(run_id, "test.produce")
+    assert record["items"] == 5
+    assert 0.05 <= record["wall_s"] < 0.2
+
+
+def test_generator_closed_early_still_records_items():
+    @instrumented("test.stream")
+    def stream():
+        yield from range(10)
+
+    with trace_run() as run_id:
+        generator = stream()
+        next(generator), next(generator)
+        generator.close()
+
+    [record] = spans(run_id, "test.stream")
+    assert record["items"] == 2
+
+
+def test_items_callback_is_rejected_for_generators():
+    with pytest.raises(TypeError):
+        @instrumented("test.bad", items=len)
+        def bad():
+            yield 1
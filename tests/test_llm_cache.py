@@ -0,0 +1,56 @@
+"""Tests of the LLM response cache in src.llm_handler, with the fake LLM from benchmarks.fake_llm."""
+import time
+
+import src.llm_handler as llm_handler
+from benchmarks.fake_llm import fake_llm
+from src.llm_handler import generate_text, get_cached_response, store_cached_response
+from tests.conftest import llm_calls
+
+PROMPT = "Context: --- enzymes lower the activation energy of reactions --- Generate one question."
+
+
+def test_repeated_prompts_are_served_from_the_cache(llm_cache):
+    with fake_llm(latency=0):
+        first, key, first_hit = generate_text(PROMPT)
+        second, second_key, second_hit = generate_text(PROMPT)
+        other_variant, other_key, other_hit = generate_text(PROMPT, cache_variant=1)
+        assert llm_calls() == 2
+
+    assert (first_hit, second_hit, other_hit) == (False, True, False)
+    assert second == first and second_key == key
+    assert other_key != key
+
+
+def test_fresh_skips_the_lookup_and_replaces_the_entry(llm_cache):
+    with fake_llm(latency=0):
+        first, key, _ = generate_text(PROMPT)
+        fresh, _, hit = generate_text(PROMPT, fresh=True)
+        assert llm_calls() == 2
+
+    assert not hit
+    assert fresh != first
+    assert get_cached_response(key) == fresh
+
+
+def test_expired_entries_are_not_served(llm_cache, monkeypatch):
+    store_cached_response("old", "response")
+    monkeypatch.setattr(llm_handler, "LLM_CACHE_TTL_SECONDS", -1)
+
+    assert get_cached_response("old") is None
+    monkeypatch.setattr(llm_handler, "LLM_CACHE_TTL_SECONDS", 3600)
+    assert get_cached_response("old") is None  # Deleted on the expired lookup
+
+
+def test_least_recently_used_entries_are_evicted_first(llm_cache, monkeypatch):
+    monkeypatch.setattr(llm_handler, "LLM_CACHE_MAX_BYTES", 25)
+    store_cached_response("a", "a" * 10)
+    time.sleep(0.01)
+    store_cached_response("b", "b" * 10)
+    time.sleep(0.01)
+    get_cached_response("a")  # Now more recently used than "b"
+    time.sleep(0.01)
+    store_cached_response("c", "c" * 10)
+
+    assert get_cached_response("b") is None
+    assert get_cached_response("a") == "a" * 10
+    assert get_cached_response("c") == "c" * 10
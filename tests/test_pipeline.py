@@ -0,0 +1,54 @@
+"""Tests of paper assembly in src.pipeline: question selection and dealing questions to variants."""
+from collections import Counter
+
+from src.pipeline import _deal_to_variants, build_exam_structure, select_paper_questions, select_variant_questions
+from tests.conftest import TOPICS
+
+ERROR = {"question": "Error generating question: 429 quota exceeded", "answer": "N/A"}
+
+
+def question(text, answer_words=10):
+    return {"question": text, "answer": " ".join(["word"] * answer_words)}
+
+
+def test_deal_to_variants_balances_sizes_topics_and_answer_lengths():
+    candidates = [(TOPICS[i % 3], question(f"Q{i}", answer_words=5 + i)) for i in range(12)]
+
+    dealt = _deal_to_variants(candidates, 4, 3)
+
+    assert sorted(i for positions in dealt for i in positions) == list(range(12))
+    assert [len(positions) for positions in dealt] == [4, 4, 4]
+    for positions in dealt:
+        topic_counts = Counter(candidates[i][0] for i in positions)
+        assert max(topic_counts.values()) - min(topic_counts.get(topic, 0) for topic in TOPICS) <= 1
+    # Candidates are dealt longest answer first, so each variant gets one of the three longest
+    longest = sorted(range(12), key=lambda i: -len(candidates[i][1]["answer"]))[:3]
+    assert [len(set(positions) & set(longest)) for positions in dealt] == [1, 1, 1]
+
+
+def test_deal_to_variants_spreads_a_shortfall():
+    candidates = [(TOPICS[0], question(f"Q{i}")) for i in range(7)]
+
+    assert sorted(len(positions) for positions in _deal_to_variants(candidates, 3, 3)) == [2, 2, 3]
+
+
+def test_failed_generations_never_reach_the_paper(fake_embeddings):
+    pools = {1: [question("What is an enzyme?"), ERROR, dict(ERROR)], 2: [ERROR]}
+    stats = {}
+
+    selected = select_paper_questions(pools, build_exam_structure({1: 2, 2: 1}), stats=stats)
+
+    assert selected == [(1, pools[1][0])]
+    assert stats == {"failed_questions": 3, "shortfall": {1: 1, 2: 1}}
+
+
+def test_failed_generations_are_not_dealt_to_variants(fake_embeddings):
+    results = [({"index": i, "marks": 1, "topic": TOPICS[i % 3]}, ERROR if i % 3 == 0 else question(f"Q{i}?"))
+               for i in range(9)]
+    stats = {}
+
+    variants = select_variant_questions(results, build_exam_structure({1: 3}), 2, stats=stats)
+
+    assert all(q_data is not ERROR and q_data["answer"] != "N/A" for variant in variants for _, q_data in variant)
+    assert sorted(len(variant) for variant in variants) == [3, 3]
+    assert stats == {"failed_questions": 3}
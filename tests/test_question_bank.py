@@ -0,0 +1,44 @@
+"""Tests of question bank building in src.question_bank, with the fake LLM from benchmarks.fake_llm."""
+import json
+
+import pytest
+
+import src.question_bank as question_bank
+from benchmarks.fake_llm import fake_llm
+from src.question_bank import build_question_bank, load_question_bank
+from tests.conftest import TOPICS
+
+
+@pytest.fixture
+def bank_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(question_bank, "BANK_DIR", str(tmp_path / "banks"))
+    return tmp_path / "banks"
+
+
+def build(topic_index):
+    return build_question_bank(None, TOPICS, "set-1", marks_levels=[1, 5], questions_per_topic=2,
+                               requests_per_minute=60000, batch_size=1, topic_index=topic_index,
+                               progress=lambda message: None)
+
+
+def test_interrupted_build_resumes_from_the_checkpoint(llm_cache, fake_embeddings, bank_dir, topic_index):
+    with fake_llm(latency=0):
+        bank = build(topic_index)
+    assert load_question_bank("set-1") == bank
+    checkpoint = bank_dir / "set-1.checkpoint.jsonl"
+    lines = checkpoint.read_text().splitlines()
+    assert len(lines) == 12  # 2 mark levels x 3 topics x 2 questions
+
+    # Simulate a build killed after 5 questions, halfway through writing the 6th
+    partial_line = lines[5][:20]
+    checkpoint.write_text("\n".join(lines[:5]) + "\n" + partial_line)
+    with fake_llm(latency=0):
+        resumed = build(topic_index)
+
+    resumed_lines = checkpoint.read_text().splitlines()
+    assert resumed_lines[:6] == lines[:5] + [partial_line]
+    # Only the 7 missing questions were generated again, each exactly once
+    records = [json.loads(line) for line in resumed_lines[6:]]
+    assert sorted(record["key"] for record in records) == sorted(json.loads(line)["key"] for line in lines[5:])
+    assert resumed == load_question_bank("set-1")
+    assert all(record in records + [json.loads(line) for line in lines[:5]] for record in resumed)
@@ -0,0 +1,72 @@
+"""Tests of the question selection and deduplication in src.uniqueness_filter."""
+import numpy as np
+
+import src.uniqueness_filter as uniqueness_filter
+from src.embedding_handler import normalize_embeddings
+from src.uniqueness_filter import select_diverse_indices, select_first_unique_indices, select_unique_questions
+
+# Questions with the same topic word get (nearly) the same embedding
+TOPIC_VECTORS = {"enzymes": [1, 0, 0], "membranes": [0, 1, 0], "proteins": [0, 0, 1]}
+
+
+def fake_encode_texts(texts, **kwargs):
+    return np.array([TOPIC_VECTORS[text.split()[-1].rstrip("?")] for text in texts], dtype=np.float32)
+
+
+def questions(*texts):
+    return [{"question": text, "answer": "..."} for text in texts]
+
+
+def planted_duplicates(n, dim=384, seed=0):
+    """Random unit vectors where every fifth one is a slightly perturbed copy of an earlier original."""
+    rng = np.random.default_rng(seed)
+    embeddings = normalize_embeddings(rng.standard_normal((n, dim)))
+    for i in range(5, n, 5):
+        source = rng.integers(0, i // 5) * 5 + rng.integers(1, 5)
+        embeddings[i] = normalize_embeddings(embeddings[source] + rng.standard_normal(dim) * 0.01)
+    return embeddings
+
+
+def test_lsh_bank_dedup_matches_exact_greedy_pass():
+    embeddings = planted_duplicates(1500)
+
+    kept = select_first_unique_indices(embeddings)
+
+    assert kept == sorted(select_diverse_indices(embeddings, len(embeddings)))
+    assert len(kept) == 1500 - len(range(5, 1500, 5))
+
+
+def test_small_pool_is_still_deduplicated(monkeypatch):
+    monkeypatch.setattr(uniqueness_filter, "encode_texts", fake_encode_texts)
+    pool = questions("What are enzymes?", "Define enzymes?", "What are membranes?")
+
+    # A pool no larger than n_required used to be returned unchanged; duplicates are now removed
+    selected = select_unique_questions(pool, 3)
+
+    assert [q["question"] for q in selected] == ["What are enzymes?", "What are membranes?"]
+
+
+def test_duplicates_of_accepted_questions_are_rejected_across_buckets(monkeypatch):
+    monkeypatch.setattr(uniqueness_filter, "encode_texts", fake_encode_texts)
+    _, accepted = select_unique_questions(questions("What are proteins?"), 1, return_embeddings=True)
+
+    selected = select_unique_questions(questions("Explain proteins?", "What are membranes?"), 2,
+                                       accepted_embeddings=accepted)
+
+    assert [q["question"] for q in selected] == ["What are membranes?"]
+
+
+def test_greedy_selection_keeps_original_order_and_skips_duplicates():
+    embeddings = normalize_embeddings(np.array([[1, 0, 0], [1, 0.01, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float32))
+
+    assert select_diverse_indices(embeddings, 3) == [0, 2, 3]
+    assert select_diverse_indices(embeddings, 2) == [0, 2]
+
+
+def test_mmr_trades_relevance_against_similarity_to_selected():
+    embeddings = normalize_embeddings(np.array([[1, 0, 0], [0.9, 0.43, 0], [0, 0, 1]], dtype=np.float32))
+    relevance = np.array([1.0, 0.9, 0.5], dtype=np.float32)
+
+    # Pure relevance takes the close second candidate; a diversity-leaning lambda skips it
+    assert select_diverse_indices(embeddings, 2, relevance_scores=relevance, mmr_lambda=1.0) == [0, 1]
+    assert select_diverse_indices(embeddings, 2, relevance_scores=relevance, mmr_lambda=0.3) == [0, 2]